@@ -7,8 +7,13 @@ IndexTTS HTTP API Server
 import os
 import sys
 import time
+import asyncio
+import re
+import struct
+import uuid
 import json
 import logging
+import threading
 from typing import Optional, Dict, Any
 from pathlib import Path
 
@@ -21,16 +26,23 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 sys.path.append(os.path.join(current_dir, "indextts"))
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from pydantic import ValidationError
 from pydantic import BaseModel, Field
 import uvicorn
-import torchaudio
+import numpy as np
 import torch
 from pydub import AudioSegment
 from pydub.effects import speedup
 
 from indextts.infer import IndexTTS
+from indextts.utils import audio_effects
+from indextts.utils.audio_encoder import AudioEncoder, AUDIO_FORMATS, audio_extension, audio_media_type, encode_audio
+from indextts.utils.cancellation import InferenceCancelled
+from indextts.utils.inference_worker import InferenceWorker, MicroBatchScheduler, QueueFullError, WorkerStoppedError, PRIORITY_CLASSES
+from indextts.utils.job_manager import Job, JobManager
+from indextts.utils.result_cache import FileHasher, ResultCache, copy_or_link
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -45,6 +57,44 @@ app = FastAPI(
 
 # 全局变量
 tts_model: Optional[IndexTTS] = None
+# 模型推理在独立的工作线程中串行执行, 避免阻塞事件循环
+inference_worker: Optional[InferenceWorker] = None
+# 等待中的合成请求上限, 队列满时返回 429
+MAX_QUEUE_SIZE = int(os.environ.get("INDEXTTS_MAX_QUEUE_SIZE", "8"))
+# 跨请求合并推理 (fast 模式): 收集窗口内到达的请求合并为一个 batch, 窗口为 0 时关闭 (默认), 见 API.md
+batch_scheduler: Optional[MicroBatchScheduler] = None
+BATCH_WINDOW_MS = float(os.environ.get("INDEXTTS_BATCH_WINDOW_MS", "0"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("INDEXTTS_BATCH_MAX_WAIT_MS", "200"))
+BATCH_MAX_SIZE = int(os.environ.get("INDEXTTS_BATCH_MAX_SIZE", "4"))
+# 每个 batch 的文本总长度上限 (字符数, 近似 token 数), 0 表示不限制
+BATCH_MAX_TEXT_LEN = int(os.environ.get("INDEXTTS_BATCH_MAX_TEXT_LEN", "600"))
+# 合并推理时使用 continuous batching 的 kv cache 行数 (每句占 num_beams 行), 0 表示使用分桶静态 batch
+BATCH_SLOTS = int(os.environ.get("INDEXTTS_BATCH_SLOTS", "0"))
+# 音频效果和编码在线程池中执行, 与下一个请求的推理重叠
+audio_encoder: Optional[AudioEncoder] = None
+ENCODE_WORKERS = int(os.environ.get("INDEXTTS_ENCODE_WORKERS", "2"))
+# 音频效果的实现: pydub (默认) 或 tensor (相位声码器, 音调和时长准确, 但减速和单独变调比 pydub 慢)
+EFFECTS_BACKEND = os.environ.get("INDEXTTS_EFFECTS_BACKEND", "pydub")
+# tensor 音频效果的计算设备, 为空时在编码线程中用 CPU 计算, "model" 表示模型所在的设备
+EFFECTS_DEVICE = os.environ.get("INDEXTTS_EFFECTS_DEVICE", "")
+# 合成结果缓存 (按文本、参考音频内容、生成参数、seed 和模型版本寻址), 目录为空时关闭
+result_cache: Optional[ResultCache] = None
+RESULT_CACHE_DIR = os.environ.get("INDEXTTS_RESULT_CACHE_DIR", "")
+RESULT_CACHE_MAX_MB = float(os.environ.get("INDEXTTS_RESULT_CACHE_MAX_MB", "1024"))
+RESULT_CACHE_TTL = float(os.environ.get("INDEXTTS_RESULT_CACHE_TTL", "0"))
+reference_hasher = FileHasher()
+# 异步任务: 长文本按段提交到推理线程, 段与段之间可以插入优先级更高的请求
+job_manager: Optional[JobManager] = None
+MAX_JOBS = int(os.environ.get("INDEXTTS_MAX_JOBS", "100"))
+JOB_SEGMENT_CHARS = int(os.environ.get("INDEXTTS_JOB_SEGMENT_CHARS", "300"))
+JOB_TTL = float(os.environ.get("INDEXTTS_JOB_TTL", "3600"))
+# 长文本正则化的工作进程数, 文本分段后并行正则化, 0 表示关闭
+NORMALIZE_WORKERS = int(os.environ.get("INDEXTTS_NORMALIZE_WORKERS", "0"))
+# 文本正则化和分词结果缓存: 内存中的条目数, 以及可选的 sqlite 文件 (重启后仍然有效)
+TEXT_CACHE_SIZE = int(os.environ.get("INDEXTTS_TEXT_CACHE_SIZE", "4096"))
+TEXT_CACHE_PATH = os.environ.get("INDEXTTS_TEXT_CACHE_PATH", "")
+# 等待推理结果时检查客户端是否断开的间隔 (秒), 断开后推理在下一个解码步停止
+DISCONNECT_POLL_INTERVAL = 0.2
 REFERENCE_AUDIO_DIR = "reference_audios"
 OUTPUT_DIR = "outputs/api"
 
@@ -57,11 +107,14 @@ class TTSRequest(BaseModel):
     """TTS请求模型"""
     text: str = Field(..., description="要合成的文本")
     reference_audio: str = Field(..., description="参考音频文件名（不含路径）")
-    output_format: str = Field(default="mp3", description="输出音频格式：mp3或wav")
+    output_format: str = Field(default="mp3", description="输出音频格式：mp3、wav、opus或flac")
     pitch_shift: float = Field(default=0.0, description="音调调整（半音，范围-12到12）")
     speed_rate: float = Field(default=1.0, description="语速倍率（范围0.5到2.0）")
+    speed_mode: str = Field(default="waveform", description="语速调整方式：waveform（声码后对波形做时间伸缩）或latent（声码前对GPT latent插值）")
     volume_gain: float = Field(default=0.0, description="音量增益（dB，范围-20到20）")
     infer_mode: str = Field(default="fast", description="推理模式：normal或fast")
+    seed: Optional[int] = Field(default=None, description="随机种子，指定后采样结果可复现（不参与合并推理）")
+    use_cache: bool = Field(default=True, description="开启结果缓存时，是否允许读写缓存")
     # GPT生成参数
     do_sample: bool = Field(default=True, description="是否使用采样")
     top_p: float = Field(default=0.8, description="Top-p采样参数")
@@ -70,6 +123,25 @@ class TTSRequest(BaseModel):
     repetition_penalty: float = Field(default=10.0, description="重复惩罚")
     max_mel_tokens: int = Field(default=600, description="最大mel token数")
 
+class TTSStreamRequest(BaseModel):
+    """流式TTS请求模型"""
+    text: str = Field(..., description="要合成的文本")
+    reference_audio: str = Field(..., description="参考音频文件名（不含路径）")
+    stream_format: str = Field(default="wav", description="HTTP流的音频格式：wav（流式WAV头+PCM）或pcm（16bit单声道裸PCM）")
+    max_text_tokens_per_sentence: int = Field(default=120, description="分句的最大token数，越小首包越快")
+    speed_rate: float = Field(default=1.0, description="语速倍率（范围0.5到2.0），在声码前对GPT latent插值")
+    # GPT生成参数
+    do_sample: bool = Field(default=True, description="是否使用采样")
+    top_p: float = Field(default=0.8, description="Top-p采样参数")
+    top_k: int = Field(default=30, description="Top-k采样参数")
+    temperature: float = Field(default=1.0, description="温度参数")
+    repetition_penalty: float = Field(default=10.0, description="重复惩罚")
+    max_mel_tokens: int = Field(default=600, description="最大mel token数")
+
+class TTSJobRequest(TTSRequest):
+    """异步任务请求模型"""
+    priority: str = Field(default="bulk", description="优先级：interactive、normal或bulk")
+
 class TTSResponse(BaseModel):
     """TTS响应模型"""
     success: bool
@@ -77,6 +149,7 @@ class TTSResponse(BaseModel):
     audio_url: Optional[str] = None
     duration: Optional[float] = None
     processing_time: Optional[float] = None
+    cached: bool = False
 
 def init_tts_model():
     """初始化TTS模型"""
@@ -91,100 +164,98 @@ def init_tts_model():
         logger.info("正在加载IndexTTS模型...")
         tts_model = IndexTTS(
             model_dir=model_dir,
-            cfg_path=config_path
+            cfg_path=config_path,
+            normalize_workers=NORMALIZE_WORKERS,
+            text_cache_size=TEXT_CACHE_SIZE,
+            text_cache_path=TEXT_CACHE_PATH or None
         )
+        if tts_model.document_normalizer is not None:
+            # 启动工作进程并加载正则化器, 避免第一个长文本请求等待
+            tts_model.document_normalizer.start()
+            logger.info(f"文本正则化工作进程已启动: {NORMALIZE_WORKERS}")
         logger.info("IndexTTS模型加载完成")
         
     except Exception as e:
         logger.error(f"模型加载失败: {e}")
         raise
 
-def apply_audio_effects(audio_path: str, pitch_shift: float, speed_rate: float, volume_gain: float, output_format: str = "wav") -> str:
+def apply_audio_effects(wav: np.ndarray, sampling_rate: int, pitch_shift: float, speed_rate: float, volume_gain: float):
     """
-    应用音频效果：音调、语速、音量调整，并转换为指定格式
+    在内存中应用音频效果：音调、语速、音量调整
+    wav: int16 PCM, 返回 (wav, sampling_rate)
     """
-    try:
-        # 加载音频
-        audio = AudioSegment.from_wav(audio_path)
-        
-        # 音量调整
-        if volume_gain != 0.0:
-            audio = audio + volume_gain
-        
-        # 语速调整
-        if speed_rate != 1.0:
-            # 限制语速范围
-            speed_rate = max(0.5, min(2.0, speed_rate))
-            if speed_rate > 1.0:
-                audio = speedup(audio, playback_speed=speed_rate)
-            elif speed_rate < 1.0:
-                # 减速：通过重采样实现
-                new_sample_rate = int(audio.frame_rate * speed_rate)
-                audio = audio._spawn(audio.raw_data, overrides={"frame_rate": new_sample_rate})
-                audio = audio.set_frame_rate(audio.frame_rate)
-        
-        # 音调调整（使用ffmpeg实现更好的效果）
-        if pitch_shift != 0.0:
-            # 限制音调范围
-            pitch_shift = max(-12.0, min(12.0, pitch_shift))
-            
-            # 计算音调调整比例
-            pitch_ratio = 2 ** (pitch_shift / 12.0)
-            
-            # 使用pydub的pitch shift（简单实现）
-            # 注意：这是一个简化的实现，实际项目中建议使用更专业的音频处理库
-            new_sample_rate = int(audio.frame_rate * pitch_ratio)
+    audio = AudioSegment(data=np.ascontiguousarray(wav, dtype=np.int16).tobytes(), sample_width=2,
+                         frame_rate=sampling_rate, channels=1)
+    
+    # 音量调整
+    if volume_gain != 0.0:
+        audio = audio + volume_gain
+    
+    # 语速调整
+    if speed_rate != 1.0:
+        # 限制语速范围
+        speed_rate = max(0.5, min(2.0, speed_rate))
+        if speed_rate > 1.0:
+            audio = speedup(audio, playback_speed=speed_rate)
+        elif speed_rate < 1.0:
+            # 减速：通过重采样实现
+            new_sample_rate = int(audio.frame_rate * speed_rate)
             audio = audio._spawn(audio.raw_data, overrides={"frame_rate": new_sample_rate})
-            audio = audio.set_frame_rate(22050)  # 恢复到标准采样率
-        
-        # 根据输出格式保存音频
-        if output_format.lower() == "mp3":
-            output_path = audio_path.replace('.wav', '_processed.mp3')
-            audio.export(output_path, format="mp3", bitrate="192k")
-        else:
-            output_path = audio_path.replace('.wav', '_processed.wav')
-            audio.export(output_path, format="wav")
-        
-        return output_path
-        
-    except Exception as e:
-        logger.error(f"音频效果处理失败: {e}")
-        return audio_path  # 返回原始文件
-
-def convert_audio_format(input_path: str, output_format: str) -> str:
-    """
-    转换音频格式
-    """
-    try:
-        # 加载音频
-        audio = AudioSegment.from_wav(input_path)
-        
-        # 生成输出路径
-        base_path = os.path.splitext(input_path)[0]
-        if output_format.lower() == "mp3":
-            output_path = f"{base_path}.mp3"
-            audio.export(output_path, format="mp3", bitrate="192k")
-        else:
-            output_path = f"{base_path}.wav"
-            audio.export(output_path, format="wav")
-        
-        # 删除原始WAV文件（如果转换为MP3）
-        if output_format.lower() == "mp3" and input_path != output_path:
-            try:
-                os.remove(input_path)
-            except:
-                pass
+            audio = audio.set_frame_rate(audio.frame_rate)
+    
+    # 音调调整
+    if pitch_shift != 0.0:
+        # 限制音调范围
+        pitch_shift = max(-12.0, min(12.0, pitch_shift))
         
-        return output_path
+        # 计算音调调整比例
+        pitch_ratio = 2 ** (pitch_shift / 12.0)
         
-    except Exception as e:
-        logger.error(f"音频格式转换失败: {e}")
-        return input_path
+        # 使用pydub的pitch shift（简单实现）
+        # 注意：这是一个简化的实现，实际项目中建议使用更专业的音频处理库
+        new_sample_rate = int(audio.frame_rate * pitch_ratio)
+        audio = audio._spawn(audio.raw_data, overrides={"frame_rate": new_sample_rate})
+        audio = audio.set_frame_rate(22050)  # 恢复到标准采样率
+    
+    return np.array(audio.get_array_of_samples(), dtype=np.int16), audio.frame_rate
 
 @app.on_event("startup")
 async def startup_event():
     """应用启动时初始化"""
+    global inference_worker, batch_scheduler, audio_encoder, result_cache, job_manager
     init_tts_model()
+    inference_worker = InferenceWorker(max_queue_size=MAX_QUEUE_SIZE)
+    job_manager = JobManager(inference_worker, max_jobs=MAX_JOBS, keep_finished=JOB_TTL)
+    audio_encoder = AudioEncoder(max_workers=max(1, ENCODE_WORKERS))
+    if RESULT_CACHE_DIR:
+        result_cache = ResultCache(
+            RESULT_CACHE_DIR,
+            max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+            ttl=RESULT_CACHE_TTL if RESULT_CACHE_TTL > 0 else None,
+        )
+        logger.info(f"结果缓存已开启: {RESULT_CACHE_DIR}, {result_cache.stats()['entries']} 条")
+    if BATCH_WINDOW_MS > 0 and BATCH_MAX_SIZE > 1:
+        batch_scheduler = MicroBatchScheduler(
+            inference_worker, run_synthesis_batch,
+            window=BATCH_WINDOW_MS / 1000,
+            max_wait=BATCH_MAX_WAIT_MS / 1000,
+            max_batch_size=BATCH_MAX_SIZE,
+            max_batch_cost=BATCH_MAX_TEXT_LEN if BATCH_MAX_TEXT_LEN > 0 else None,
+        )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止推理线程"""
+    if batch_scheduler is not None:
+        batch_scheduler.shutdown()
+    if inference_worker is not None:
+        inference_worker.shutdown(wait=False)
+    if audio_encoder is not None:
+        audio_encoder.shutdown(wait=False)
+    if tts_model is not None and tts_model.document_normalizer is not None:
+        tts_model.document_normalizer.close()
+    if tts_model is not None and tts_model.text_cache is not None:
+        tts_model.text_cache.close()
 
 @app.get("/")
 async def root():
@@ -194,7 +265,24 @@ async def root():
 @app.get("/health")
 async def health_check():
     """健康检查"""
-    return {"status": "healthy", "model_loaded": tts_model is not None}
+    status = {"status": "healthy", "model_loaded": tts_model is not None}
+    if tts_model is not None:
+        status["voice_cache"] = tts_model.voice_cache.stats()
+        if tts_model.text_cache is not None:
+            status["text_cache"] = tts_model.text_cache.stats()
+    if inference_worker is not None:
+        status["worker"] = inference_worker.stats()
+    if audio_encoder is not None:
+        status["encoder"] = audio_encoder.stats()
+    if result_cache is not None:
+        status["result_cache"] = result_cache.stats()
+    if job_manager is not None:
+        status["jobs"] = job_manager.stats()
+    if batch_scheduler is not None:
+        status["batching"] = batch_scheduler.stats()
+        if tts_model is not None and tts_model.last_batching_stats is not None:
+            status["batching"]["continuous_batching"] = tts_model.last_batching_stats
+    return status
 
 @app.get("/reference_audios")
 async def list_reference_audios():
@@ -236,92 +324,64 @@ async def upload_reference_audio(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
 @app.post("/synthesize", response_model=TTSResponse)
-async def synthesize_speech(request: TTSRequest):
+async def synthesize_speech(request: TTSRequest, http_request: Request):
     """
     合成语音
+    请求进入推理队列, 由工作线程执行, 事件循环不会被阻塞
+    fast 模式的并发请求会被合并到同一个 GPT batch 中推理
+    合成结果直接以 PCM 返回, 音频效果和编码在 audio_encoder 线程池中完成, 与后续请求的推理重叠
+    客户端断开后排队中的请求直接取消, 推理中的请求在下一个解码步停止
     """
-    if tts_model is None:
-        raise HTTPException(status_code=500, detail="TTS模型未加载")
-    
+    if request.speed_mode not in ["waveform", "latent"]:
+        raise HTTPException(status_code=400, detail=f"不支持的语速调整方式: {request.speed_mode}")
+    if tts_model is None or inference_worker is None or not inference_worker.is_alive():
+        raise HTTPException(status_code=503, detail="TTS模型未加载", headers={"Retry-After": "10"})
     start_time = time.time()
-    
+    cache_key = None
+    if result_cache is not None and request.use_cache:
+        try:
+            cache_key = await asyncio.to_thread(result_cache_key, request)
+        except Exception as e:
+            # 例如参考音频不存在, 交给合成流程返回错误
+            logger.warning(f"无法计算缓存key: {e}")
+        if cache_key is not None:
+            entry = result_cache.get(cache_key)
+            if entry is not None:
+                try:
+                    return cached_response(entry, start_time)
+                except OSError as e:
+                    # 缓存文件在 get() 之后被淘汰, 重新合成
+                    logger.warning(f"读取缓存文件失败, 重新合成: {e}")
+    cancel_event = threading.Event()
     try:
-        # 检查参考音频文件是否存在
-        reference_path = os.path.join(REFERENCE_AUDIO_DIR, request.reference_audio)
-        if not os.path.exists(reference_path):
-            raise HTTPException(status_code=404, detail=f"参考音频文件不存在: {request.reference_audio}")
-        
-        # 验证输出格式
-        output_format = request.output_format.lower()
-        if output_format not in ["mp3", "wav"]:
-            output_format = "mp3"  # 默认为mp3
-        
-        # 生成输出文件名（先生成WAV，后续可能转换格式）
-        timestamp = int(time.time() * 1000)
-        temp_filename = f"tts_{timestamp}.wav"
-        temp_path = os.path.join(OUTPUT_DIR, temp_filename)
-        
-        # 执行TTS合成
-        logger.info(f"开始合成语音: {request.text[:50]}...")
-        
-        generation_kwargs = {
-            "do_sample": request.do_sample,
-            "top_p": request.top_p,
-            "top_k": request.top_k,
-            "temperature": request.temperature,
-            "repetition_penalty": request.repetition_penalty,
-            "max_mel_tokens": request.max_mel_tokens
-        }
-        
-        if request.infer_mode == "fast":
-            result_path = tts_model.infer_fast(
-                audio_prompt=reference_path,
-                text=request.text,
-                output_path=temp_path,
-                **generation_kwargs
-            )
+        if batch_scheduler is not None and request.infer_mode == "fast" and request.seed is None:
+            future = batch_scheduler.submit((request, cancel_event), key=batch_key(request), cost=len(request.text))
         else:
-            result_path = tts_model.infer(
-                audio_prompt=reference_path,
-                text=request.text,
-                output_path=temp_path,
-                **generation_kwargs
-            )
-        
-        # 应用音频效果或格式转换
-        if request.pitch_shift != 0.0 or request.speed_rate != 1.0 or request.volume_gain != 0.0:
-            logger.info("应用音频效果...")
-            result_path = apply_audio_effects(
-                result_path, 
-                request.pitch_shift, 
-                request.speed_rate, 
-                request.volume_gain,
-                output_format
-            )
-        elif output_format != "wav":
-            # 如果没有音频效果但需要格式转换
-            logger.info(f"转换音频格式为: {output_format}")
-            result_path = convert_audio_format(result_path, output_format)
-        
-        # 获取音频时长
-        try:
-            audio_info = torchaudio.info(result_path)
-            duration = audio_info.num_frames / audio_info.sample_rate
-        except:
-            duration = None
-        
-        processing_time = time.time() - start_time
-        
-        logger.info(f"语音合成完成，耗时: {processing_time:.2f}秒")
-        
-        return TTSResponse(
-            success=True,
-            message="语音合成成功",
-            audio_url=f"/audio/{os.path.basename(result_path)}",
-            duration=duration,
-            processing_time=processing_time
+            future = inference_worker.submit(run_synthesis, request, cancel_event)
+    except QueueFullError as e:
+        logger.warning(f"合成请求队列已满: {e}")
+        raise HTTPException(status_code=429, detail="服务繁忙，请稍后重试",
+                            headers={"Retry-After": str(e.retry_after)})
+    except WorkerStoppedError:
+        raise HTTPException(status_code=503, detail="服务正在关闭", headers={"Retry-After": "10"})
+    try:
+        sampling_rate, wav = await wait_or_disconnect(http_request, future, cancel_event)
+        return await wait_or_disconnect(
+            http_request,
+            audio_encoder.submit(postprocess_audio, request, sampling_rate, wav, start_time, cache_key),
+            cancel_event
         )
-    
+    except ClientDisconnected:
+        logger.info(f"客户端已断开，取消合成: {request.text[:50]}...")
+        raise HTTPException(status_code=499, detail="客户端已断开")
+    except asyncio.CancelledError:
+        cancel_event.set()
+        future.cancel()
+        raise
+    except QueueFullError as e:
+        # 合并后的 batch 未能进入队列
+        raise HTTPException(status_code=429, detail="服务繁忙，请稍后重试",
+                            headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         logger.error(f"语音合成失败: {e}")
         return TTSResponse(
@@ -330,6 +390,523 @@ async def synthesize_speech(request: TTSRequest):
             processing_time=time.time() - start_time
         )
 
+class ClientDisconnected(Exception):
+    """等待推理结果时客户端断开了连接"""
+
+async def wait_or_disconnect(http_request: Request, future, cancel_event: threading.Event):
+    """
+    等待 concurrent.futures.Future 的结果, 期间每 DISCONNECT_POLL_INTERVAL 秒检查一次客户端是否断开
+    断开时设置 cancel_event (推理在下一个解码步抛出 InferenceCancelled) 并取消排队中的 future, 抛出 ClientDisconnected
+    """
+    waiter = asyncio.wrap_future(future)
+    while True:
+        done, _ = await asyncio.wait({waiter}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return waiter.result()
+        if await http_request.is_disconnected():
+            cancel_event.set()
+            # 同时取消排队中的 future
+            waiter.cancel()
+            raise ClientDisconnected()
+
+def get_generation_kwargs(request) -> Dict[str, Any]:
+    kwargs = {
+        "do_sample": request.do_sample,
+        "top_p": request.top_p,
+        "top_k": request.top_k,
+        "temperature": request.temperature,
+        "repetition_penalty": request.repetition_penalty,
+        "max_mel_tokens": request.max_mel_tokens
+    }
+    # 流式请求只支持 latent 语速调整
+    if getattr(request, "speed_mode", "latent") == "latent" and request.speed_rate != 1.0:
+        kwargs["speed_rate"] = max(0.5, min(2.0, request.speed_rate))
+    return kwargs
+
+def model_fingerprint() -> Dict[str, Any]:
+    """模型版本和权重文件的大小、修改时间, 更换模型后旧的缓存结果不会命中"""
+    fingerprint = {"version": tts_model.model_version}
+    for name in ["gpt_path", "bigvgan_path", "bpe_path"]:
+        path = getattr(tts_model, name, None)
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint[name] = (stat.st_size, stat.st_mtime_ns)
+    return fingerprint
+
+def result_cache_key(request: TTSRequest) -> str:
+    """
+    结果缓存的key: 归一化后的文本、参考音频内容的哈希、生成参数、音效和输出格式、seed、模型版本
+    """
+    reference_path = os.path.join(REFERENCE_AUDIO_DIR, request.reference_audio)
+    return ResultCache.make_key(
+        text=tts_model.tokenizer.normalize(request.text),
+        reference=reference_hasher(reference_path),
+        generation=get_generation_kwargs(request),
+        infer_mode=request.infer_mode,
+        effects=(request.pitch_shift, request.speed_rate, request.speed_mode, request.volume_gain, EFFECTS_BACKEND),
+        output_format=request.output_format.lower() if request.output_format.lower() in AUDIO_FORMATS else "mp3",
+        seed=request.seed,
+        model=model_fingerprint(),
+    )
+
+def cached_response(entry: Dict[str, Any], start_time: float) -> TTSResponse:
+    """缓存命中: 直接链接缓存文件到输出目录, 不经过模型"""
+    filename = f"tts_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}.{entry['meta']['filename'].rsplit('.', 1)[-1]}"
+    copy_or_link(entry["path"], os.path.join(OUTPUT_DIR, filename))
+    processing_time = time.time() - start_time
+    logger.info(f"结果缓存命中，耗时: {processing_time:.3f}秒")
+    return TTSResponse(
+        success=True,
+        message="语音合成成功",
+        audio_url=f"/audio/{filename}",
+        duration=entry["meta"].get("duration"),
+        processing_time=processing_time,
+        cached=True
+    )
+
+def batch_key(request: TTSRequest):
+    """生成参数相同的请求才能合并推理"""
+    return tuple(get_generation_kwargs(request).items())
+
+def run_synthesis(request: TTSRequest, cancel_event: Optional[threading.Event] = None):
+    """
+    在推理线程中执行合成, 返回 (sampling_rate, wav_data), 不落盘
+    cancel_event 设置后推理在下一个解码步停止, 抛出 InferenceCancelled
+    """
+    # 检查参考音频文件是否存在
+    reference_path = os.path.join(REFERENCE_AUDIO_DIR, request.reference_audio)
+    if not os.path.exists(reference_path):
+        raise FileNotFoundError(f"参考音频文件不存在: {request.reference_audio}")
+    
+    # 执行TTS合成
+    logger.info(f"开始合成语音: {request.text[:50]}...")
+    if request.seed is not None:
+        torch.manual_seed(request.seed)
+    
+    generation_kwargs = get_generation_kwargs(request)
+    generation_kwargs["cancel_event"] = cancel_event
+    
+    if request.infer_mode == "fast":
+        return tts_model.infer_fast(
+            audio_prompt=reference_path,
+            text=request.text,
+            output_path=None,
+            **generation_kwargs
+        )
+    else:
+        return tts_model.infer(
+            audio_prompt=reference_path,
+            text=request.text,
+            output_path=None,
+            **generation_kwargs
+        )
+
+def run_synthesis_batch(items) -> list:
+    """
+    在推理线程中合并推理多个请求 (生成参数相同), items 为 (request, cancel_event)
+    返回每个请求的 (sampling_rate, wav_data), 失败或已取消的请求对应一个 Exception
+    已取消请求的句子不再占用 batch, 所有请求都取消时整个 batch 停止
+    """
+    requests = [request for request, _ in items]
+    cancel_events = [cancel_event for _, cancel_event in items]
+    results = [None] * len(requests)
+    batch = []
+    for i, request in enumerate(requests):
+        reference_path = os.path.join(REFERENCE_AUDIO_DIR, request.reference_audio)
+        if cancel_events[i].is_set():
+            results[i] = InferenceCancelled("inference cancelled")
+        elif not os.path.exists(reference_path):
+            results[i] = FileNotFoundError(f"参考音频文件不存在: {request.reference_audio}")
+        else:
+            batch.append((i, reference_path))
+    if len(batch) > 0:
+        logger.info(f"开始合并合成语音, 请求数: {len(batch)}")
+        try:
+            outputs = tts_model.infer_batch(
+                audio_prompts=[reference_path for _, reference_path in batch],
+                texts=[requests[i].text for i, _ in batch],
+                output_paths=None,
+                sentences_bucket_max_size=max(4, BATCH_MAX_SIZE),
+                max_batch_slots=BATCH_SLOTS or None,
+                cancel_events=[cancel_events[i] for i, _ in batch],
+                **get_generation_kwargs(requests[batch[0][0]])
+            )
+        except Exception as e:
+            logger.error(f"语音合成失败: {e}")
+            outputs = [e] * len(batch)
+        for (i, _), output in zip(batch, outputs):
+            results[i] = output if output is not None else InferenceCancelled("inference cancelled")
+    return results
+
+def postprocess_audio(request: TTSRequest, sampling_rate: int, wav: np.ndarray, start_time: float,
+                      cache_key: Optional[str] = None) -> TTSResponse:
+    """
+    在内存中应用音频效果并编码为目标格式, 只写一次最终文件, 生成响应
+    指定 cache_key 时编码结果写入结果缓存, 输出文件链接到缓存文件
+    """
+    # 验证输出格式
+    output_format = request.output_format.lower()
+    if output_format not in AUDIO_FORMATS:
+        output_format = "mp3"  # 默认为mp3
+    
+    wav = np.asarray(wav).reshape(-1)
+    # 应用音频效果, latent 模式的语速已在声码前调整
+    speed_rate = request.speed_rate if request.speed_mode == "waveform" else 1.0
+    if request.pitch_shift != 0.0 or speed_rate != 1.0 or request.volume_gain != 0.0:
+        logger.info("应用音频效果...")
+        if EFFECTS_BACKEND == "tensor":
+            # 相位声码器变速、重采样变调、增益, 采样率不变
+            device = None
+            if EFFECTS_DEVICE:
+                device = tts_model.device if EFFECTS_DEVICE == "model" else EFFECTS_DEVICE
+            wav = audio_effects.apply_audio_effects(
+                torch.from_numpy(wav),
+                pitch_shift_steps=max(-12.0, min(12.0, request.pitch_shift)),
+                speed_rate=max(0.5, min(2.0, speed_rate)),
+                volume_gain=request.volume_gain,
+                device=device
+            ).numpy()
+        else:
+            wav, sampling_rate = apply_audio_effects(
+                wav,
+                sampling_rate,
+                request.pitch_shift,
+                speed_rate,
+                request.volume_gain
+            )
+    
+    data = encode_audio(wav, sampling_rate, output_format)
+    duration = len(wav) / sampling_rate
+    filename = f"tts_{int(time.time() * 1000)}_{uuid.uuid4().hex[:8]}.{audio_extension(output_format)}"
+    if cache_key is not None:
+        cache_path = result_cache.put(cache_key, data, audio_extension(output_format),
+                                      duration=duration, sampling_rate=sampling_rate)
+        copy_or_link(cache_path, os.path.join(OUTPUT_DIR, filename))
+    else:
+        with open(os.path.join(OUTPUT_DIR, filename), "wb") as f:
+            f.write(data)
+    processing_time = time.time() - start_time
+    
+    logger.info(f"语音合成完成，耗时: {processing_time:.2f}秒")
+    
+    return TTSResponse(
+        success=True,
+        message="语音合成成功",
+        audio_url=f"/audio/{filename}",
+        duration=duration,
+        processing_time=processing_time
+    )
+
+def split_text_segments(text: str, max_chars: int) -> list:
+    """
+    按句末标点把长文本切成不超过 max_chars 个字符的段 (单句超长时单独成段), max_chars <= 0 时不切分
+    """
+    if max_chars <= 0:
+        return [text]
+    sentences = [s for s in re.split(r"(?<=[。！？；.!?;\n])", text) if s.strip()]
+    segments = []
+    current = ""
+    for sentence in sentences:
+        if current and len(current) + len(sentence) > max_chars:
+            segments.append(current)
+            current = ""
+        current += sentence
+    if current.strip():
+        segments.append(current)
+    return segments or [text]
+
+def job_steps(job: Job, request: TTSJobRequest):
+    """
+    异步任务的执行步骤, 每段文本是推理线程中的一步, 最后在 audio_encoder 中做音效和编码
+    进度复用 infer_fast / infer 通过 gr_progress 上报的进度
+    取消任务时 job.cancel_event 被设置, 当前段的推理在下一个解码步停止
+    """
+    start_time = time.time()
+    reference_path = os.path.join(REFERENCE_AUDIO_DIR, request.reference_audio)
+    if not os.path.exists(reference_path):
+        raise FileNotFoundError(f"参考音频文件不存在: {request.reference_audio}")
+    cache_key = None
+    if result_cache is not None and request.use_cache:
+        cache_key = result_cache_key(request)
+        entry = result_cache.get(cache_key)
+        if entry is not None:
+            try:
+                return cached_response(entry, start_time).dict()
+            except OSError as e:
+                logger.warning(f"读取缓存文件失败, 重新合成: {e}")
+    segments = split_text_segments(request.text, JOB_SEGMENT_CHARS)
+    logger.info(f"任务 {job.id} 开始合成, 共 {len(segments)} 段")
+    infer = tts_model.infer_fast if request.infer_mode == "fast" else tts_model.infer
+    sampling_rate, wavs = 24000, []
+    for i, segment in enumerate(segments):
+        if request.seed is not None:
+            # 段之间推理线程会执行其他请求并消耗全局随机数, 每段重新设置种子, 结果只取决于 seed
+            torch.manual_seed(request.seed + i)
+        def report(value, desc=None, i=i):
+            job.set_progress((i + value) / len(segments), f"segment {i + 1}/{len(segments)}: {desc}")
+        tts_model.gr_progress = report
+        try:
+            sampling_rate, wav = infer(
+                audio_prompt=reference_path,
+                text=segment,
+                output_path=None,
+                cancel_event=job.cancel_event,
+                **get_generation_kwargs(request)
+            )
+        finally:
+            tts_model.gr_progress = None
+        wavs.append(np.asarray(wav).reshape(-1))
+        job.set_progress((i + 1) / len(segments), f"segment {i + 1}/{len(segments)} done")
+        # 让出推理线程, 优先级更高的请求可以在段之间执行
+        yield
+    job.set_progress(1.0, "encoding")
+    wav = np.concatenate(wavs)
+    return audio_encoder.submit(lambda: postprocess_audio(request, sampling_rate, wav, start_time, cache_key).dict())
+
+def job_status(job: Job) -> Dict[str, Any]:
+    status = job.to_dict()
+    if job.status == "queued":
+        status["queue_position"] = job_manager.queue_position(job.id)
+    return status
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: TTSJobRequest):
+    """
+    提交异步合成任务, 立即返回任务 id, 通过 GET /jobs/{job_id} 查询进度和结果
+    """
+    if request.priority not in PRIORITY_CLASSES:
+        raise HTTPException(status_code=400, detail=f"不支持的优先级: {request.priority}")
+    if request.speed_mode not in ["waveform", "latent"]:
+        raise HTTPException(status_code=400, detail=f"不支持的语速调整方式: {request.speed_mode}")
+    if tts_model is None or job_manager is None or not inference_worker.is_alive():
+        raise HTTPException(status_code=503, detail="TTS模型未加载", headers={"Retry-After": "10"})
+    if not os.path.exists(os.path.join(REFERENCE_AUDIO_DIR, request.reference_audio)):
+        raise HTTPException(status_code=404, detail=f"参考音频文件不存在: {request.reference_audio}")
+    try:
+        job = job_manager.submit(lambda job: job_steps(job, request),
+                                 priority=PRIORITY_CLASSES[request.priority], priority_class=request.priority)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail="任务过多，请稍后重试", headers={"Retry-After": str(e.retry_after)})
+    except WorkerStoppedError:
+        raise HTTPException(status_code=503, detail="服务正在关闭", headers={"Retry-After": "10"})
+    logger.info(f"已提交任务 {job.id}: {request.text[:50]}...")
+    return {**job_status(job), "status_url": f"/jobs/{job.id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询任务状态、进度和结果"""
+    job = job_manager.get(job_id) if job_manager is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job_status(job)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """取消任务: 排队中的任务立即取消, 执行中的任务在下一个解码步停止"""
+    job = job_manager.cancel(job_id) if job_manager is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job_status(job)
+
+def wav_stream_header(sample_rate: int, channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """
+    流式WAV文件头: 总长度未知, RIFF 和 data 的长度字段填 0xFFFFFFFF, 播放器会一直读到流结束
+    """
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+def start_stream(request: TTSStreamRequest, cancel_event: threading.Event):
+    """
+    把 `IndexTTS.infer_stream` 放到推理线程中执行, 每句音频合成后通过 asyncio.Queue 交给事件循环
+    队列已满时抛出 HTTPException(429), 返回异步生成器, 依次产出每句的 chunk dict
+    调用方在客户端断开时设置 cancel_event, 推理在下一个解码步停止
+    """
+    if tts_model is None or inference_worker is None or not inference_worker.is_alive():
+        raise HTTPException(status_code=503, detail="TTS模型未加载", headers={"Retry-After": "10"})
+    reference_path = os.path.join(REFERENCE_AUDIO_DIR, request.reference_audio)
+    if not os.path.exists(reference_path):
+        raise HTTPException(status_code=404, detail=f"参考音频文件不存在: {request.reference_audio}")
+    loop = asyncio.get_running_loop()
+    chunks: asyncio.Queue = asyncio.Queue()
+    end = object()
+
+    def produce():
+        try:
+            for chunk in tts_model.infer_stream(
+                audio_prompt=reference_path,
+                text=request.text,
+                max_text_tokens_per_sentence=request.max_text_tokens_per_sentence,
+                cancel_event=cancel_event,
+                **get_generation_kwargs(request)
+            ):
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        except InferenceCancelled:
+            logger.info("客户端已断开，流式合成已停止")
+        except Exception as e:
+            logger.error(f"流式合成失败: {e}")
+            loop.call_soon_threadsafe(chunks.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, end)
+
+    try:
+        future = inference_worker.submit(produce)
+    except QueueFullError as e:
+        logger.warning(f"合成请求队列已满: {e}")
+        raise HTTPException(status_code=429, detail="服务繁忙，请稍后重试",
+                            headers={"Retry-After": str(e.retry_after)})
+    except WorkerStoppedError:
+        raise HTTPException(status_code=503, detail="服务正在关闭", headers={"Retry-After": "10"})
+
+    async def iterate():
+        try:
+            while True:
+                item = await chunks.get()
+                if item is end:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # 排队中的推理直接取消
+            if cancel_event.is_set():
+                future.cancel()
+    return iterate()
+
+@app.post("/synthesize/stream")
+async def synthesize_speech_stream(request: TTSStreamRequest, http_request: Request):
+    """
+    流式合成语音: 每句合成后立即以一个 HTTP chunk 发送, 不落盘
+    wav 格式先发送流式WAV头, pcm 格式为 16bit 单声道小端裸PCM, 采样率见 X-Sample-Rate 响应头
+    客户端断开后推理在下一个解码步停止
+    """
+    stream_format = request.stream_format.lower()
+    if stream_format not in ["wav", "pcm"]:
+        raise HTTPException(status_code=400, detail=f"不支持的流格式: {request.stream_format}")
+    logger.info(f"开始流式合成语音: {request.text[:50]}...")
+    cancel_event = threading.Event()
+    chunks = start_stream(request, cancel_event)
+    sample_rate = 24000
+
+    async def body():
+        # 发送失败时才能发现断开, 等待下一句的过程中另外轮询连接状态
+        watcher = asyncio.create_task(watch_disconnect(http_request, cancel_event))
+        try:
+            if stream_format == "wav":
+                yield wav_stream_header(sample_rate)
+            async for chunk in chunks:
+                yield chunk["wav"].tobytes()
+        except Exception:
+            # 响应头已发送, 只能中断连接
+            return
+        finally:
+            cancel_event.set()
+            watcher.cancel()
+            await chunks.aclose()
+
+    media_type = "audio/wav" if stream_format == "wav" else f"audio/L16;rate={sample_rate};channels=1"
+    return StreamingResponse(body(), media_type=media_type, headers={"X-Sample-Rate": str(sample_rate)})
+
+async def watch_disconnect(http_request: Request, cancel_event: threading.Event):
+    """客户端断开时设置 cancel_event"""
+    while not cancel_event.is_set():
+        if await http_request.is_disconnected():
+            logger.info("客户端已断开，停止流式合成")
+            cancel_event.set()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+@app.websocket("/ws/synthesize")
+async def synthesize_speech_ws(websocket: WebSocket):
+    """
+    WebSocket 流式合成: 客户端发送 TTSStreamRequest 的 JSON, 服务端对每句先发送一条 JSON 文本消息
+    ``{"type": "chunk", ...}``, 紧接着发送该句的 16bit 单声道裸PCM 二进制消息, 最后发送 ``{"type": "done", ...}`` 汇总
+    同一连接可以依次发送多个请求, 出错时发送 ``{"type": "error", ...}``
+    客户端消息在后台持续接收, 合成过程中连接断开时推理在下一个解码步停止
+    """
+    await websocket.accept()
+    messages: asyncio.Queue = asyncio.Queue()
+    current = {"cancel_event": None}
+
+    async def receive_messages():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                if current["cancel_event"] is not None:
+                    current["cancel_event"].set()
+                await messages.put(None)
+                return
+            await messages.put(message)
+
+    receiver = asyncio.create_task(receive_messages())
+    try:
+        while True:
+            message = await messages.get()
+            if message is None:
+                raise WebSocketDisconnect()
+            try:
+                request = TTSStreamRequest(**json.loads(message.get("text") or message.get("bytes") or ""))
+            except (ValidationError, ValueError, TypeError) as e:
+                await websocket.send_json({"type": "error", "status_code": 400, "message": f"请求格式错误: {e}"})
+                continue
+            start_time = time.time()
+            cancel_event = threading.Event()
+            try:
+                chunks = start_stream(request, cancel_event)
+            except HTTPException as e:
+                message = {"type": "error", "status_code": e.status_code, "message": e.detail}
+                if e.headers and "Retry-After" in e.headers:
+                    message["retry_after"] = int(e.headers["Retry-After"])
+                await websocket.send_json(message)
+                continue
+            current["cancel_event"] = cancel_event
+            num_chunks = 0
+            audio_duration = 0.0
+            first_chunk_latency = None
+            try:
+                async for chunk in chunks:
+                    if first_chunk_latency is None:
+                        first_chunk_latency = time.time() - start_time
+                    await websocket.send_json({
+                        "type": "chunk",
+                        "index": chunk["index"],
+                        "total": chunk["total"],
+                        "sample_rate": chunk["sampling_rate"],
+                        "samples": int(chunk["wav"].shape[-1]),
+                        "audio_duration": chunk["audio_duration"],
+                        "elapsed": chunk["elapsed"],
+                    })
+                    await websocket.send_bytes(chunk["wav"].tobytes())
+                    num_chunks += 1
+                    audio_duration += chunk["audio_duration"]
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                await websocket.send_json({"type": "error", "status_code": 500, "message": f"语音合成失败: {str(e)}"})
+                continue
+            finally:
+                cancel_event.set()
+                current["cancel_event"] = None
+                await chunks.aclose()
+            if receiver.done():
+                # 合成过程中连接已断开
+                raise WebSocketDisconnect()
+            await websocket.send_json({
+                "type": "done",
+                "chunks": num_chunks,
+                "audio_duration": round(audio_duration, 3),
+                "first_chunk_latency": first_chunk_latency,
+                "processing_time": time.time() - start_time,
+            })
+    except WebSocketDisconnect:
+        logger.info("WebSocket 连接已断开")
+    finally:
+        receiver.cancel()
+
 @app.get("/audio/{filename}")
 async def get_audio_file(filename: str):
     """获取生成的音频文件"""
@@ -337,17 +914,9 @@ async def get_audio_file(filename: str):
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="音频文件不存在")
     
-    # 根据文件扩展名确定媒体类型
-    if filename.lower().endswith('.mp3'):
-        media_type = "audio/mpeg"
-    elif filename.lower().endswith('.wav'):
-        media_type = "audio/wav"
-    else:
-        media_type = "audio/wav"  # 默认为wav
-    
     return FileResponse(
         file_path,
-        media_type=media_type,
+        media_type=audio_media_type(filename),
         filename=filename
     )
 
@@ -371,8 +940,45 @@ if __name__ == "__main__":
     parser.add_argument("--host", default="0.0.0.0", help="服务器地址")
     parser.add_argument("--port", type=int, default=8000, help="服务器端口")
     parser.add_argument("--reload", action="store_true", help="开发模式，自动重载")
+    parser.add_argument("--max-queue-size", type=int, default=MAX_QUEUE_SIZE, help="等待中的合成请求上限，超出返回429")
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS, help="合并推理的收集窗口(毫秒)，0表示关闭（默认），如20开启")
+    parser.add_argument("--batch-max-wait-ms", type=float, default=BATCH_MAX_WAIT_MS, help="请求在合并窗口中的最长等待时间(毫秒)")
+    parser.add_argument("--batch-max-size", type=int, default=BATCH_MAX_SIZE, help="每次合并推理的最大请求数")
+    parser.add_argument("--batch-slots", type=int, default=BATCH_SLOTS, help="合并推理使用continuous batching的kv cache行数，0表示关闭")
+    parser.add_argument("--encode-workers", type=int, default=ENCODE_WORKERS, help="音频效果和编码线程数")
+    parser.add_argument("--max-jobs", type=int, default=MAX_JOBS, help="未完成的异步任务数上限")
+    parser.add_argument("--job-segment-chars", type=int, default=JOB_SEGMENT_CHARS, help="异步任务按段推理的每段字符数，0表示不分段")
+    parser.add_argument("--job-ttl", type=float, default=JOB_TTL, help="已完成任务的保留时间(秒)")
+    parser.add_argument("--effects-backend", default=EFFECTS_BACKEND, choices=["pydub", "tensor"], help="音频效果的实现，tensor为相位声码器（音调和时长准确）")
+    parser.add_argument("--effects-device", default=EFFECTS_DEVICE, help="tensor音频效果的计算设备，如cuda:0，model表示模型所在设备，为空时使用CPU")
+    parser.add_argument("--result-cache-dir", default=RESULT_CACHE_DIR, help="合成结果缓存目录，为空表示关闭")
+    parser.add_argument("--result-cache-max-mb", type=float, default=RESULT_CACHE_MAX_MB, help="结果缓存的容量上限(MB)")
+    parser.add_argument("--result-cache-ttl", type=float, default=RESULT_CACHE_TTL, help="结果缓存的过期时间(秒)，0表示不过期")
+    parser.add_argument("--normalize-workers", type=int, default=NORMALIZE_WORKERS, help="长文本并行正则化的进程数，0表示关闭")
+    parser.add_argument("--text-cache-size", type=int, default=TEXT_CACHE_SIZE, help="文本正则化和分词缓存的内存条目数，0表示关闭")
+    parser.add_argument("--text-cache-path", default=TEXT_CACHE_PATH, help="文本缓存的sqlite文件，重启后仍然有效，为空表示只在内存中缓存")
+    parser.add_argument("--batch-max-text-len", type=int, default=BATCH_MAX_TEXT_LEN, help="每次合并推理的文本总长度上限，0表示不限制")
     
     args = parser.parse_args()
+    # uvicorn 会重新导入 api_server 模块, 通过环境变量传递配置
+    os.environ["INDEXTTS_MAX_QUEUE_SIZE"] = str(args.max_queue_size)
+    os.environ["INDEXTTS_BATCH_WINDOW_MS"] = str(args.batch_window_ms)
+    os.environ["INDEXTTS_BATCH_MAX_WAIT_MS"] = str(args.batch_max_wait_ms)
+    os.environ["INDEXTTS_BATCH_MAX_SIZE"] = str(args.batch_max_size)
+    os.environ["INDEXTTS_BATCH_MAX_TEXT_LEN"] = str(args.batch_max_text_len)
+    os.environ["INDEXTTS_BATCH_SLOTS"] = str(args.batch_slots)
+    os.environ["INDEXTTS_ENCODE_WORKERS"] = str(args.encode_workers)
+    os.environ["INDEXTTS_EFFECTS_BACKEND"] = args.effects_backend
+    os.environ["INDEXTTS_EFFECTS_DEVICE"] = args.effects_device
+    os.environ["INDEXTTS_MAX_JOBS"] = str(args.max_jobs)
+    os.environ["INDEXTTS_JOB_SEGMENT_CHARS"] = str(args.job_segment_chars)
+    os.environ["INDEXTTS_JOB_TTL"] = str(args.job_ttl)
+    os.environ["INDEXTTS_RESULT_CACHE_DIR"] = args.result_cache_dir
+    os.environ["INDEXTTS_RESULT_CACHE_MAX_MB"] = str(args.result_cache_max_mb)
+    os.environ["INDEXTTS_RESULT_CACHE_TTL"] = str(args.result_cache_ttl)
+    os.environ["INDEXTTS_NORMALIZE_WORKERS"] = str(args.normalize_workers)
+    os.environ["INDEXTTS_TEXT_CACHE_SIZE"] = str(args.text_cache_size)
+    os.environ["INDEXTTS_TEXT_CACHE_PATH"] = args.text_cache_path
     
     uvicorn.run(
         "api_server:app",
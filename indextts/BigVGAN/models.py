@@ -198,8 +198,27 @@ class BigVGAN(torch.nn.Module):
 
         # self.logit_scale = nn.Parameter(torch.ones([]) * np.log(1 / 0.07))
 
-    def forward(self, x, mel_ref, lens=None):
-        speaker_embedding = self.speaker_encoder(mel_ref, lens)
+    def get_speaker_embedding(self, mel_ref, lens=None):
+        """
+        Args:
+            mel_ref: (b, frames, n_mels) reference mel spectrogram
+            lens: relative lengths of the reference mels in shape (b,)
+        Returns:
+            speaker_embedding: (b, 1, speaker_embedding_dim)
+        """
+        return self.speaker_encoder(mel_ref, lens)
+
+    def forward(self, x, mel_ref=None, lens=None, speaker_embedding=None):
+        """
+        Args:
+            x: (b, T, dim) gpt latents
+            mel_ref: (b, frames, n_mels) reference mel spectrogram, ignored if ``speaker_embedding`` is given
+            lens: relative lengths of the reference mels in shape (b,)
+            speaker_embedding: (b, 1, speaker_embedding_dim) precomputed `get_speaker_embedding()` output,
+                skips the ECAPA-TDNN speaker encoder
+        """
+        if speaker_embedding is None:
+            speaker_embedding = self.get_speaker_embedding(mel_ref, lens)
         n_batch = x.size(0)
         contrastive_loss = None
         if n_batch * 2 == speaker_embedding.size(0):
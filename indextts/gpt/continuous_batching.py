@@ -0,0 +1,554 @@
+"""
+Iteration-level (continuous) batching of mel-token generation.
+
+With bucketed static batching, a batch runs until its longest sentence emits the stop token: finished rows keep
+being computed and queued sentences wait for the whole batch. `ContinuousBatchingEngine` schedules at every decoding
+step instead: finished sequences leave the KV cache right away and queued sentences (of any request or voice, each
+with its own conditioning latent) are prefilled into the free slots.
+
+Each sentence occupies ``num_beams`` slots (rows) of a shared KV cache. The rows of the running sentences are kept
+contiguous, so a decoding step works on views of the cache without any gather. The sampling has the same semantics
+as `GPT2InferenceModel.generate()` (`transformers==4.36`): greedy search, multinomial sampling, beam search and
+beam sampling, with repetition penalty, temperature, top-k and top-p.
+"""
+import copy
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import torch
+import torch.nn.functional as F
+from transformers import BeamSearchScorer
+
+from indextts.utils.cancellation import check_cancelled
+
+
+def apply_repetition_penalty(scores: torch.Tensor, seen: torch.Tensor, penalty: float) -> torch.Tensor:
+    """
+    Same as `RepetitionPenaltyLogitsProcessor`, with the tokens of ``input_ids`` kept as a (batch, vocab) mask.
+    """
+    penalized = torch.where(scores < 0, scores * penalty, scores / penalty)
+    return torch.where(seen, penalized, scores)
+
+
+def warp_scores(scores: torch.Tensor, temperature=None, top_k=None, top_p=None, min_tokens_to_keep=1) -> torch.Tensor:
+    """
+    Same as `TemperatureLogitsWarper`, `TopKLogitsWarper` and `TopPLogitsWarper` applied in that order.
+    """
+    if temperature is not None and temperature != 1.0:
+        scores = scores / temperature
+    if top_k is not None and top_k != 0:
+        top_k = min(max(top_k, min_tokens_to_keep), scores.size(-1))
+        indices_to_remove = scores < torch.topk(scores, top_k)[0][..., -1, None]
+        scores = scores.masked_fill(indices_to_remove, -float("inf"))
+    if top_p is not None and top_p < 1.0:
+        sorted_logits, sorted_indices = torch.sort(scores, descending=False)
+        cumulative_probs = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        sorted_indices_to_remove = cumulative_probs <= (1 - float(top_p))
+        sorted_indices_to_remove[..., -min_tokens_to_keep:] = 0
+        indices_to_remove = sorted_indices_to_remove.scatter(1, sorted_indices, sorted_indices_to_remove)
+        scores = scores.masked_fill(indices_to_remove, -float("inf"))
+    return scores
+
+
+class _Sequence:
+    """
+    One sentence in the engine: its prompt, generated tokens and, for beam search, its own `BeamSearchScorer`.
+    """
+
+    def __init__(self, seq_id: int, text_tokens: torch.Tensor, conds_latent: torch.Tensor):
+        self.seq_id = seq_id
+        self.text_tokens = text_tokens
+        self.conds_latent = conds_latent
+        # first row in the kv cache, -1 while queued
+        self.row = -1
+        self.tokens: Optional[torch.Tensor] = None  # (num_beams, max_generate_length)
+        self.num_generated = 0
+        self.beam_scorer: Optional[BeamSearchScorer] = None
+        self.codes: Optional[torch.Tensor] = None
+
+
+class ContinuousBatchingEngine:
+    """
+    Usage:
+    ```
+    engine = ContinuousBatchingEngine(gpt, max_batch_slots=16, max_generate_length=600, do_sample=True, num_beams=3)
+    seq_id = engine.add_request(text_tokens, conds_latent)
+    results = engine.run()  # {seq_id: codes (1, T)}
+    print(engine.stats())
+    ```
+    `step()` can also be called directly, e.g. to keep adding requests while generating.
+    """
+
+    SUPPORTED_KWARGS = {
+        "do_sample", "num_beams", "num_return_sequences", "temperature", "top_k", "top_p",
+        "repetition_penalty", "length_penalty", "early_stopping",
+    }
+
+    def __init__(self, gpt, max_batch_slots: int = 16, max_generate_length: int = None, max_text_tokens: int = None,
+                 max_step_stats: int = 1000, **generate_kwargs):
+        """
+        Args:
+            gpt: `UnifiedVoice` after `post_init_gpt2_config()`
+            max_batch_slots: number of kv cache rows, a sentence takes ``num_beams`` rows
+            max_generate_length: limit the number of generated tokens, defaults to ``gpt.max_mel_tokens - 1``
+            max_text_tokens: the longest sentence accepted by `add_request()`, defaults to ``gpt.max_text_tokens``.
+                The kv cache is allocated once for the longest prompt plus ``max_generate_length``, set it to the
+                longest queued sentence to save memory.
+            max_step_stats: number of recent steps kept by `step_stats()`
+            generate_kwargs: see `SUPPORTED_KWARGS`, unset ones default to ``generation_config``, as `generate()`
+        """
+        unsupported = set(generate_kwargs) - self.SUPPORTED_KWARGS
+        if unsupported:
+            raise ValueError(f"unsupported generation kwargs: {sorted(unsupported)}")
+        self.gpt = gpt
+        self.model = gpt.inference_model
+        self.transformer = self.model.transformer
+        transformer_config = self.transformer.config
+        self.num_layers = transformer_config.n_layer
+        self.num_heads = transformer_config.n_head
+        self.head_dim = transformer_config.n_embd // transformer_config.n_head
+        self.stop_mel_token = gpt.stop_mel_token
+
+        config = copy.deepcopy(self.model.generation_config)
+        config.update(**generate_kwargs)
+        if config.num_return_sequences > 1:
+            raise ValueError("ContinuousBatchingEngine returns one sequence per sentence, "
+                             f"got num_return_sequences={config.num_return_sequences}")
+        self.config = config
+        self.num_beams = config.num_beams or 1
+        if max_batch_slots < self.num_beams:
+            raise ValueError(f"max_batch_slots ({max_batch_slots}) must be >= num_beams ({self.num_beams})")
+        self.max_batch_slots = max_batch_slots
+        self.max_generate_length = max_generate_length if max_generate_length is not None else gpt.max_mel_tokens - 1
+        self.max_text_tokens = max_text_tokens if max_text_tokens is not None else gpt.max_text_tokens
+        # [conditioning latents][start_text][text][stop_text][start_mel], see `UnifiedVoice.prepare_gpt_inputs()`
+        self.max_prompt_len = gpt.cond_num + self.max_text_tokens + 3
+        self.max_len = self.max_prompt_len + self.max_generate_length
+
+        self._next_id = 0
+        self._queue: Deque[_Sequence] = deque()
+        # running sequences in row order, their rows are [0, num_rows)
+        self._running: List[_Sequence] = []
+        self._finished: Dict[int, torch.Tensor] = {}
+        # all the buffers are allocated once for the longest sequence, the kv cache is never resized while generating
+        dtype, device = self.transformer.dtype, self.transformer.device
+        vocab_size = gpt.number_mel_codes
+        # kv cache (layers, slots, heads, max_len, head_dim)
+        cache_shape = (self.num_layers, max_batch_slots, self.num_heads, self.max_len, self.head_dim)
+        self.key = torch.zeros(cache_shape, dtype=dtype, device=device)
+        self.value = torch.zeros(cache_shape, dtype=dtype, device=device)
+        self._valid = torch.zeros((max_batch_slots, self.max_len), dtype=torch.bool, device=device)  # positions to attend
+        self._lens = torch.zeros(max_batch_slots, dtype=torch.long, device=device)  # next write position
+        self._seen = torch.zeros((max_batch_slots, vocab_size), dtype=torch.bool, device=device)  # for the repetition penalty
+        self._logits = torch.zeros((max_batch_slots, vocab_size), dtype=dtype, device=device)  # logits of the next token
+        self._last_tokens = torch.zeros(max_batch_slots, dtype=torch.long, device=device)
+        self._steps_generated = torch.zeros(max_batch_slots, dtype=torch.long, device=device)  # generated tokens fed so far
+        self._beam_scores = torch.zeros(max_batch_slots, dtype=torch.float, device=device)  # for beam search
+
+        self.max_step_stats = max_step_stats
+        self._step_stats: Deque[Dict] = deque(maxlen=max_step_stats)
+        self._totals = {
+            "steps": 0, "admitted": 0, "finished": 0, "cancelled": 0, "generated_tokens": 0, "prefill_tokens": 0,
+            "busy_rows": 0, "prefill_time": 0.0, "decode_time": 0.0,
+        }
+
+    @property
+    def num_rows(self) -> int:
+        return len(self._running) * self.num_beams
+
+    def add_request(self, text_tokens: torch.Tensor, conds_latent: torch.Tensor) -> int:
+        """
+        Queue a sentence.
+        Args:
+            text_tokens: (L,) or (1, L) text token ids, without padding
+            conds_latent: (1, 32, dim) `UnifiedVoice.get_conditioning()` output of its reference audio
+        Returns:
+            the id of the sentence in the results of `step()` / `run()`
+        """
+        if text_tokens.ndim == 2:
+            text_tokens = text_tokens.squeeze(0)
+        if text_tokens.shape[0] > self.max_text_tokens or conds_latent.shape[1] > self.gpt.cond_num:
+            raise ValueError(f"the sentence ({text_tokens.shape[0]} text tokens, {conds_latent.shape[1]} conditioning "
+                             f"latents) exceeds the kv cache of the engine (max_text_tokens={self.max_text_tokens}, "
+                             f"cond_num={self.gpt.cond_num})")
+        seq = _Sequence(self._next_id, text_tokens, conds_latent)
+        self._next_id += 1
+        self._queue.append(seq)
+        return seq.seq_id
+
+    def has_unfinished(self) -> bool:
+        return len(self._queue) > 0 or len(self._running) > 0
+
+    def cancel(self, seq_ids) -> int:
+        """
+        Drop queued or running sentences, e.g. of a cancelled request; the rows of running ones are freed
+        right away and reused from the next `step()`. Returns the number of sentences dropped.
+        """
+        seq_ids = set(seq_ids)
+        queued = [seq for seq in self._queue if seq.seq_id in seq_ids]
+        for seq in queued:
+            self._queue.remove(seq)
+        running = [seq for seq in self._running if seq.seq_id in seq_ids]
+        self._evict(running)
+        for seq_id in seq_ids:
+            self._finished.pop(seq_id, None)
+        self._totals["cancelled"] += len(queued) + len(running)
+        return len(queued) + len(running)
+
+    def run(self, cancel_event=None) -> Dict[int, torch.Tensor]:
+        """
+        Step until all the queued sentences are generated, returns ``{seq_id: codes (1, T)}``.
+        ``cancel_event`` is checked before every step, raises `InferenceCancelled` once set.
+        """
+        while self.has_unfinished():
+            check_cancelled(cancel_event)
+            self.step()
+        finished, self._finished = self._finished, {}
+        return finished
+
+    def pop_finished(self) -> Dict[int, torch.Tensor]:
+        finished, self._finished = self._finished, {}
+        return finished
+
+    @torch.no_grad()
+    def step(self) -> List[int]:
+        """
+        One scheduling iteration:
+            1. admit queued sentences into the free slots and prefill them
+            2. pick the next token of every running sentence
+            3. evict the finished sentences and compact the rows
+            4. decode one position for the remaining rows
+        Returns:
+            the ids of the sentences finished in this step, their codes are kept until `run()` / `pop_finished()`
+        """
+        stats = {"step": self._totals["steps"]}
+        start_time = time.perf_counter()
+        admitted = self._admit()
+        prefill_time = time.perf_counter() - start_time
+        stats["admitted"] = len(admitted)
+        stats["running"] = len(self._running)
+        stats["busy_rows"] = self.num_rows
+        stats["utilization"] = round(self.num_rows / self.max_batch_slots, 4)
+        stats["queued"] = len(self._queue)
+        if len(self._running) == 0:
+            return []
+
+        start_time = time.perf_counter()
+        finished = self._select_tokens()
+        self._totals["generated_tokens"] += len(self._running)
+        for seq in finished:
+            self._finished[seq.seq_id] = seq.codes
+        self._evict(finished)
+        if len(self._running) > 0:
+            self._decode()
+        decode_time = time.perf_counter() - start_time
+
+        stats["finished"] = len(finished)
+        stats["prefill_time"] = prefill_time
+        stats["decode_time"] = decode_time
+        self._step_stats.append(stats)
+        self._totals["steps"] += 1
+        self._totals["admitted"] += len(admitted)
+        self._totals["finished"] += len(finished)
+        self._totals["busy_rows"] += stats["busy_rows"]
+        self._totals["prefill_time"] += prefill_time
+        self._totals["decode_time"] += decode_time
+        return [seq.seq_id for seq in finished]
+
+    def step_stats(self) -> List[Dict]:
+        """Per-step scheduling stats of the last ``max_step_stats`` steps."""
+        return list(self._step_stats)
+
+    def stats(self) -> Dict:
+        totals = self._totals
+        steps = totals["steps"]
+        return {
+            "max_batch_slots": self.max_batch_slots,
+            "num_beams": self.num_beams,
+            "steps": steps,
+            "admitted": totals["admitted"],
+            "finished": totals["finished"],
+            "cancelled": totals["cancelled"],
+            "queued": len(self._queue),
+            "running": len(self._running),
+            "generated_tokens": totals["generated_tokens"],
+            "prefill_tokens": totals["prefill_tokens"],
+            # average share of the kv cache rows used by running sentences
+            "avg_utilization": round(totals["busy_rows"] / (steps * self.max_batch_slots), 4) if steps > 0 else None,
+            "prefill_time": round(totals["prefill_time"], 4),
+            "decode_time": round(totals["decode_time"], 4),
+        }
+
+    def _admit(self) -> List[_Sequence]:
+        admitted = []
+        while len(self._queue) > 0 and self.num_rows + (len(admitted) + 1) * self.num_beams <= self.max_batch_slots:
+            admitted.append(self._queue.popleft())
+        if len(admitted) == 0:
+            return admitted
+        gpt = self.gpt
+        text_inputs = torch.nn.utils.rnn.pad_sequence([seq.text_tokens for seq in admitted], batch_first=True,
+                                                      padding_value=gpt.stop_text_token)
+        conds_latent = torch.cat([seq.conds_latent for seq in admitted], dim=0)
+        input_ids, inputs_embeds, attention_mask = gpt.prepare_gpt_inputs(conds_latent, text_inputs)
+        self._totals["prefill_tokens"] += int(attention_mask.sum().item())
+
+        first_row = self.num_rows
+        rows = torch.arange(first_row, first_row + len(admitted) * self.num_beams, device=input_ids.device)
+        logits = self._prefill(input_ids, inputs_embeds, attention_mask, rows)
+        self._logits[rows] = logits.repeat_interleave(self.num_beams, dim=0)
+        self._seen[rows] = False
+        self._seen[rows] = self._seen[rows].scatter(1, input_ids.repeat_interleave(self.num_beams, dim=0), True)
+        self._steps_generated[rows] = 0
+
+        device = input_ids.device
+        for i, seq in enumerate(admitted):
+            seq.row = first_row + i * self.num_beams
+            seq.tokens = torch.full((self.num_beams, self.max_generate_length), self.stop_mel_token,
+                                    dtype=torch.long, device=device)
+            if self.num_beams > 1:
+                seq.beam_scorer = BeamSearchScorer(
+                    batch_size=1,
+                    num_beams=self.num_beams,
+                    device=device,
+                    length_penalty=self.config.length_penalty,
+                    do_early_stopping=self.config.early_stopping,
+                    num_beam_hyps_to_keep=1,
+                    max_length=self.max_generate_length,
+                )
+                self._beam_scores[seq.row:seq.row + self.num_beams] = 0
+                if not self.config.do_sample:
+                    # only the tokens of the first beam are considered at the first step
+                    self._beam_scores[seq.row + 1:seq.row + self.num_beams] = -1e9
+            self._running.append(seq)
+        return admitted
+
+    def _select_tokens(self) -> List[_Sequence]:
+        """
+        Pick the next token of each running sentence from ``self._logits``, returns the finished sentences.
+        """
+        n = self.num_rows
+        config = self.config
+        logits = self._logits[:n]
+        seen = self._seen[:n] if config.repetition_penalty is not None and config.repetition_penalty != 1.0 else None
+        finished = []
+        if self.num_beams == 1:
+            scores = logits
+            if seen is not None:
+                scores = apply_repetition_penalty(scores, seen, config.repetition_penalty)
+            if config.do_sample:
+                scores = warp_scores(scores, config.temperature, config.top_k, config.top_p)
+                next_tokens = torch.multinomial(F.softmax(scores, dim=-1), num_samples=1).squeeze(1)
+            else:
+                next_tokens = torch.argmax(scores, dim=-1)
+            self._seen[:n].scatter_(1, next_tokens.unsqueeze(1), True)
+            self._last_tokens[:n] = next_tokens
+            is_stop = (next_tokens == self.stop_mel_token).tolist()
+            for row, seq in enumerate(self._running):
+                seq.tokens[0, seq.num_generated] = next_tokens[row]
+                seq.num_generated += 1
+                if is_stop[row] or seq.num_generated >= self.max_generate_length:
+                    seq.codes = seq.tokens[:, :seq.num_generated]
+                    finished.append(seq)
+            return finished
+
+        num_beams = self.num_beams
+        num_seqs = len(self._running)
+        scores = F.log_softmax(logits, dim=-1)
+        if seen is not None:
+            scores = apply_repetition_penalty(scores, seen, config.repetition_penalty)
+        if config.do_sample:
+            # keep at least one non-eos token in each beam
+            scores = warp_scores(scores, config.temperature, config.top_k, config.top_p, min_tokens_to_keep=2)
+        scores = scores + self._beam_scores[:n, None]
+        vocab_size = scores.shape[-1]
+        # the rows of a sentence are contiguous: (sentences, num_beams * vocab)
+        scores = scores.view(num_seqs, num_beams * vocab_size)
+        if config.do_sample:
+            next_tokens = torch.multinomial(F.softmax(scores, dim=-1), num_samples=2 * num_beams)
+            next_token_scores = torch.gather(scores, -1, next_tokens)
+            next_token_scores, _indices = torch.sort(next_token_scores, descending=True, dim=1)
+            next_tokens = torch.gather(next_tokens, -1, _indices)
+        else:
+            next_token_scores, next_tokens = torch.topk(scores, 2 * num_beams, dim=1, largest=True, sorted=True)
+        next_indices = torch.div(next_tokens, vocab_size, rounding_mode="floor")
+        next_tokens = next_tokens % vocab_size
+
+        beam_idx = torch.arange(n, device=scores.device)
+        for k, seq in enumerate(self._running):
+            rows = slice(seq.row, seq.row + num_beams)
+            cur_len = seq.num_generated
+            # each sentence has its own length, so its own scorer
+            beam_outputs = seq.beam_scorer.process(
+                seq.tokens[:, :cur_len],
+                next_token_scores[k:k + 1],
+                next_tokens[k:k + 1],
+                next_indices[k:k + 1],
+                pad_token_id=self.stop_mel_token,
+                eos_token_id=[self.stop_mel_token],
+                decoder_prompt_len=0,
+            )
+            self._beam_scores[rows] = beam_outputs["next_beam_scores"]
+            beam_next_tokens = beam_outputs["next_beam_tokens"]
+            seq_beam_idx = beam_outputs["next_beam_indices"]
+            seq.tokens[:, :cur_len] = seq.tokens[seq_beam_idx, :cur_len]
+            seq.tokens[:, cur_len] = beam_next_tokens
+            seq.num_generated += 1
+            beam_idx[rows] = seq_beam_idx + seq.row
+            self._last_tokens[rows] = beam_next_tokens
+            if seq.beam_scorer.is_done or seq.num_generated >= self.max_generate_length:
+                seq.codes = seq.beam_scorer.finalize(
+                    seq.tokens[:, :seq.num_generated],
+                    self._beam_scores[rows],
+                    next_tokens[k:k + 1],
+                    next_indices[k:k + 1],
+                    pad_token_id=self.stop_mel_token,
+                    eos_token_id=[self.stop_mel_token],
+                    max_length=self.max_generate_length,
+                    decoder_prompt_len=0,
+                )["sequences"]
+                finished.append(seq)
+        # the beams move within their sentence, only the rows whose beam changed are copied
+        changed = (beam_idx != torch.arange(n, device=beam_idx.device)).nonzero().squeeze(1)
+        if changed.numel() > 0:
+            src = beam_idx[changed]
+            self._seen[changed] = self._seen[src]
+            length = int(self._lens[:n].max().item())
+            self.key[:, changed, :, :length] = self.key[:, src, :, :length]
+            self.value[:, changed, :, :length] = self.value[:, src, :, :length]
+        self._seen[:n].scatter_(1, self._last_tokens[:n].unsqueeze(1), True)
+        return finished
+
+    def _evict(self, finished: List[_Sequence]):
+        """
+        Free the rows of the finished sentences; the last running sentences are moved into the gaps,
+        so the running rows stay contiguous.
+        """
+        if len(finished) == 0:
+            return
+        finished_ids = {seq.seq_id for seq in finished}
+        running = [seq for seq in self._running if seq.seq_id not in finished_ids]
+        num_beams = self.num_beams
+        src_rows, dst_rows = [], []
+        for i, seq in enumerate(running):
+            row = i * num_beams
+            if seq.row != row:
+                src_rows.extend(range(seq.row, seq.row + num_beams))
+                dst_rows.extend(range(row, row + num_beams))
+                seq.row = row
+        if len(src_rows) > 0:
+            device = self._lens.device
+            src = torch.tensor(src_rows, device=device)
+            dst = torch.tensor(dst_rows, device=device)
+            length = int(self._lens[src].max().item())
+            self.key[:, dst, :, :length] = self.key[:, src, :, :length]
+            self.value[:, dst, :, :length] = self.value[:, src, :, :length]
+            for buffer in (self._valid, self._lens, self._seen, self._logits, self._last_tokens, self._steps_generated,
+                           self._beam_scores):
+                buffer[dst] = buffer[src]
+        self._running = running
+        # the freed rows are reset on admission
+        self._valid[self.num_rows:] = False
+
+    def _embed_prompt(self, input_ids, inputs_embeds):
+        model = self.model
+        mel_len = inputs_embeds.shape[1]
+        text_emb = model.embeddings(input_ids[:, mel_len:])
+        text_emb = text_emb + model.text_pos_embedding(text_emb)
+        emb = torch.cat([inputs_embeds, text_emb], dim=1)
+        # null position embeddings, added as `GPT2Model` does for the same dtype promotion
+        return emb + self.transformer.wpe(input_ids)
+
+    def _prefill(self, input_ids, inputs_embeds, attention_mask, rows) -> torch.Tensor:
+        """
+        Run the prompts of the admitted sentences, write their keys/values into ``rows`` (``num_beams`` rows each).
+        Returns the logits of the first mel token, (b, vocab).
+        """
+        b, prompt_len = input_ids.shape
+        hidden_states = self._embed_prompt(input_ids, inputs_embeds)
+        mask_dtype = self.transformer.dtype
+        additive_mask = ((1.0 - attention_mask.to(mask_dtype)) * torch.finfo(mask_dtype).min)[:, None, None, :]
+        causal_mask = torch.ones((prompt_len, prompt_len), dtype=torch.bool, device=input_ids.device).tril()
+        for i, block in enumerate(self.transformer.h):
+            residual = hidden_states
+            hidden_states = block.ln_1(hidden_states)
+            attn = block.attn
+            query, key, value = self._qkv(attn, hidden_states)
+            self.key[i, rows, :, :prompt_len] = key.repeat_interleave(self.num_beams, dim=0).to(self.key.dtype)
+            self.value[i, rows, :, :prompt_len] = value.repeat_interleave(self.num_beams, dim=0).to(self.value.dtype)
+            hidden_states = self._attend(attn, query, key, value, i, additive_mask, causal_mask)
+            hidden_states = hidden_states + residual
+            residual = hidden_states
+            hidden_states = block.ln_2(hidden_states)
+            hidden_states = residual + block.mlp(hidden_states)
+        valid = self._valid[rows]
+        valid[:] = False
+        valid[:, :prompt_len] = attention_mask.bool().repeat_interleave(self.num_beams, dim=0)
+        self._valid[rows] = valid
+        self._lens[rows] = prompt_len
+        self._last_tokens[rows] = input_ids[:, -1].repeat_interleave(self.num_beams, dim=0)
+        hidden_states = self.transformer.ln_f(hidden_states[:, -1])
+        return self.model.lm_head(hidden_states)
+
+    def _decode(self):
+        """Feed the last token of every running row and update ``self._logits``."""
+        model = self.model
+        n = self.num_rows
+        rows = torch.arange(n, device=self._lens.device)
+        input_ids = self._last_tokens[:n].unsqueeze(1)
+        emb = model.embeddings(input_ids)
+        # the mel position of `generate()` with the kv cache: the n-th generated token is at position n + 1
+        self._steps_generated[:n] += 1
+        emb = emb + model.text_pos_embedding.emb(self._steps_generated[:n] + 1).unsqueeze(1)
+        hidden_states = emb + self.transformer.wpe(input_ids)
+
+        positions = self._lens[:n]
+        self._valid[rows, positions] = True
+        length = int(positions.max().item()) + 1
+        mask_dtype = self.transformer.dtype
+        additive_mask = torch.zeros((n, 1, 1, length), dtype=mask_dtype, device=emb.device)
+        additive_mask.masked_fill_(~self._valid[:n, None, None, :length], torch.finfo(mask_dtype).min)
+        for i, block in enumerate(self.transformer.h):
+            residual = hidden_states
+            hidden_states = block.ln_1(hidden_states)
+            attn = block.attn
+            query, key, value = self._qkv(attn, hidden_states)
+            self.key[i, rows, :, positions] = key[:, :, 0].to(self.key.dtype)
+            self.value[i, rows, :, positions] = value[:, :, 0].to(self.value.dtype)
+            hidden_states = self._attend(attn, query, self.key[i, :n, :, :length], self.value[i, :n, :, :length],
+                                         i, additive_mask, None)
+            hidden_states = hidden_states + residual
+            residual = hidden_states
+            hidden_states = block.ln_2(hidden_states)
+            hidden_states = residual + block.mlp(hidden_states)
+        self._lens[:n] += 1
+        hidden_states = self.transformer.ln_f(hidden_states[:, -1])
+        self._logits[:n] = model.lm_head(hidden_states)
+
+    def _qkv(self, attn, hidden_states):
+        rows, query_len, _ = hidden_states.shape
+        query, key, value = attn.c_attn(hidden_states).split(attn.split_size, dim=2)
+        query = query.view(rows, query_len, self.num_heads, self.head_dim).permute(0, 2, 1, 3)
+        key = key.view(rows, query_len, self.num_heads, self.head_dim).permute(0, 2, 1, 3)
+        value = value.view(rows, query_len, self.num_heads, self.head_dim).permute(0, 2, 1, 3)
+        return query, key, value
+
+    def _attend(self, attn, query, key, value, layer_idx, attention_mask, causal_mask):
+        """Same as `GPT2Attention._attn()` followed by the output projection."""
+        rows, _, query_len, _ = query.shape
+        attn_weights = torch.matmul(query, key.transpose(-1, -2))
+        if attn.scale_attn_weights:
+            attn_weights = attn_weights / torch.full(
+                [], value.size(-1) ** 0.5, dtype=attn_weights.dtype, device=attn_weights.device
+            )
+        if attn.scale_attn_by_inverse_layer_idx:
+            attn_weights = attn_weights / float(layer_idx + 1)
+        if causal_mask is not None:
+            mask_value = torch.full([], torch.finfo(attn_weights.dtype).min, dtype=attn_weights.dtype, device=attn_weights.device)
+            attn_weights = torch.where(causal_mask, attn_weights, mask_value)
+        attn_weights = attn_weights + attention_mask
+        attn_weights = F.softmax(attn_weights, dim=-1)
+        attn_weights = attn_weights.type(value.dtype)
+        attn_output = torch.matmul(attn_weights, value)
+        attn_output = attn_output.permute(0, 2, 1, 3).contiguous().view(rows, query_len, self.num_heads * self.head_dim)
+        return attn.c_proj(attn_output)
@@ -3,7 +3,7 @@ import functools
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from transformers import GPT2Config, GPT2PreTrainedModel, LogitsProcessorList, GenerationMixin
+from transformers import GPT2Config, GPT2PreTrainedModel, LogitsProcessorList, GenerationMixin, StoppingCriteria, StoppingCriteriaList
 from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
 from transformers.utils.model_parallel_utils import (assert_device_map,
                                                      get_device_map)
@@ -11,6 +11,7 @@ from transformers.utils.model_parallel_utils import (assert_device_map,
 from indextts.gpt.conformer_encoder import ConformerEncoder
 from indextts.gpt.perceiver import PerceiverResampler
 from indextts.utils.arch_util import AttentionBlock
+from indextts.utils.cancellation import check_cancelled
 from indextts.utils.typical_sampling import TypicalLogitsWarper
 
 
@@ -18,6 +19,25 @@ def null_position_embeddings(range, dim):
     return torch.zeros((range.shape[0], range.shape[1], dim), device=range.device)
 
 
+def _repeat_rows(x, repeats: int):
+    """`repeat_interleave` the rows of a tensor, or of every tensor in nested tuples (e.g. ``past_key_values``)."""
+    if x is None:
+        return None
+    if isinstance(x, (tuple, list)):
+        return tuple(_repeat_rows(item, repeats) for item in x)
+    return x.repeat_interleave(repeats, dim=0)
+
+
+class CancelledCriteria(StoppingCriteria):
+    """Stops `generate()` once ``cancel_event`` is set."""
+
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        return self.cancel_event.is_set()
+
+
 class ResBlock(nn.Module):
     """
     Basic residual convolutional block that uses GroupNorm.
@@ -135,6 +155,31 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
         return_dict = (
             return_dict if return_dict is not None else self.config.use_return_dict
         )
+        group_size = self._prefill_group_size(input_ids, attention_mask, past_key_values)
+        if group_size > 1:
+            # generate() expands every input to num_beams (or num_return_sequences) identical rows before the prefill:
+            # run the conditioning + text prefix once per input and fan the outputs and the kv cache out to the rows
+            outputs = self(
+                input_ids[::group_size],
+                attention_mask=attention_mask[::group_size] if attention_mask is not None else None,
+                token_type_ids=token_type_ids[::group_size] if token_type_ids is not None else None,
+                position_ids=position_ids[::group_size] if position_ids is not None else None,
+                head_mask=head_mask,
+                use_cache=use_cache,
+                output_attentions=output_attentions,
+                output_hidden_states=output_hidden_states,
+                return_dict=True,
+            )
+            fan_out = functools.partial(_repeat_rows, repeats=group_size)
+            outputs = CausalLMOutputWithCrossAttentions(
+                loss=None,
+                logits=fan_out(outputs.logits),
+                past_key_values=fan_out(outputs.past_key_values),
+                hidden_states=fan_out(outputs.hidden_states),
+                attentions=fan_out(outputs.attentions),
+                cross_attentions=fan_out(outputs.cross_attentions),
+            )
+            return outputs if return_dict else outputs.to_tuple()
         # Create embedding
         mel_len = self.cached_mel_emb.shape[1]
         if input_ids.shape[1] != 1:
@@ -177,6 +222,8 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
                 torch.cuda.set_device(self.transformer.first_device)
             hidden_states = hidden_states.to(self.lm_head.weight.device)
 
+        # generation only reads the logits of the last position, skip the lm_head of the whole prefix at the first step
+        hidden_states = hidden_states[:, -1:]
         lm_logits = self.lm_head(hidden_states)
 
         if not return_dict:
@@ -191,8 +238,26 @@ class GPT2InferenceModel(GPT2PreTrainedModel, GenerationMixin):
             cross_attentions=transformer_outputs.cross_attentions,
         )
 
-    @staticmethod
-    def _reorder_cache(past, beam_idx):
+    def _prefill_group_size(self, input_ids, attention_mask, past_key_values) -> int:
+        """
+        Number of identical consecutive rows per input in the prefill of `generate()`, 1 if the rows are not
+        (or no longer) groups of the same input, e.g. at the decoding steps or with per-row ``input_tokens``.
+        """
+        if past_key_values is not None or self.cached_mel_emb is None or input_ids.shape[1] == 1:
+            return 1
+        num_inputs = self.cached_mel_emb.shape[0]
+        if input_ids.shape[0] == num_inputs or input_ids.shape[0] % num_inputs != 0:
+            return 1
+        group_size = input_ids.shape[0] // num_inputs
+        for rows in (input_ids, attention_mask):
+            if rows is None:
+                continue
+            grouped = rows.view(num_inputs, group_size, -1)
+            if not (grouped == grouped[:, :1]).all():
+                return 1
+        return group_size
+
+    def _reorder_cache(self, past, beam_idx):
         """
         This function is used to re-order the :obj:`past_key_values` cache if
         :meth:`~transformers.PreTrainedModel.beam_search` or :meth:`~transformers.PreTrainedModel.beam_sample` is
@@ -459,13 +524,14 @@ class UnifiedVoice(nn.Module):
                 text_input_tokens[b, actual_end:] = self.stop_text_token
         return text_input_tokens
 
-    def get_logits(self, speech_conditioning_inputs, first_inputs, first_head, second_inputs=None, second_head=None, get_attns=False, return_latent=False):
+    def get_logits(self, speech_conditioning_inputs, first_inputs, first_head, second_inputs=None, second_head=None, get_attns=False, return_latent=False,
+                   attention_mask=None):
         if second_inputs is not None:
             emb = torch.cat([speech_conditioning_inputs, first_inputs, second_inputs], dim=1)
         else:
             emb = torch.cat([speech_conditioning_inputs, first_inputs], dim=1)
 
-        gpt_out = self.gpt(inputs_embeds=emb, return_dict=True, output_attentions=get_attns)
+        gpt_out = self.gpt(inputs_embeds=emb, attention_mask=attention_mask, return_dict=True, output_attentions=get_attns)
         if get_attns:
             return gpt_out.attentions
 
@@ -520,7 +586,7 @@ class UnifiedVoice(nn.Module):
 
     def forward(self, speech_conditioning_latent, text_inputs, text_lengths, mel_codes, wav_lengths,
                 cond_mel_lengths=None, types=None, text_first=True, raw_mels=None, return_attentions=False,
-                return_latent=False, clip_inputs=False):
+                return_latent=False, clip_inputs=False, conds_latent=None):
         """
         Forward pass that uses both text and voice in either text conditioning mode or voice conditioning mode
         (actuated by `text_first`).
@@ -532,12 +598,22 @@ class UnifiedVoice(nn.Module):
         wav_lengths: long tensor, (b,)
         raw_mels: MEL float tensor (b,80,s)
 
+        conds_latent: (b, 32, dim) or (1, 32, dim) precomputed `get_conditioning()` output,
+            if given, ``speech_conditioning_latent`` is ignored and the conditioning encoder is skipped.
+
         If return_attentions is specified, only logits are returned.
         If return_latent is specified, loss & logits are not computed or returned. Only the predicted latents are returned.
+            The text padding of a batch is masked out, so each row gets the same latents as when run alone;
+            the latents of row i are ``[i, :mel_codes_lengths[i]]``.
         If clip_inputs is True, the inputs will be clipped to the smallest input size across each input modality.
         """
 
-        speech_conditioning_latent = self.get_conditioning(speech_conditioning_latent, cond_mel_lengths)
+        if conds_latent is None:
+            speech_conditioning_latent = self.get_conditioning(speech_conditioning_latent, cond_mel_lengths)
+        else:
+            speech_conditioning_latent = conds_latent
+        if speech_conditioning_latent.shape[0] != text_inputs.shape[0]:
+            speech_conditioning_latent = speech_conditioning_latent.expand(text_inputs.shape[0], -1, -1)
         # Types are expressed by expanding the text embedding space.
         if types is not None:
             text_inputs = text_inputs * (1 + types).unsqueeze(-1)
@@ -571,13 +647,27 @@ class UnifiedVoice(nn.Module):
         mel_emb = self.mel_embedding(mel_inp)
         mel_emb = mel_emb + self.mel_pos_embedding(mel_codes)
 
+        attention_mask = None
+        if return_latent and text_inputs.shape[0] > 1 and (text_lengths + 2 < text_inputs.shape[1]).any():
+            # mask out the text padding of the batch, so every row gets the same latents as when run alone;
+            # the mel padding always follows the valid codes, the causal attention keeps it out of the valid positions
+            text_mask = torch.arange(text_inputs.shape[1], device=text_inputs.device).unsqueeze(0) < (text_lengths + 2).unsqueeze(1)
+            cond_mask = text_mask.new_ones(conds.shape[0], conds.shape[1])
+            mel_mask = text_mask.new_ones(mel_emb.shape[0], mel_emb.shape[1])
+            if text_first:
+                attention_mask = torch.cat([cond_mask, text_mask, mel_mask], dim=1).long()
+            else:
+                attention_mask = torch.cat([cond_mask, mel_mask, text_mask], dim=1).long()
+
         if text_first:
             # print(f"conds: {conds.shape}, text_emb: {text_emb.shape}, mel_emb: {mel_emb.shape}")
-            text_logits, mel_logits = self.get_logits(conds, text_emb, self.text_head, mel_emb, self.mel_head, get_attns=return_attentions, return_latent=return_latent)
+            text_logits, mel_logits = self.get_logits(conds, text_emb, self.text_head, mel_emb, self.mel_head, get_attns=return_attentions, return_latent=return_latent,
+                                                      attention_mask=attention_mask)
             if return_latent:
                 return mel_logits[:, :-2]  # Despite the name, these are not logits. Strip off the two tokens added by this forward pass.
         else:
-            mel_logits, text_logits = self.get_logits(conds, mel_emb, self.mel_head, text_emb, self.text_head, get_attns=return_attentions, return_latent=return_latent)
+            mel_logits, text_logits = self.get_logits(conds, mel_emb, self.mel_head, text_emb, self.text_head, get_attns=return_attentions, return_latent=return_latent,
+                                                      attention_mask=attention_mask)
             if return_latent:
                 return text_logits[:, :-2]  # Despite the name, these are not logits. Strip off the two tokens added by this forward pass.
 
@@ -653,21 +743,26 @@ class UnifiedVoice(nn.Module):
         fake_inputs[:, -1] = self.start_mel_token
         return fake_inputs, batched_mel_emb, attention_mask
     def inference_speech(self, speech_conditioning_mel, text_inputs, cond_mel_lengths=None, input_tokens=None, num_return_sequences=1,
-                         max_generate_length=None, typical_sampling=False, typical_mass=.9, **hf_generate_kwargs):
+                         max_generate_length=None, typical_sampling=False, typical_mass=.9,
+                         conds_latent=None, cancel_event=None, **hf_generate_kwargs):
         """
         Args:
             speech_conditioning_mel: (b, n_mels, frames) or (n_mels, frames)
             text_inputs: (b, L)
             cond_mel_lengths: lengths of the conditioning mel spectrograms in shape (b,) or (1,)
+            conds_latent: (b, 32, dim) or (1, 32, dim) precomputed `get_conditioning()` output,
+                if given, ``speech_conditioning_mel`` is ignored and the conditioning encoder is skipped.
             input_tokens: additional tokens for generation in shape (b, s) or (s,)
             max_generate_length: limit the number of generated tokens
+            cancel_event: a `threading.Event` checked at every decoding step, raises `InferenceCancelled` once set
             hf_generate_kwargs: kwargs for `GPT2InferenceModel.generate(**hf_generate_kwargs)`
         """
-        if speech_conditioning_mel.ndim == 2:
-            speech_conditioning_mel = speech_conditioning_mel.unsqueeze(0)
-        if cond_mel_lengths is None:
-            cond_mel_lengths = torch.tensor([speech_conditioning_mel.shape[-1]], device=speech_conditioning_mel.device)
-        conds_latent = self.get_conditioning(speech_conditioning_mel, cond_mel_lengths)
+        if conds_latent is None:
+            if speech_conditioning_mel.ndim == 2:
+                speech_conditioning_mel = speech_conditioning_mel.unsqueeze(0)
+            if cond_mel_lengths is None:
+                cond_mel_lengths = torch.tensor([speech_conditioning_mel.shape[-1]], device=speech_conditioning_mel.device)
+            conds_latent = self.get_conditioning(speech_conditioning_mel, cond_mel_lengths)
         input_ids, inputs_embeds, attention_mask = self.prepare_gpt_inputs(conds_latent, text_inputs)
         self.inference_model.store_mel_emb(inputs_embeds)
         if input_tokens is None:
@@ -695,12 +790,18 @@ class UnifiedVoice(nn.Module):
             min_tokens_to_keep = 2 if hf_generate_kwargs.get("num_beams", 1) > 1 else 1
             logits_processor.append(TypicalLogitsWarper(mass=typical_mass, min_tokens_to_keep=min_tokens_to_keep))
         max_length = (trunc_index + self.max_mel_tokens - 1) if max_generate_length is None else trunc_index + max_generate_length
-        output = self.inference_model.generate(inputs, 
+        stopping_criteria = StoppingCriteriaList()
+        if cancel_event is not None:
+            stopping_criteria.append(CancelledCriteria(cancel_event))
+        output = self.inference_model.generate(inputs,
                                             bos_token_id=self.start_mel_token, pad_token_id=self.stop_mel_token,
                                             eos_token_id=self.stop_mel_token, attention_mask=attention_mask,
                                             max_length=max_length, logits_processor=logits_processor,
+                                            stopping_criteria=stopping_criteria,
                                             num_return_sequences=num_return_sequences,
                                             **hf_generate_kwargs)
+        # generate() stopped early and returned the partial sequences
+        check_cancelled(cancel_event)
         if isinstance(output, torch.Tensor):
             return output[:, trunc_index:]
         # GenerateOutput
@@ -1,9 +1,12 @@
 import os
+import queue
 import sys
+import threading
 import time
 from subprocess import CalledProcessError
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Tuple
 
+import numpy as np
 import torch
 import torchaudio
 from torch.nn.utils.rnn import pad_sequence
@@ -16,16 +19,26 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
 
 from indextts.BigVGAN.models import BigVGAN as Generator
+from indextts.gpt.continuous_batching import ContinuousBatchingEngine
 from indextts.gpt.model import UnifiedVoice
+from indextts.utils.cancellation import AllEvents, InferenceCancelled, check_cancelled
 from indextts.utils.checkpoint import load_checkpoint
 from indextts.utils.feature_extractors import MelSpectrogramFeatures
 
-from indextts.utils.front import TextNormalizer, TextTokenizer
+from indextts.utils.document_normalizer import DocumentNormalizer, split_document
+from indextts.utils.front import TextTokenizer, get_shared_normalizer
+from indextts.utils.text_cache import TextCache, frontend_version
+from indextts.utils.voice_cache import VoiceCache, VoiceConditioning
 
 
 class IndexTTS:
+    # `infer_fast(pipeline_frontend=True)` 时每个文本段的最大字符数
+    pipeline_chunk_chars = 300
+
     def __init__(
         self, cfg_path="checkpoints/config.yaml", model_dir="checkpoints", is_fp16=True, device=None, use_cuda_kernel=None,
+        voice_cache_max_bytes=64 * 1024 * 1024, normalize_workers=0, text_cache_size=4096, text_cache_path=None,
+        lazy_normalizer=False,
     ):
         """
         Args:
@@ -34,6 +47,12 @@ class IndexTTS:
             is_fp16 (bool): whether to use fp16.
             device (str): device to use (e.g., 'cuda:0', 'cpu'). If None, it will be set automatically based on the availability of CUDA or MPS.
             use_cuda_kernel (None | bool): whether to use BigVGan custom fused activation CUDA kernel, only for CUDA device.
+            voice_cache_max_bytes (int): memory budget of the reference audio conditioning cache, see `VoiceCache`.
+            normalize_workers (int): worker processes normalizing long texts in parallel, see `DocumentNormalizer`. 0 to disable.
+            text_cache_size (int): texts kept in the in-memory normalization and tokenization cache, see `TextCache`.
+            text_cache_path (str): sqlite file persisting that cache across restarts, None to keep it in memory only.
+            lazy_normalizer (bool): return before the text normalizer finished loading in the background,
+                the first request waits for it. Otherwise wait for it at the end of `__init__`.
         """
         if device is not None:
             self.device = device
@@ -57,6 +76,9 @@ class IndexTTS:
         self.model_dir = model_dir
         self.dtype = torch.float16 if self.is_fp16 else None
         self.stop_mel_token = self.cfg.gpt.stop_mel_token
+        # 文本正则化器（进程内共享）在后台线程中加载 FST，与下面模型权重的加载重叠
+        self.normalizer = get_shared_normalizer()
+        self.normalizer.load_async()
 
         # Comment-off to load the VQ-VAE model for debugging tokenizer
         #   https://github.com/index-tts/index-tts/issues/34
@@ -117,74 +139,107 @@ class IndexTTS:
         self.bigvgan.eval()
         print(">> bigvgan weights restored from:", self.bigvgan_path)
         self.bpe_path = os.path.join(self.model_dir, self.cfg.dataset["bpe_model"])
-        self.normalizer = TextNormalizer()
-        self.normalizer.load()
-        print(">> TextNormalizer loaded")
         self.tokenizer = TextTokenizer(self.bpe_path, self.normalizer)
         print(">> bpe model loaded from:", self.bpe_path)
-        # 缓存参考音频mel：
-        self.cache_audio_prompt = None
-        self.cache_cond_mel = None
+        if not lazy_normalizer:
+            self.normalizer.load()
+            print(">> TextNormalizer loaded")
+        # 长文本分段后多进程并行正则化
+        self.document_normalizer = None
+        if normalize_workers > 0:
+            self.document_normalizer = DocumentNormalizer(self.normalizer, num_workers=normalize_workers)
+        # 按原文本缓存正则化结果和 token id, 版本包含 bpe 模型和正则化器, 更换后旧的缓存不会命中
+        self.text_cache = None
+        if text_cache_size > 0 or text_cache_path:
+            self.text_cache = TextCache(
+                frontend_version(self.bpe_path, self.normalizer), max_entries=text_cache_size, db_path=text_cache_path
+            )
+            self.tokenizer.text_cache = self.text_cache
+            if self.document_normalizer is not None:
+                self.document_normalizer.text_cache = self.text_cache
+        # 缓存参考音频的 mel、conditioning latents 和 speaker embedding（LRU）
+        self.voice_cache = VoiceCache(max_bytes=voice_cache_max_bytes)
+        # 最近一次 continuous batching 的调度统计, 见 `infer_batch(max_batch_slots=...)`
+        self.last_batching_stats = None
         # 进度引用显示（可选）
         self.gr_progress = None
         self.model_version = self.cfg.version if hasattr(self.cfg, "version") else None
 
+    def get_voice_conditioning(self, audio_prompt: str, verbose=False) -> VoiceConditioning:
+        """
+        Load the reference audio and compute its conditioning, or return it from `voice_cache`.
+        """
+        key = VoiceCache.make_key(audio_prompt)
+        voice = self.voice_cache.get(key)
+        if voice is not None:
+            return voice
+        audio, sr = torchaudio.load(audio_prompt)
+        audio = torch.mean(audio, dim=0, keepdim=True)
+        if audio.shape[0] > 1:
+            audio = audio[0].unsqueeze(0)
+        audio = torchaudio.transforms.Resample(sr, 24000)(audio)
+        cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
+        if verbose:
+            print(f"cond_mel shape: {cond_mel.shape}", "dtype:", cond_mel.dtype)
+        cond_mel_lengths = torch.tensor([cond_mel.shape[-1]], device=self.device)
+        with torch.no_grad():
+            with torch.amp.autocast(cond_mel.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                conds_latent = self.gpt.get_conditioning(cond_mel, cond_mel_lengths)
+                speaker_embedding = self.bigvgan.get_speaker_embedding(cond_mel.transpose(1, 2))
+        voice = VoiceConditioning(cond_mel, conds_latent, speaker_embedding)
+        self.voice_cache.put(key, voice)
+        return voice
+
     def remove_long_silence(self, codes: torch.Tensor, silent_token=52, max_consecutive=30):
         """
         Shrink special tokens (silent_token and stop_mel_token) in codes
         codes: [B, T]
+
+        Each row is cut at its first stop_mel_token. Rows with more than ``max_consecutive`` silent tokens
+        keep at most 10 tokens of every silent run, and are padded with stop_mel_token after their length.
+        The whole batch is processed with tensor ops, without per-token device syncs.
         """
-        code_lens = []
-        codes_list = []
         device = codes.device
-        dtype = codes.dtype
-        isfix = False
-        for i in range(0, codes.shape[0]):
-            code = codes[i]
-            if not torch.any(code == self.stop_mel_token).item():
-                len_ = code.size(0)
-            else:
-                stop_mel_idx = (code == self.stop_mel_token).nonzero(as_tuple=False)
-                len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
-
-            count = torch.sum(code == silent_token).item()
-            if count > max_consecutive:
-                # code = code.cpu().tolist()
-                ncode_idx = []
-                n = 0
-                for k in range(len_):
-                    assert code[k] != self.stop_mel_token, f"stop_mel_token {self.stop_mel_token} should be shrinked here"
-                    if code[k] != silent_token:
-                        ncode_idx.append(k)
-                        n = 0
-                    elif code[k] == silent_token and n < 10:
-                        ncode_idx.append(k)
-                        n += 1
-                    # if (k == 0 and code[k] == 52) or (code[k] == 52 and code[k-1] == 52):
-                    #    n += 1
-                # new code
-                len_ = len(ncode_idx)
-                codes_list.append(code[ncode_idx])
-                isfix = True
-            else:
-                # shrink to len_
-                codes_list.append(code[:len_])
-            code_lens.append(len_)
-        if isfix:
-            if len(codes_list) > 1:
-                codes = pad_sequence(codes_list, batch_first=True, padding_value=self.stop_mel_token)
-            else:
-                codes = codes_list[0].unsqueeze(0)
-        else:
-            # unchanged
-            pass
-        # clip codes to max length
-        max_len = max(code_lens)
-        if max_len < codes.shape[1]:
-            codes = codes[:, :max_len]
-        code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
+        B, T = codes.shape
+        positions = torch.arange(T, device=device).unsqueeze(0).expand(B, T)
+        is_stop = codes == self.stop_mel_token
+        # index of the first stop_mel_token, T if there is none
+        code_lens = torch.where(is_stop, positions, T).min(dim=1).values
+        is_silent = codes == silent_token
+        need_fix = is_silent.sum(dim=1) > max_consecutive
+        if not need_fix.any().item():
+            # unchanged, only clip codes to max length
+            max_len = code_lens.max().item()
+            return codes[:, :max_len], code_lens
+        # position of each silent token within its run of consecutive silent tokens
+        last_non_silent = torch.where(is_silent, -1, positions).cummax(dim=1).values
+        run_pos = positions - last_non_silent - 1
+        keep = (positions < code_lens.unsqueeze(1)) & (~is_silent | (run_pos < 10) | ~need_fix.unsqueeze(1))
+        code_lens = keep.sum(dim=1)
+        max_len = code_lens.max().item()
+        # stable sort moves the kept positions to the front, preserving their order
+        order = torch.sort((~keep).to(torch.int8), dim=1, stable=True).indices[:, :max_len]
+        pad_mask = positions[:, :max_len] >= code_lens.unsqueeze(1)
+        codes = codes.gather(1, order).masked_fill(pad_mask, self.stop_mel_token)
         return codes, code_lens
 
+    def tokenize_sentences(self, text: str, max_text_tokens_per_sentence=120, verbose=False) -> List[np.ndarray]:
+        """
+        文本 -> 分句后每句的 token id (int32 数组)，直接在 token id 上分句，见 `TextTokenizer.split_sentences_ids`
+        设置了 ``normalize_workers`` 时，长文本由 `DocumentNormalizer` 分段并行正则化
+        """
+        if self.document_normalizer is not None and len(text) >= self.document_normalizer.min_chars:
+            normalized = self.document_normalizer.normalize(text)
+            if verbose:
+                stats = self.document_normalizer.last_stats
+                print(f">> normalized {stats['chars']} chars in {stats['chunks']} chunks with {stats['workers']} workers, "
+                      f"{stats['elapsed']:.2f}s, {stats['chars_per_sec']:.0f} chars/s")
+            token_ids = self.tokenizer.encode(normalized, normalize=False)
+        else:
+            token_ids = self.tokenizer.encode(text)
+        ids, offsets = self.tokenizer.split_sentences_ids(token_ids, max_text_tokens_per_sentence)
+        return [ids[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)]
+
     def bucket_sentences(self, sentences, bucket_max_size=4) -> List[List[Dict]]:
         """
         Sentence data bucketing.
@@ -242,6 +297,85 @@ class IndexTTS:
             return out_buckets
         return [outputs]
 
+    def iter_sentence_buckets(self, text: str, max_text_tokens_per_sentence=100, bucket_max_size=4,
+                              pipeline_frontend=False, verbose=False, cancel_event=None) -> Iterator[List[Dict]]:
+        """
+        分句、分桶，依次 yield 每个 bucket（``idx`` 为句子在全文中的序号）
+        ``pipeline_frontend``: 文本按 ``pipeline_chunk_chars`` 切段（见 `split_document`），在后台线程中逐段正则化和分词，
+            每段单独分桶，前面的段先开始生成；分桶只取决于切段，与后台线程的快慢无关，句子不跨段合并。
+            队列最多缓存 2 个已完成的段，生成跟不上时后台线程等待
+        ``cancel_event``: 设置后后台线程不再处理剩余的段
+        """
+        paragraphs = split_document(text, self.pipeline_chunk_chars) if pipeline_frontend else []
+        if len(paragraphs) <= 1:
+            sentences = self.tokenize_sentences(text, max_text_tokens_per_sentence, verbose=verbose)
+            if verbose:
+                print(">> text token count:", sum(len(sent) for sent in sentences))
+                print("   splited sentences count:", len(sentences))
+                print("   max_text_tokens_per_sentence:", max_text_tokens_per_sentence)
+                print(*[self.tokenizer.convert_ids_to_tokens(sent.tolist()) for sent in sentences], sep="\n")
+            buckets = self.bucket_sentences(sentences, bucket_max_size=bucket_max_size)
+            if verbose:
+                print(">> sentences bucket_count:", len(buckets),
+                      "bucket sizes:", [(len(s), [t["idx"] for t in s]) for s in buckets],
+                      "bucket_max_size:", bucket_max_size)
+            yield from buckets
+            return
+
+        ready = queue.Queue(maxsize=2)
+        stopped = threading.Event()
+
+        def should_stop():
+            return stopped.is_set() or (cancel_event is not None and cancel_event.is_set())
+
+        def put(item) -> bool:
+            # 队列满时等待, 生成结束或取消后放弃, 避免后台线程阻塞在已经没有消费者的队列上
+            while not should_stop():
+                try:
+                    ready.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for paragraph in paragraphs:
+                    if should_stop() or not put(self.tokenize_sentences(paragraph, max_text_tokens_per_sentence)):
+                        return
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+
+        threading.Thread(target=produce, name="IndexTTS.frontend", daemon=True).start()
+        offset = 0
+        try:
+            while True:
+                try:
+                    item = ready.get(timeout=0.1)
+                except queue.Empty:
+                    # 取消后后台线程不再放入结束标记
+                    check_cancelled(cancel_event)
+                    continue
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                if len(item) == 0:
+                    continue
+                buckets = self.bucket_sentences(item, bucket_max_size=bucket_max_size)
+                for bucket in buckets:
+                    for sent in bucket:
+                        sent["idx"] += offset
+                if verbose:
+                    print(f">> [pipeline] sentences {offset}-{offset + len(item) - 1}, bucket_count: {len(buckets)}",
+                          "bucket sizes:", [(len(s), [t["idx"] for t in s]) for s in buckets])
+                offset += len(item)
+                yield from buckets
+        finally:
+            stopped.set()
+
     def pad_tokens_cat(self, tokens: List[torch.Tensor]) -> torch.Tensor:
         if self.model_version and self.model_version >= 1.5:
             # 1.5版本以上，直接使用stop_text_token 右侧填充，填充到最大长度
@@ -261,6 +395,17 @@ class IndexTTS:
         tokens = torch.cat(outputs, dim=0)
         return tokens
 
+    def scale_latent_speed(self, latent: torch.Tensor, speed_rate: float) -> torch.Tensor:
+        """
+        在 BigVGAN 之前调整语速: 沿时间轴线性插值 GPT latent, (B, T, D) -> (B, round(T / speed_rate), D)
+        减速时声码的帧数按比例增加, 加速时按比例减少, 音调不变
+        """
+        if speed_rate == 1.0:
+            return latent
+        length = max(1, int(round(latent.shape[1] / speed_rate)))
+        scaled = torch.nn.functional.interpolate(latent.transpose(1, 2).float(), size=length, mode="linear", align_corners=True)
+        return scaled.transpose(1, 2).to(latent.dtype)
+
     def torch_empty_cache(self):
         try:
             if "cuda" in str(self.device):
@@ -275,7 +420,8 @@ class IndexTTS:
             self.gr_progress(value, desc=desc)
 
     # 快速推理：对于“多句长文本”，可实现至少 2~10 倍以上的速度提升~ （First modified by sunnyboxs 2025-04-16）
-    def infer_fast(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_sentence=100, sentences_bucket_max_size=4, **generation_kwargs):
+    def infer_fast(self, audio_prompt, text, output_path, verbose=False, max_text_tokens_per_sentence=100, sentences_bucket_max_size=4,
+                   pipeline_frontend=False, **generation_kwargs):
         """
         Args:
             ``max_text_tokens_per_sentence``: 分句的最大token数，默认``100``，可以根据GPU硬件情况调整
@@ -284,6 +430,10 @@ class IndexTTS:
             ``sentences_bucket_max_size``: 分句分桶的最大容量，默认``4``，可以根据GPU内存调整
                 - 越大，bucket数量越少，batch越多，推理速度越*快*，占用内存更多，可能影响质量
                 - 越小，bucket数量越多，batch越少，推理速度越*慢*，占用内存和质量更接近于非快速推理
+            ``speed_rate``: 语速倍率，默认``1.0``，在 BigVGAN 之前对 latent 做时间轴插值，见 `scale_latent_speed`
+            ``cancel_event``: `threading.Event`，设置后在下一个解码步 / bucket / BigVGAN 块之前抛出 `InferenceCancelled`
+            ``pipeline_frontend``: 长文本按段在后台线程中正则化和分词，每段单独分桶，前面段的 bucket 先开始生成，默认``False``
+                - 见 `iter_sentence_buckets`，只有一个段落时与不开启相同
         """
         print(">> start fast inference...")
         
@@ -292,37 +442,17 @@ class IndexTTS:
             print(f"origin text:{text}")
         start_time = time.perf_counter()
 
-        # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
-        if self.cache_cond_mel is None or self.cache_audio_prompt != audio_prompt:
-            audio, sr = torchaudio.load(audio_prompt)
-            audio = torch.mean(audio, dim=0, keepdim=True)
-            if audio.shape[0] > 1:
-                audio = audio[0].unsqueeze(0)
-            audio = torchaudio.transforms.Resample(sr, 24000)(audio)
-            cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
-            cond_mel_frame = cond_mel.shape[-1]
-            if verbose:
-                print(f"cond_mel shape: {cond_mel.shape}", "dtype:", cond_mel.dtype)
-
-            self.cache_audio_prompt = audio_prompt
-            self.cache_cond_mel = cond_mel
-        else:
-            cond_mel = self.cache_cond_mel
-            cond_mel_frame = cond_mel.shape[-1]
-            pass
+        # 参考音频的 cond_mel 等已缓存时直接复用, 提升速度
+        voice = self.get_voice_conditioning(audio_prompt, verbose=verbose)
+        cond_mel = voice.cond_mel
+        cond_mel_frame = voice.cond_mel_frame
+        # 条件 latent 和说话人 embedding 每个参考音频只计算一次, 所有句子共享
+        conds_latent = voice.conds_latent
+        speaker_embedding = voice.speaker_embedding
 
         auto_conditioning = cond_mel
         cond_mel_lengths = torch.tensor([cond_mel_frame], device=self.device)
 
-        # text_tokens
-        text_tokens_list = self.tokenizer.tokenize(text)
-
-        sentences = self.tokenizer.split_sentences(text_tokens_list, max_tokens_per_sentence=max_text_tokens_per_sentence)
-        if verbose:
-            print(">> text token count:", len(text_tokens_list))
-            print("   splited sentences count:", len(sentences))
-            print("   max_text_tokens_per_sentence:", max_text_tokens_per_sentence)
-            print(*sentences, sep="\n")
         do_sample = generation_kwargs.pop("do_sample", True)
         top_p = generation_kwargs.pop("top_p", 0.8)
         top_k = generation_kwargs.pop("top_k", 30)
@@ -332,6 +462,8 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        speed_rate = generation_kwargs.pop("speed_rate", 1.0)
+        cancel_event = generation_kwargs.pop("cancel_event", None)
         sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
@@ -342,36 +474,38 @@ class IndexTTS:
 
         # text processing
         all_text_tokens: List[List[torch.Tensor]] = []
+        all_sentences: List[List[Dict]] = []
         self._set_gr_progress(0.1, "text processing...")
         bucket_max_size = sentences_bucket_max_size if self.device != "cpu" else 1
-        all_sentences = self.bucket_sentences(sentences, bucket_max_size=bucket_max_size)
-        bucket_count = len(all_sentences)
-        if verbose:
-            print(">> sentences bucket_count:", bucket_count,
-                  "bucket sizes:", [(len(s), [t["idx"] for t in s]) for s in all_sentences],
-                  "bucket_max_size:", bucket_max_size)
-        for sentences in all_sentences:
-            temp_tokens: List[torch.Tensor] = []
-            all_text_tokens.append(temp_tokens)
+        buckets = self.iter_sentence_buckets(text, max_text_tokens_per_sentence, bucket_max_size=bucket_max_size,
+                                             pipeline_frontend=pipeline_frontend, verbose=verbose,
+                                             cancel_event=cancel_event)
+        if not pipeline_frontend:
+            # 先完成全部分桶，与 gpt 推理的进度分开统计
+            buckets = list(buckets)
+
+        # Sequential processing of bucketing data
+        all_batch_num = sum(len(s) for s in buckets) if not pipeline_frontend else 0
+        all_batch_codes = []
+        processed_num = 0
+        for sentences in buckets:
+            check_cancelled(cancel_event)
+            item_tokens: List[torch.Tensor] = []
             for item in sentences:
                 sent = item["sent"]
-                text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
-                text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
+                text_tokens = torch.tensor(sent, dtype=torch.int32, device=self.device).unsqueeze(0)
                 if verbose:
                     print(text_tokens)
                     print(f"text_tokens shape: {text_tokens.shape}, text_tokens type: {text_tokens.dtype}")
                     # debug tokenizer
-                    text_token_syms = self.tokenizer.convert_ids_to_tokens(text_tokens[0].tolist())
-                    print("text_token_syms is same as sentence tokens", text_token_syms == sent) 
-                temp_tokens.append(text_tokens)
-        
-            
-        # Sequential processing of bucketing data
-        all_batch_num = sum(len(s) for s in all_sentences)
-        all_batch_codes = []
-        processed_num = 0
-        for item_tokens in all_text_tokens:
+                    print("text_token_syms:", self.tokenizer.convert_ids_to_tokens(sent.tolist()))
+                item_tokens.append(text_tokens)
+            all_sentences.append(sentences)
+            all_text_tokens.append(item_tokens)
             batch_num = len(item_tokens)
+            if pipeline_frontend:
+                # 后续段落还在处理中, 总数按已经分桶的句子计算
+                all_batch_num += batch_num
             if batch_num > 1:
                 batch_text_tokens = self.pad_tokens_cat(item_tokens)
             else:
@@ -384,6 +518,7 @@ class IndexTTS:
                 with torch.amp.autocast(batch_text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
                     temp_codes = self.gpt.inference_speech(auto_conditioning, batch_text_tokens,
                                         cond_mel_lengths=cond_mel_lengths,
+                                        conds_latent=conds_latent,
                                         # text_lengths=text_len,
                                         do_sample=do_sample,
                                         top_p=top_p,
@@ -394,6 +529,7 @@ class IndexTTS:
                                         num_beams=num_beams,
                                         repetition_penalty=repetition_penalty,
                                         max_generate_length=max_mel_tokens,
+                                        cancel_event=cancel_event,
                                         **generation_kwargs)
                     all_batch_codes.append(temp_codes)
             gpt_gen_time += time.perf_counter() - m_start_time
@@ -413,28 +549,30 @@ class IndexTTS:
                         category=RuntimeWarning
                     )
                     has_warned = True
-                codes = codes.unsqueeze(0)  # [x] -> [1, x]
-                if verbose:
-                    print("codes:", codes.shape)
-                    print(codes)
-                codes, code_lens = self.remove_long_silence(codes, silent_token=52, max_consecutive=30)
-                if verbose:
-                    print("fix codes:", codes.shape)
-                    print(codes)
-                    print("code_lens:", code_lens)
-                text_tokens = batch_tokens[i]
                 all_idxs.append(batch_sentences[i]["idx"])
-                m_start_time = time.perf_counter()
-                with torch.no_grad():
-                    with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
-                        latent = \
-                            self.gpt(auto_conditioning, text_tokens,
-                                        torch.tensor([text_tokens.shape[-1]], device=text_tokens.device), codes,
-                                        code_lens*self.gpt.mel_length_compression,
-                                        cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]], device=text_tokens.device),
-                                        return_latent=True, clip_inputs=False)
-                        gpt_forward_time += time.perf_counter() - m_start_time
-                        all_latents.append(latent)
+            # 整个 bucket 一次前向计算 latent
+            codes, code_lens = self.remove_long_silence(batch_codes, silent_token=52, max_consecutive=30)
+            if verbose:
+                print("fix codes:", codes.shape)
+                print(codes)
+            text_tokens = self.pad_tokens_cat(batch_tokens) if len(batch_tokens) > 1 else batch_tokens[0]
+            text_lens = torch.tensor([t.shape[-1] for t in batch_tokens], device=text_tokens.device)
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    latent = \
+                        self.gpt(auto_conditioning, text_tokens,
+                                    text_lens, codes,
+                                    code_lens*self.gpt.mel_length_compression,
+                                    cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]], device=text_tokens.device),
+                                    conds_latent=conds_latent,
+                                    return_latent=True, clip_inputs=False)
+            gpt_forward_time += time.perf_counter() - m_start_time
+            if verbose:
+                print("code_lens:", code_lens)
+            for i in range(latent.shape[0]):
+                all_latents.append(latent[i:i+1, :code_lens[i]])
+        bucket_count = len(all_sentences)
         del all_batch_codes, all_text_tokens, all_sentences
         # bigvgan chunk
         chunk_size = 2
@@ -450,12 +588,13 @@ class IndexTTS:
         self._set_gr_progress(0.7, "bigvgan decode...")
         tqdm_progress = tqdm(total=latent_length, desc="bigvgan")
         for items in chunk_latents:
+            check_cancelled(cancel_event)
             tqdm_progress.update(len(items))
-            latent = torch.cat(items, dim=1)
+            latent = self.scale_latent_speed(torch.cat(items, dim=1), speed_rate)
             with torch.no_grad():
                 with torch.amp.autocast(latent.device.type, enabled=self.dtype is not None, dtype=self.dtype):
                     m_start_time = time.perf_counter()
-                    wav, _ = self.bigvgan(latent, auto_conditioning.transpose(1, 2))
+                    wav, _ = self.bigvgan(latent, speaker_embedding=speaker_embedding)
                     bigvgan_time += time.perf_counter() - m_start_time
                     wav = wav.squeeze(1)
                     pass
@@ -504,34 +643,22 @@ class IndexTTS:
             print(f"origin text:{text}")
         start_time = time.perf_counter()
 
-        # 如果参考音频改变了，才需要重新生成 cond_mel, 提升速度
-        if self.cache_cond_mel is None or self.cache_audio_prompt != audio_prompt:
-            audio, sr = torchaudio.load(audio_prompt)
-            audio = torch.mean(audio, dim=0, keepdim=True)
-            if audio.shape[0] > 1:
-                audio = audio[0].unsqueeze(0)
-            audio = torchaudio.transforms.Resample(sr, 24000)(audio)
-            cond_mel = MelSpectrogramFeatures()(audio).to(self.device)
-            cond_mel_frame = cond_mel.shape[-1]
-            if verbose:
-                print(f"cond_mel shape: {cond_mel.shape}", "dtype:", cond_mel.dtype)
-
-            self.cache_audio_prompt = audio_prompt
-            self.cache_cond_mel = cond_mel
-        else:
-            cond_mel = self.cache_cond_mel
-            cond_mel_frame = cond_mel.shape[-1]
-            pass
+        # 参考音频的 cond_mel 等已缓存时直接复用, 提升速度
+        voice = self.get_voice_conditioning(audio_prompt, verbose=verbose)
+        cond_mel = voice.cond_mel
+        cond_mel_frame = voice.cond_mel_frame
+        # 条件 latent 和说话人 embedding 每个参考音频只计算一次, 所有句子共享
+        conds_latent = voice.conds_latent
+        speaker_embedding = voice.speaker_embedding
 
         self._set_gr_progress(0.1, "text processing...")
         auto_conditioning = cond_mel
-        text_tokens_list = self.tokenizer.tokenize(text)
-        sentences = self.tokenizer.split_sentences(text_tokens_list, max_text_tokens_per_sentence)
+        sentences = self.tokenize_sentences(text, max_text_tokens_per_sentence, verbose=verbose)
         if verbose:
-            print("text token count:", len(text_tokens_list))
+            print("text token count:", sum(len(sent) for sent in sentences))
             print("sentences count:", len(sentences))
             print("max_text_tokens_per_sentence:", max_text_tokens_per_sentence)
-            print(*sentences, sep="\n")
+            print(*[self.tokenizer.convert_ids_to_tokens(sent.tolist()) for sent in sentences], sep="\n")
         do_sample = generation_kwargs.pop("do_sample", True)
         top_p = generation_kwargs.pop("top_p", 0.8)
         top_k = generation_kwargs.pop("top_k", 30)
@@ -541,6 +668,8 @@ class IndexTTS:
         num_beams = generation_kwargs.pop("num_beams", 3)
         repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
         max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        speed_rate = generation_kwargs.pop("speed_rate", 1.0)
+        cancel_event = generation_kwargs.pop("cancel_event", None)
         sampling_rate = 24000
         # lang = "EN"
         # lang = "ZH"
@@ -551,8 +680,8 @@ class IndexTTS:
         progress = 0
         has_warned = False
         for sent in sentences:
-            text_tokens = self.tokenizer.convert_tokens_to_ids(sent)
-            text_tokens = torch.tensor(text_tokens, dtype=torch.int32, device=self.device).unsqueeze(0)
+            check_cancelled(cancel_event)
+            text_tokens = torch.tensor(sent, dtype=torch.int32, device=self.device).unsqueeze(0)
             # text_tokens = F.pad(text_tokens, (0, 1))  # This may not be necessary.
             # text_tokens = F.pad(text_tokens, (1, 0), value=0)
             # text_tokens = F.pad(text_tokens, (0, 1), value=1)
@@ -560,8 +689,7 @@ class IndexTTS:
                 print(text_tokens)
                 print(f"text_tokens shape: {text_tokens.shape}, text_tokens type: {text_tokens.dtype}")
                 # debug tokenizer
-                text_token_syms = self.tokenizer.convert_ids_to_tokens(text_tokens[0].tolist())
-                print("text_token_syms is same as sentence tokens", text_token_syms == sent)
+                print("text_token_syms:", self.tokenizer.convert_ids_to_tokens(sent.tolist()))
 
             # text_len = torch.IntTensor([text_tokens.size(1)], device=text_tokens.device)
             # print(text_len)
@@ -573,6 +701,7 @@ class IndexTTS:
                     codes = self.gpt.inference_speech(auto_conditioning, text_tokens,
                                                         cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]],
                                                                                       device=text_tokens.device),
+                                                        conds_latent=conds_latent,
                                                         # text_lengths=text_len,
                                                         do_sample=do_sample,
                                                         top_p=top_p,
@@ -583,6 +712,7 @@ class IndexTTS:
                                                         num_beams=num_beams,
                                                         repetition_penalty=repetition_penalty,
                                                         max_generate_length=max_mel_tokens,
+                                                        cancel_event=cancel_event,
                                                         **generation_kwargs)
                 gpt_gen_time += time.perf_counter() - m_start_time
                 if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
@@ -616,11 +746,13 @@ class IndexTTS:
                                     torch.tensor([text_tokens.shape[-1]], device=text_tokens.device), codes,
                                     code_lens*self.gpt.mel_length_compression,
                                     cond_mel_lengths=torch.tensor([auto_conditioning.shape[-1]], device=text_tokens.device),
+                                    conds_latent=conds_latent,
                                     return_latent=True, clip_inputs=False)
                     gpt_forward_time += time.perf_counter() - m_start_time
 
                     m_start_time = time.perf_counter()
-                    wav, _ = self.bigvgan(latent, auto_conditioning.transpose(1, 2))
+                    latent = self.scale_latent_speed(latent, speed_rate)
+                    wav, _ = self.bigvgan(latent, speaker_embedding=speaker_embedding)
                     bigvgan_time += time.perf_counter() - m_start_time
                     wav = wav.squeeze(1)
 
@@ -659,6 +791,358 @@ class IndexTTS:
             wav_data = wav_data.numpy().T
             return (sampling_rate, wav_data)
 
+    # 流式推理：每句（或每批相邻句子）声码完成后立即返回，首包延迟约等于第一句的合成时间
+    def infer_stream(self, audio_prompt, text, verbose=False, max_text_tokens_per_sentence=120,
+                     sentences_bucket_max_size=1, output_dtype="int16", **generation_kwargs):
+        """
+        按原始句子顺序逐句 yield 音频块，调用方拿到第一块即可开始播放或发送。
+        Args:
+            ``sentences_bucket_max_size``: 相邻句子合并为一个 batch 生成的最大句数，默认``1``
+                - 越大，吞吐越高，首包延迟越大；不会打乱句子顺序（CPU 上固定为 1）
+            ``output_dtype``: ``"int16"``（与 `infer` 保存的 wav 一致）或 ``"float32"``（范围 [-1, 1]）
+            ``generation_kwargs``: 同 `infer`，包括 ``speed_rate``、``cancel_event``
+        Yields:
+            dict:
+                - ``index``: 句子序号（从 0 开始），``total``: 句子总数
+                - ``sampling_rate``: 采样率
+                - ``wav``: 本句音频，numpy 数组，shape ``(samples,)``
+                - ``audio_duration``: 本句音频时长（秒）
+                - ``gpt_gen_time`` / ``gpt_forward_time`` / ``bigvgan_time``: 本块各阶段耗时（秒），
+                  同一 batch 的 GPT 耗时只计入该 batch 的第一块
+                - ``elapsed``: 从调用开始到本块产出的耗时（秒），第一块的值即首包延迟
+        """
+        if output_dtype not in ("int16", "float32"):
+            raise ValueError(f"output_dtype must be 'int16' or 'float32', got {output_dtype!r}")
+        print(">> start stream inference...")
+        if verbose:
+            print(f"origin text:{text}")
+        start_time = time.perf_counter()
+
+        voice = self.get_voice_conditioning(audio_prompt, verbose=verbose)
+        cond_mel = voice.cond_mel
+        cond_mel_lengths = torch.tensor([voice.cond_mel_frame], device=self.device)
+        conds_latent = voice.conds_latent
+        speaker_embedding = voice.speaker_embedding
+
+        sentences = self.tokenize_sentences(text, max_text_tokens_per_sentence, verbose=verbose)
+        if verbose:
+            print("text token count:", sum(len(sent) for sent in sentences))
+            print("sentences count:", len(sentences))
+            print(*[self.tokenizer.convert_ids_to_tokens(sent.tolist()) for sent in sentences], sep="\n")
+        do_sample = generation_kwargs.pop("do_sample", True)
+        top_p = generation_kwargs.pop("top_p", 0.8)
+        top_k = generation_kwargs.pop("top_k", 30)
+        temperature = generation_kwargs.pop("temperature", 1.0)
+        autoregressive_batch_size = 1
+        length_penalty = generation_kwargs.pop("length_penalty", 0.0)
+        num_beams = generation_kwargs.pop("num_beams", 3)
+        repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        speed_rate = generation_kwargs.pop("speed_rate", 1.0)
+        cancel_event = generation_kwargs.pop("cancel_event", None)
+        sampling_rate = 24000
+
+        bucket_max_size = max(1, sentences_bucket_max_size) if self.device != "cpu" else 1
+        has_warned = False
+        first_chunk_time = None
+        wav_length = 0
+        for bucket_start in range(0, len(sentences), bucket_max_size):
+            # 只合并相邻的句子，保证按原始顺序输出
+            bucket = sentences[bucket_start:bucket_start + bucket_max_size]
+            check_cancelled(cancel_event)
+            item_tokens = [
+                torch.tensor(sent, dtype=torch.int32, device=self.device).unsqueeze(0)
+                for sent in bucket
+            ]
+            text_tokens = self.pad_tokens_cat(item_tokens) if len(item_tokens) > 1 else item_tokens[0]
+            text_lens = torch.tensor([t.shape[-1] for t in item_tokens], device=text_tokens.device)
+
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    codes = self.gpt.inference_speech(cond_mel, text_tokens,
+                                                      cond_mel_lengths=cond_mel_lengths,
+                                                      conds_latent=conds_latent,
+                                                      do_sample=do_sample,
+                                                      top_p=top_p,
+                                                      top_k=top_k,
+                                                      temperature=temperature,
+                                                      num_return_sequences=autoregressive_batch_size,
+                                                      length_penalty=length_penalty,
+                                                      num_beams=num_beams,
+                                                      repetition_penalty=repetition_penalty,
+                                                      max_generate_length=max_mel_tokens,
+                                                      cancel_event=cancel_event,
+                                                      **generation_kwargs)
+            gpt_gen_time = time.perf_counter() - m_start_time
+            if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
+                warnings.warn(
+                    f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                    f"Consider reducing `max_text_tokens_per_sentence`({max_text_tokens_per_sentence}) or increasing `max_mel_tokens`.",
+                    category=RuntimeWarning
+                )
+                has_warned = True
+
+            codes, code_lens = self.remove_long_silence(codes, silent_token=52, max_consecutive=30)
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    latent = self.gpt(cond_mel, text_tokens, text_lens, codes,
+                                      code_lens*self.gpt.mel_length_compression,
+                                      cond_mel_lengths=cond_mel_lengths,
+                                      conds_latent=conds_latent,
+                                      return_latent=True, clip_inputs=False)
+            gpt_forward_time = time.perf_counter() - m_start_time
+            if verbose:
+                print("code_lens:", code_lens)
+
+            for i in range(len(bucket)):
+                check_cancelled(cancel_event)
+                m_start_time = time.perf_counter()
+                with torch.no_grad():
+                    with torch.amp.autocast(latent.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                        wav, _ = self.bigvgan(self.scale_latent_speed(latent[i:i+1, :code_lens[i]], speed_rate),
+                                              speaker_embedding=speaker_embedding)
+                bigvgan_time = time.perf_counter() - m_start_time
+                wav = wav.squeeze(1).squeeze(0).float().cpu()
+                if output_dtype == "int16":
+                    wav = torch.clamp(32767 * wav, -32767.0, 32767.0).type(torch.int16)
+                else:
+                    wav = torch.clamp(wav, -1.0, 1.0)
+                elapsed = time.perf_counter() - start_time
+                if first_chunk_time is None:
+                    first_chunk_time = elapsed
+                wav_length += wav.shape[-1] / sampling_rate
+                yield {
+                    "index": bucket_start + i,
+                    "total": len(sentences),
+                    "sampling_rate": sampling_rate,
+                    "wav": wav.numpy(),
+                    "audio_duration": wav.shape[-1] / sampling_rate,
+                    "gpt_gen_time": gpt_gen_time if i == 0 else 0,
+                    "gpt_forward_time": gpt_forward_time if i == 0 else 0,
+                    "bigvgan_time": bigvgan_time,
+                    "elapsed": elapsed,
+                }
+
+        end_time = time.perf_counter()
+        self.torch_empty_cache()
+        if first_chunk_time is not None:
+            print(f">> [stream] First chunk latency: {first_chunk_time:.2f} seconds")
+            print(f">> [stream] Total inference time: {end_time - start_time:.2f} seconds")
+            print(f">> [stream] Generated audio length: {wav_length:.2f} seconds")
+            if wav_length > 0:
+                print(f">> [stream] RTF: {(end_time - start_time) / wav_length:.4f}")
+
+    # 多请求合并推理：不同参考音频、不同文本的句子放进同一个 GPT batch，按请求拆分输出
+    def infer_batch(self, audio_prompts: List[str], texts: List[str], output_paths: List[str] = None, verbose=False,
+                    max_text_tokens_per_sentence=100, sentences_bucket_max_size=4, max_batch_slots=None,
+                    cancel_events: List = None, **generation_kwargs):
+        """
+        Args:
+            ``audio_prompts``, ``texts``: 每个请求的参考音频和文本，一一对应
+            ``output_paths``: 每个请求的输出路径，为 ``None`` 时返回 ``[(sampling_rate, wav_data), ...]``
+            ``sentences_bucket_max_size``: 同 `infer_fast`，所有请求的句子一起按长度分桶
+            ``max_batch_slots``: 设置后使用 `ContinuousBatchingEngine` 逐步调度生成 mel codes，默认``None``（分桶静态 batch）
+                - 句子生成结束后立即让出 kv cache 的行，排队的句子马上补进来，每句占用 ``num_beams`` 行
+                - 调度统计见 ``self.last_batching_stats``
+            ``cancel_events``: 每个请求的 `threading.Event`（可为 ``None``），设置后该请求的句子不再生成和声码，
+                结果为 ``None``；所有请求都取消时抛出 `InferenceCancelled`
+            ``generation_kwargs``: 同 `infer_fast`，所有请求共用
+        每行使用各自参考音频的 conditioning latent（见 `UnifiedVoice.prepare_gpt_inputs`）和 speaker embedding，
+        同一请求的句子按原始顺序拼接。
+        """
+        assert len(audio_prompts) == len(texts), "audio_prompts and texts must have the same length"
+        if output_paths is not None:
+            assert len(output_paths) == len(texts), "output_paths and texts must have the same length"
+        cancel_events = list(cancel_events) if cancel_events is not None else [None] * len(texts)
+        assert len(cancel_events) == len(texts), "cancel_events and texts must have the same length"
+        # 所有请求都取消时整个 batch 停止
+        batch_cancel_event = AllEvents(cancel_events) if all(e is not None for e in cancel_events) else None
+
+        def is_cancelled(req_idx):
+            return cancel_events[req_idx] is not None and cancel_events[req_idx].is_set()
+
+        print(f">> start batch inference, requests: {len(texts)}")
+        start_time = time.perf_counter()
+
+        voices = [self.get_voice_conditioning(audio_prompt, verbose=verbose) for audio_prompt in audio_prompts]
+        # 所有请求的句子展开成一个列表, 记录每句所属的请求
+        all_sentences = []
+        sentence_owners = []
+        for req_idx, text in enumerate(texts):
+            sentences = self.tokenize_sentences(text, max_text_tokens_per_sentence, verbose=verbose)
+            all_sentences.extend(sentences)
+            sentence_owners.extend([req_idx] * len(sentences))
+        if verbose:
+            print("sentences count:", len(all_sentences), "owners:", sentence_owners)
+
+        do_sample = generation_kwargs.pop("do_sample", True)
+        top_p = generation_kwargs.pop("top_p", 0.8)
+        top_k = generation_kwargs.pop("top_k", 30)
+        temperature = generation_kwargs.pop("temperature", 1.0)
+        autoregressive_batch_size = 1
+        length_penalty = generation_kwargs.pop("length_penalty", 0.0)
+        num_beams = generation_kwargs.pop("num_beams", 3)
+        repetition_penalty = generation_kwargs.pop("repetition_penalty", 10.0)
+        max_mel_tokens = generation_kwargs.pop("max_mel_tokens", 600)
+        speed_rate = generation_kwargs.pop("speed_rate", 1.0)
+        sampling_rate = 24000
+        gpt_gen_time = 0
+        gpt_forward_time = 0
+        bigvgan_time = 0
+
+        bucket_max_size = sentences_bucket_max_size if self.device != "cpu" else 1
+        buckets = self.bucket_sentences(all_sentences, bucket_max_size=bucket_max_size)
+        all_text_tokens = [
+            torch.tensor(sent, dtype=torch.int32, device=self.device).unsqueeze(0)
+            for sent in all_sentences
+        ]
+        engine_codes = None
+        if max_batch_slots:
+            # kv cache 按最长的句子一次分配, 生成过程中不再扩容
+            engine = ContinuousBatchingEngine(self.gpt, max_batch_slots=max_batch_slots,
+                                              max_generate_length=max_mel_tokens,
+                                              max_text_tokens=max(len(sent) for sent in all_sentences),
+                                              do_sample=do_sample,
+                                              top_p=top_p,
+                                              top_k=top_k,
+                                              temperature=temperature,
+                                              length_penalty=length_penalty,
+                                              num_beams=num_beams,
+                                              repetition_penalty=repetition_penalty,
+                                              **generation_kwargs)
+            # 按分桶顺序排队, 长度相近的句子先后进入
+            seq_ids = {item["idx"]: engine.add_request(all_text_tokens[item["idx"]], voices[sentence_owners[item["idx"]]].conds_latent)
+                       for bucket in buckets for item in bucket}
+            m_start_time = time.perf_counter()
+            cancelled_owners = set()
+            with torch.amp.autocast(torch.device(self.device).type, enabled=self.dtype is not None, dtype=self.dtype):
+                while engine.has_unfinished():
+                    check_cancelled(batch_cancel_event)
+                    # 已取消请求的句子立即让出 kv cache 的行
+                    newly_cancelled = {req_idx for req_idx in range(len(texts))
+                                       if req_idx not in cancelled_owners and is_cancelled(req_idx)}
+                    if newly_cancelled:
+                        cancelled_owners |= newly_cancelled
+                        engine.cancel([seq_id for idx, seq_id in seq_ids.items() if sentence_owners[idx] in newly_cancelled])
+                    engine.step()
+                results = engine.pop_finished()
+            gpt_gen_time += time.perf_counter() - m_start_time
+            engine_codes = {idx: results[seq_id] for idx, seq_id in seq_ids.items() if seq_id in results}
+            self.last_batching_stats = engine.stats()
+            if verbose:
+                print(">> continuous batching:", self.last_batching_stats)
+        all_latents: Dict[int, torch.Tensor] = {}
+        has_warned = False
+        for bucket in buckets:
+            check_cancelled(batch_cancel_event)
+            bucket = [item for item in bucket if not is_cancelled(sentence_owners[item["idx"]])]
+            if len(bucket) == 0:
+                continue
+            item_tokens = [all_text_tokens[item["idx"]] for item in bucket]
+            text_tokens = self.pad_tokens_cat(item_tokens) if len(item_tokens) > 1 else item_tokens[0]
+            text_lens = torch.tensor([t.shape[-1] for t in item_tokens], device=text_tokens.device)
+            # 每行使用所属请求的 conditioning latent
+            conds_latent = torch.cat([voices[sentence_owners[item["idx"]]].conds_latent for item in bucket], dim=0)
+
+            if engine_codes is not None:
+                codes = pad_sequence([engine_codes[item["idx"]].squeeze(0) for item in bucket], batch_first=True,
+                                     padding_value=self.stop_mel_token)
+            else:
+                # 整个 bucket 的请求都取消时停止这个 bucket 的解码
+                owner_events = [cancel_events[sentence_owners[item["idx"]]] for item in bucket]
+                bucket_cancel_event = AllEvents(owner_events) if all(e is not None for e in owner_events) else None
+                m_start_time = time.perf_counter()
+                try:
+                    with torch.no_grad():
+                        with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                            codes = self.gpt.inference_speech(None, text_tokens,
+                                                              conds_latent=conds_latent,
+                                                              do_sample=do_sample,
+                                                              top_p=top_p,
+                                                              top_k=top_k,
+                                                              temperature=temperature,
+                                                              num_return_sequences=autoregressive_batch_size,
+                                                              length_penalty=length_penalty,
+                                                              num_beams=num_beams,
+                                                              repetition_penalty=repetition_penalty,
+                                                              max_generate_length=max_mel_tokens,
+                                                              cancel_event=bucket_cancel_event,
+                                                              **generation_kwargs)
+                except InferenceCancelled:
+                    continue
+                gpt_gen_time += time.perf_counter() - m_start_time
+            if not has_warned and (codes[:, -1] != self.stop_mel_token).any():
+                warnings.warn(
+                    f"WARN: generation stopped due to exceeding `max_mel_tokens` ({max_mel_tokens}). "
+                    f"Consider reducing `max_text_tokens_per_sentence`({max_text_tokens_per_sentence}) or increasing `max_mel_tokens`.",
+                    category=RuntimeWarning
+                )
+                has_warned = True
+
+            codes, code_lens = self.remove_long_silence(codes, silent_token=52, max_consecutive=30)
+            m_start_time = time.perf_counter()
+            with torch.no_grad():
+                with torch.amp.autocast(text_tokens.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                    latent = self.gpt(None, text_tokens, text_lens, codes,
+                                      code_lens*self.gpt.mel_length_compression,
+                                      conds_latent=conds_latent,
+                                      return_latent=True, clip_inputs=False)
+            gpt_forward_time += time.perf_counter() - m_start_time
+            for i, item in enumerate(bucket):
+                all_latents[item["idx"]] = latent[i:i+1, :code_lens[i]]
+
+        # 按请求拆分, 每个请求的句子按原始顺序拼接后用该请求的 speaker embedding 声码
+        chunk_size = 2
+        wavs = []
+        for req_idx, voice in enumerate(voices):
+            if is_cancelled(req_idx):
+                wavs.append(None)
+                continue
+            latents = [all_latents[idx] for idx in sorted(all_latents) if sentence_owners[idx] == req_idx]
+            req_wavs = [torch.zeros(1, 0)]
+            for i in range(0, len(latents), chunk_size):
+                check_cancelled(batch_cancel_event)
+                if is_cancelled(req_idx):
+                    break
+                latent = self.scale_latent_speed(torch.cat(latents[i:i + chunk_size], dim=1), speed_rate)
+                m_start_time = time.perf_counter()
+                with torch.no_grad():
+                    with torch.amp.autocast(latent.device.type, enabled=self.dtype is not None, dtype=self.dtype):
+                        wav, _ = self.bigvgan(latent, speaker_embedding=voice.speaker_embedding)
+                bigvgan_time += time.perf_counter() - m_start_time
+                wav = torch.clamp(32767 * wav.squeeze(1), -32767.0, 32767.0)
+                req_wavs.append(wav.cpu())
+            wavs.append(torch.cat(req_wavs, dim=1) if not is_cancelled(req_idx) else None)
+        del all_latents
+        end_time = time.perf_counter()
+        self.torch_empty_cache()
+
+        wav_length = sum(wav.shape[-1] for wav in wavs if wav is not None) / sampling_rate
+        print(f">> gpt_gen_time: {gpt_gen_time:.2f} seconds")
+        print(f">> gpt_forward_time: {gpt_forward_time:.2f} seconds")
+        print(f">> bigvgan_time: {bigvgan_time:.2f} seconds")
+        print(f">> Total batch inference time: {end_time - start_time:.2f} seconds")
+        print(f">> Generated audio length: {wav_length:.2f} seconds")
+        print(f">> [batch] requests: {len(texts)} sentences: {len(all_sentences)} bucket_count: {len(buckets)}")
+        if engine_codes is not None:
+            print(f">> [batch] continuous batching steps: {self.last_batching_stats['steps']}, "
+                  f"avg_utilization: {self.last_batching_stats['avg_utilization']}")
+        if wav_length > 0:
+            print(f">> [batch] RTF: {(end_time - start_time) / wav_length:.4f}")
+
+        if output_paths is not None:
+            for output_path, wav in zip(output_paths, wavs):
+                if wav is None:
+                    continue
+                if os.path.dirname(output_path) != "":
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                torchaudio.save(output_path, wav.type(torch.int16), sampling_rate)
+            print(">> wav files saved to:", output_paths)
+            return [output_path if wav is not None else None for output_path, wav in zip(output_paths, wavs)]
+        return [(sampling_rate, wav.type(torch.int16).numpy().T) if wav is not None else None for wav in wavs]
+
 
 if __name__ == "__main__":
     prompt_wav="test_data/input.wav"
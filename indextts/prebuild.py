@@ -0,0 +1,48 @@
+import os
+import sys
+import time
+import warnings
+# Suppress warnings from tensorflow and other libraries
+warnings.filterwarnings("ignore", category=UserWarning)
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+
+def main():
+    """
+    Build the text normalizer FST caches ahead of time, e.g. in a `RUN` step of a Docker image,
+    so that the first `IndexTTS` in a new container only reads them.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="Prebuild the IndexTTS text normalizer FST caches")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Directory of the Chinese tagger cache. Default is $INDEXTTS_TAGGER_CACHE_DIR or indextts/utils/tagger_cache")
+    parser.add_argument("--overwrite", action="store_true", default=False,
+                        help="Rebuild the caches even if they exist, e.g. after upgrading WeTextProcessing/pynini")
+    args = parser.parse_args()
+
+    from indextts.utils.front import TextNormalizer
+    normalizer = TextNormalizer(args.cache_dir)
+    print(f">> Building text normalizer FSTs in {normalizer.cache_dir} ...")
+    start_time = time.perf_counter()
+    try:
+        normalizer.load(overwrite_cache=args.overwrite)
+    except ImportError as e:
+        print(f"ERROR: {e}. Install WeTextProcessing (wetext on macOS) first.")
+        sys.exit(1)
+    print(f">> Text normalizer loaded in {time.perf_counter() - start_time:.1f}s")
+    if os.path.isdir(normalizer.cache_dir):
+        for name in sorted(os.listdir(normalizer.cache_dir)):
+            if name.endswith(".fst"):
+                size = os.path.getsize(os.path.join(normalizer.cache_dir, name))
+                print(f"   {name}: {size / 1024 / 1024:.1f} MB")
+    # smoke test, also loads the FSTs once from the cache
+    start_time = time.perf_counter()
+    reloaded = TextNormalizer(normalizer.cache_dir)
+    reloaded.load()
+    print(f">> Reloaded from the cache in {time.perf_counter() - start_time:.1f}s")
+    for text in ["现在是北京时间2025年01月11日 20:00", "This sales for 2.5% off, only $12.5."]:
+        print(f"   {text} -> {reloaded.normalize(text)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import functools
+import math
+from fractions import Fraction
+
+import torch
+import torchaudio
+
+
+@functools.lru_cache(maxsize=16)
+def _stft_constants(n_fft: int, hop_length: int, device: torch.device, dtype: torch.dtype):
+    """Hann window and the expected phase advance per hop of each bin, (n_fft // 2 + 1, 1)"""
+    window = torch.hann_window(n_fft, device=device, dtype=dtype)
+    phase_advance = torch.linspace(0, math.pi * hop_length, n_fft // 2 + 1, device=device, dtype=dtype)[..., None]
+    return window, phase_advance
+
+
+@functools.lru_cache(maxsize=16)
+def _resampler(orig_freq: int, new_freq: int, device: torch.device, dtype: torch.dtype) -> torchaudio.transforms.Resample:
+    """`Resample` builds the sinc kernel once, `torchaudio.functional.resample` rebuilds it on every call"""
+    return torchaudio.transforms.Resample(orig_freq, new_freq, dtype=dtype).to(device)
+
+
+def phase_vocoder(spec: torch.Tensor, rate: float, phase_advance: torch.Tensor) -> torch.Tensor:
+    """
+    Same result as `torchaudio.functional.phase_vocoder`, about 2x faster on CPU:
+    the magnitudes, phases and phase increments are computed once per input frame instead of
+    twice per output frame, and the frames are gathered as contiguous rows.
+    Args:
+        ``spec``: complex STFT of shape (freq, time)
+        ``phase_advance``: (freq, 1)
+    """
+    time_steps = torch.arange(0, spec.shape[-1], rate, device=spec.device, dtype=phase_advance.dtype)
+    index = time_steps.long()
+    alphas = (time_steps - index)[:, None]
+    frames = spec.transpose(-1, -2)  # (time, freq)
+    phase = frames.angle()
+    magnitude = torch.nn.functional.pad(frames.abs(), (0, 0, 0, 2))
+    phase_advance = phase_advance.transpose(-1, -2)
+    delta = torch.diff(phase, dim=-2, append=phase.new_zeros(2, phase.shape[-1])) - phase_advance
+    delta = delta - 2 * math.pi * torch.round(delta * (0.5 / math.pi)) + phase_advance
+    magnitude = torch.lerp(magnitude.index_select(-2, index), magnitude.index_select(-2, index + 1), alphas)
+    phase = torch.cat([phase[:1], delta.index_select(-2, index[:-1])], dim=-2).cumsum(-2)
+    return torch.polar(magnitude, phase).transpose(-1, -2)
+
+
+def time_stretch(wav: torch.Tensor, rate: float, n_fft: int = 1024, hop_length: int = 256) -> torch.Tensor:
+    """
+    Phase-vocoder time stretch, the pitch is unchanged.
+    Args:
+        ``wav``: float waveform of shape (T,)
+        ``rate``: speed factor, ``rate > 1`` is faster / shorter, the output has ``round(T / rate)`` samples
+    """
+    if rate == 1.0:
+        return wav
+    length = wav.shape[-1]
+    window, phase_advance = _stft_constants(n_fft, hop_length, wav.device, wav.dtype)
+    # zero padding: the phase vocoder starts from the phases of the first frame,
+    # a reflected first frame puts adjacent bins out of phase and the partials cancel out
+    spec = torch.stft(wav, n_fft, hop_length=hop_length, window=window, pad_mode="constant", return_complex=True)
+    stretched = phase_vocoder(spec, rate, phase_advance)
+    return torch.istft(stretched, n_fft, hop_length=hop_length, window=window, length=int(round(length / rate)))
+
+
+def resample_ratio(wav: torch.Tensor, ratio: float, max_denominator: int = 64) -> torch.Tensor:
+    """
+    Resample so the output has ``T / ratio`` samples.
+    The ratio is approximated by a small fraction, resampling between close but coprime rates
+    (e.g. 24000 -> 26939) would otherwise build a huge sinc kernel.
+    """
+    if ratio == 1.0:
+        return wav
+    fraction = Fraction(ratio).limit_denominator(max_denominator)
+    return _resampler(fraction.numerator, fraction.denominator, wav.device, wav.dtype)(wav)
+
+
+def pitch_shift(wav: torch.Tensor, n_steps: float, speed_rate: float = 1.0, n_fft: int = 1024,
+                hop_length: int = 256) -> torch.Tensor:
+    """
+    Shift the pitch by ``n_steps`` semitones and change the speed by ``speed_rate`` in one phase-vocoder pass:
+    time stretch by ``speed_rate / ratio`` then resample by ``ratio``, the output has ``round(T / speed_rate)`` samples.
+    """
+    if n_steps == 0.0:
+        return time_stretch(wav, speed_rate, n_fft, hop_length)
+    ratio = 2 ** (n_steps / 12.0)
+    length = int(round(wav.shape[-1] / speed_rate))
+    shifted = resample_ratio(time_stretch(wav, speed_rate / ratio, n_fft, hop_length), ratio)
+    if shifted.shape[-1] >= length:
+        return shifted[..., :length]
+    return torch.nn.functional.pad(shifted, (0, length - shifted.shape[-1]))
+
+
+def apply_gain(wav: torch.Tensor, gain_db: float) -> torch.Tensor:
+    if gain_db == 0.0:
+        return wav
+    return wav * (10 ** (gain_db / 20.0))
+
+
+@torch.no_grad()
+def apply_audio_effects(wav: torch.Tensor, pitch_shift_steps: float = 0.0, speed_rate: float = 1.0,
+                        volume_gain: float = 0.0, device=None) -> torch.Tensor:
+    """
+    Pitch / speed / volume effects on the vocoder output, the sampling rate is unchanged.
+    Batching several outputs is slower than processing them one by one on CPU, so only a single waveform is accepted.
+    Args:
+        ``wav``: waveform of shape (T,); int16 input is processed in float and returned as int16
+        ``pitch_shift_steps``: semitones, the duration is unchanged
+        ``speed_rate``: playback speed, the duration becomes ``T / speed_rate`` and the pitch is unchanged
+        ``volume_gain``: dB
+        ``device``: run the effects on this device (e.g. the model's GPU), the result is moved back
+    """
+    if wav.dim() != 1:
+        raise ValueError(f"expected a waveform of shape (T,), got {tuple(wav.shape)}")
+    source_device, source_dtype = wav.device, wav.dtype
+    is_int16 = source_dtype == torch.int16
+    x = wav.to(device or source_device, torch.float32)
+    if is_int16:
+        x = x / 32768.0
+    x = pitch_shift(x, pitch_shift_steps, speed_rate)
+    x = apply_gain(x, volume_gain)
+    if is_int16:
+        x = torch.clamp(x * 32768.0, -32767.0, 32767.0).round().to(torch.int16)
+    return x.to(source_device)
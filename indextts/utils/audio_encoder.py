@@ -0,0 +1,125 @@
+import io
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+
+# format -> (soundfile format, subtype, file extension, media type)
+AUDIO_FORMATS = {
+    "wav": ("WAV", "PCM_16", "wav", "audio/wav"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "mp3", "audio/mpeg"),
+    "opus": ("OGG", "OPUS", "opus", "audio/ogg"),
+    "flac": ("FLAC", "PCM_16", "flac", "audio/flac"),
+}
+# sample rates supported by the lossy encoders, other rates are resampled to the nearest one
+SUPPORTED_SAMPLE_RATES = {
+    "mp3": (8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000),
+    "opus": (8000, 12000, 16000, 24000, 48000),
+}
+
+
+def audio_extension(output_format: str) -> str:
+    return AUDIO_FORMATS[output_format.lower()][2]
+
+
+def audio_media_type(filename: str) -> str:
+    ext = filename.rsplit(".", 1)[-1].lower()
+    for _, _, extension, media_type in AUDIO_FORMATS.values():
+        if ext == extension:
+            return media_type
+    return "audio/wav"
+
+
+def encode_audio(wav, sampling_rate: int, output_format: str = "wav", bitrate: str = "192k") -> bytes:
+    """
+    Encode int16 PCM to WAV/MP3/Opus/FLAC bytes in memory, without touching the disk.
+    Args:
+        ``wav``: int16 samples, a numpy array or tensor of shape (T,), (T, C) or (C, T) with C < T,
+            e.g. the ``wav_data`` returned by `IndexTTS.infer(..., output_path=None)`
+        ``bitrate``: target bitrate of the lossy codecs (MP3 / Opus)
+    """
+    output_format = output_format.lower()
+    if output_format not in AUDIO_FORMATS:
+        raise ValueError(f"unsupported audio format: {output_format}")
+    if isinstance(wav, torch.Tensor):
+        wav = wav.detach().cpu().numpy()
+    wav = np.asarray(wav)
+    if wav.ndim == 2 and wav.shape[0] < wav.shape[1]:
+        # (C, T) -> (T, C)
+        wav = wav.T
+    if wav.dtype != np.int16:
+        wav = np.clip(wav, -32767, 32767).astype(np.int16)
+    sample_rates = SUPPORTED_SAMPLE_RATES.get(output_format)
+    if sample_rates is not None and sampling_rate not in sample_rates:
+        target_rate = min(sample_rates, key=lambda rate: abs(rate - sampling_rate))
+        resampled = torchaudio.functional.resample(torch.from_numpy(wav.T.astype(np.float32)), sampling_rate, target_rate)
+        wav = resampled.round().clamp(-32767, 32767).to(torch.int16).numpy().T
+        sampling_rate = target_rate
+    sf_format, subtype, _, _ = AUDIO_FORMATS[output_format]
+    kwargs = {}
+    if output_format in ("mp3", "opus"):
+        # libsndfile only exposes a 0..1 compression level, map the bitrate onto it (320k -> 0, 32k -> 1)
+        kbps = float(str(bitrate).lower().rstrip("k"))
+        kwargs["compression_level"] = float(np.clip((320.0 - kbps) / 288.0, 0.0, 1.0))
+    if output_format == "mp3":
+        kwargs["bitrate_mode"] = "CONSTANT"
+    buffer = io.BytesIO()
+    sf.write(buffer, wav, sampling_rate, format=sf_format, subtype=subtype, **kwargs)
+    return buffer.getvalue()
+
+
+class AudioEncoder:
+    """
+    Runs audio post-processing (effects, encoding) on a small thread pool, so that it overlaps with
+    the GPT / BigVGAN work of the next request on the `InferenceWorker` thread.
+    libsndfile and torch release the GIL while encoding / resampling.
+    """
+
+    def __init__(self, max_workers: int = 2, name: str = "audio-encoder"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.processed = 0
+        self.failed = 0
+        self._total_time = 0.0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            self.pending += 1
+        return self._executor.submit(self._run, fn, args, kwargs)
+
+    def encode(self, wav, sampling_rate: int, output_format: str = "wav", bitrate: str = "192k") -> Future:
+        return self.submit(encode_audio, wav, sampling_rate, output_format, bitrate)
+
+    def _run(self, fn, args, kwargs):
+        start_time = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.processed += 1
+                self._total_time += time.perf_counter() - start_time
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "pending": self.pending,
+                "processed": self.processed,
+                "failed": self.failed,
+                "avg_processing_time": round(self._total_time / self.processed, 3) if self.processed > 0 else None,
+            }
@@ -0,0 +1,25 @@
+import threading
+from typing import Iterable
+
+
+class InferenceCancelled(RuntimeError):
+    """Raised by the inference loops once their ``cancel_event`` is set."""
+
+
+def check_cancelled(cancel_event):
+    """
+    Cooperative cancellation point. ``cancel_event`` is a `threading.Event` (or anything with ``is_set()``),
+    ``None`` disables the check.
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise InferenceCancelled("inference cancelled")
+
+
+class AllEvents:
+    """Set once all the given events are set, e.g. a batch of requests that were all cancelled."""
+
+    def __init__(self, events: Iterable[threading.Event]):
+        self.events = list(events)
+
+    def is_set(self) -> bool:
+        return len(self.events) > 0 and all(event.is_set() for event in self.events)
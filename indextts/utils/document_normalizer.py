@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional
+
+from indextts.utils.front import TextNormalizer
+
+# 句末标点: 中文标点后直接切分, 英文标点后必须是空白 (不切 3.14, a.b@c.com)
+# 紧跟的右引号/括号留在前一句
+SENTENCE_END_PATTERN = re.compile(
+    r"(?<=[。！？；…])(?![”’」』）)\]\"'])"
+    r"|(?<=[。！？；…][”’」』）)\]\"'])"
+    r"|(?<=[.!?;])(?=\s)"
+    r"|(?<=[.!?;][”’」』）)\]\"'])(?=\s)"
+)
+
+
+def split_document(text: str, max_chars: int = 1000) -> List[str]:
+    """
+    Split a document into chunks that are normalized independently.
+    A chunk never crosses a line break; longer paragraphs are cut after sentence-ending punctuation
+    and packed into chunks of at most ``max_chars`` characters (a longer sentence is kept whole).
+    """
+    chunks = []
+    for paragraph in text.splitlines():
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            chunks.append(paragraph)
+            continue
+        current = ""
+        for sentence in SENTENCE_END_PATTERN.split(paragraph):
+            if not sentence:
+                continue
+            if current.strip() and len(current) + len(sentence) > max_chars:
+                chunks.append(current.strip())
+                current = ""
+            current += sentence
+        if current.strip():
+            chunks.append(current.strip())
+    return chunks
+
+
+_worker_normalizer: Optional[TextNormalizer] = None
+
+
+def _init_worker(normalizer_factory: Callable[[], TextNormalizer]):
+    global _worker_normalizer
+    _worker_normalizer = normalizer_factory()
+    _worker_normalizer.load()
+
+
+def _normalize_chunk(text: str) -> str:
+    return _worker_normalizer.normalize(text)
+
+
+class DocumentNormalizer:
+    """
+    Normalize long documents (e.g. novel chapters) with `TextNormalizer` in a pool of worker processes,
+    each loading its own normalizer once.
+
+    The document is split by `split_document`, the chunks are normalized in parallel and joined with " "
+    in their original order, so the result does not depend on the number of workers.
+    Texts shorter than ``min_chars`` are normalized as a whole in the calling process, as before.
+    Note that `TextNormalizer.normalize` picks the Chinese or English normalizer per chunk, not per document.
+    With ``text_cache`` (`TextCache`) only the chunks that are not cached are sent to the workers.
+    """
+
+    def __init__(self, normalizer: TextNormalizer = None, num_workers: int = None, max_chunk_chars: int = 1000,
+                 min_chars: int = 2000, normalizer_factory: Callable[[], TextNormalizer] = TextNormalizer):
+        """
+        Args:
+            ``normalizer``: loaded normalizer for the in-process path, created from ``normalizer_factory`` if ``None``
+            ``num_workers``: worker processes, defaults to the number of CPUs
+            ``normalizer_factory``: picklable callable creating the normalizer of each worker
+        """
+        self.normalizer = normalizer
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.max_chunk_chars = max_chunk_chars
+        self.min_chars = min_chars
+        self.normalizer_factory = normalizer_factory
+        self.text_cache = None
+        # 最近一次 normalize 的统计: chars, chunks, workers, elapsed, chars_per_sec
+        self.last_stats: Optional[Dict] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _local_normalizer(self) -> TextNormalizer:
+        if self.normalizer is None:
+            self.normalizer = self.normalizer_factory()
+            self.normalizer.load()
+        return self.normalizer
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: 不 fork 已经初始化 CUDA 的进程
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.num_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.normalizer_factory,),
+                )
+            return self._executor
+
+    def start(self):
+        """Start the worker processes and load their normalizers ahead of the first document."""
+        if self.num_workers > 1:
+            executor = self._get_executor()
+            list(executor.map(_normalize_chunk, [""] * self.num_workers))
+
+    def normalize(self, text: str) -> str:
+        start_time = time.perf_counter()
+        if len(text) < self.min_chars or self.num_workers <= 1:
+            chunks = [text]
+            result = self._local_normalizer().normalize(text)
+            workers = 1
+        else:
+            chunks = split_document(text, self.max_chunk_chars)
+            normalized = [None] * len(chunks)
+            if self.text_cache is not None:
+                for i, chunk in enumerate(chunks):
+                    entry = self.text_cache.get(chunk)
+                    if entry is not None:
+                        normalized[i] = entry[0]
+            missing = [i for i, value in enumerate(normalized) if value is None]
+            workers = min(self.num_workers, len(missing))
+            try:
+                chunksize = max(1, len(missing) // (self.num_workers * 4))
+                results = list(self._get_executor().map(_normalize_chunk, [chunks[i] for i in missing],
+                                                        chunksize=chunksize)) if missing else []
+            except BrokenProcessPool as e:
+                print(f">> Normalizer worker process died, normalizing in the current process: {e}")
+                self.close()
+                normalizer = self._local_normalizer()
+                results = [normalizer.normalize(chunks[i]) for i in missing]
+                workers = 1
+            for i, value in zip(missing, results):
+                normalized[i] = value
+                # 单个字符 `TextTokenizer.encode` 不做正则化, 不缓存
+                if self.text_cache is not None and len(chunks[i]) > 1:
+                    self.text_cache.put(chunks[i], value)
+            result = " ".join(chunk for chunk in normalized if chunk)
+        elapsed = time.perf_counter() - start_time
+        self.last_stats = {
+            "chars": len(text),
+            "chunks": len(chunks),
+            "workers": workers,
+            "elapsed": elapsed,
+            "chars_per_sec": len(text) / elapsed if elapsed > 0 else float("inf"),
+        }
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -2,16 +2,27 @@
 import os
 import traceback
 import re
-from typing import List, Union, overload
+import threading
+from typing import Dict, List, Set, Tuple, Union, overload
 import warnings
+import numpy as np
 from indextts.utils.common import tokenize_by_CJK_char, de_tokenized_by_CJK_char
 from sentencepiece import SentencePieceProcessor
 
 
 class TextNormalizer:
-    def __init__(self):
+    def __init__(self, cache_dir: str = None):
+        """
+        ``cache_dir``: 中文 tagger FST 的缓存目录，默认为环境变量 ``INDEXTTS_TAGGER_CACHE_DIR`` 或 indextts/utils/tagger_cache
+        """
         self.zh_normalizer = None
         self.en_normalizer = None
+        self.cache_dir = TextNormalizer.resolve_cache_dir(cache_dir)
+        self._load_lock = threading.Lock()
+        self._load_thread = None
+        # WeTextProcessing / wetext (pynini) 的 normalizer 没有声明线程安全,
+        # 推理线程和其他线程 (如 api_server 计算结果缓存 key) 可能同时正则化
+        self._normalize_lock = threading.Lock()
         self.char_rep_map = {
             "：": ",",
             "；": ",",
@@ -85,43 +96,78 @@ class TextNormalizer:
         has_pinyin = bool(re.search(TextNormalizer.PINYIN_TONE_PATTERN, s, re.IGNORECASE))
         return has_pinyin
 
-    def load(self):
+    @staticmethod
+    def resolve_cache_dir(cache_dir: str = None) -> str:
+        if cache_dir:
+            return os.path.abspath(cache_dir)
+        if os.environ.get("INDEXTTS_TAGGER_CACHE_DIR"):
+            return os.path.abspath(os.environ["INDEXTTS_TAGGER_CACHE_DIR"])
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "tagger_cache")
+
+    @property
+    def loaded(self) -> bool:
+        return self.zh_normalizer is not None and self.en_normalizer is not None
+
+    def load(self, overwrite_cache=False):
+        """
+        加载（首次运行时构建）正则化 FST，线程安全，已加载时直接返回；``overwrite_cache`` 重新构建 FST 缓存
+        """
         # print(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
         # sys.path.append(model_dir)
         import platform
-        if self.zh_normalizer is not None and self.en_normalizer is not None:
-            return
-        if platform.system() == "Darwin":
-            from wetext import Normalizer
+        with self._load_lock:
+            if self.loaded and not overwrite_cache:
+                return
+            if platform.system() == "Darwin":
+                from wetext import Normalizer
+
+                self.zh_normalizer = Normalizer(remove_erhua=False, lang="zh", operator="tn")
+                self.en_normalizer = Normalizer(lang="en", operator="tn")
+            else:
+                from tn.chinese.normalizer import Normalizer as NormalizerZh
+                from tn.english.normalizer import Normalizer as NormalizerEn
+                # use new cache dir for build tagger rules with disable remove_interjections and remove_erhua
+                cache_dir = self.cache_dir
+                if not os.path.exists(cache_dir):
+                    os.makedirs(cache_dir)
+                    with open(os.path.join(cache_dir, ".gitignore"), "w") as f:
+                        f.write("*\n")
+                self.zh_normalizer = NormalizerZh(
+                    cache_dir=cache_dir, remove_interjections=False, remove_erhua=False, overwrite_cache=overwrite_cache
+                )
+                self.en_normalizer = NormalizerEn(overwrite_cache=overwrite_cache)
 
-            self.zh_normalizer = Normalizer(remove_erhua=False, lang="zh", operator="tn")
-            self.en_normalizer = Normalizer(lang="en", operator="tn")
-        else:
-            from tn.chinese.normalizer import Normalizer as NormalizerZh
-            from tn.english.normalizer import Normalizer as NormalizerEn
-            # use new cache dir for build tagger rules with disable remove_interjections and remove_erhua
-            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tagger_cache")
-            if not os.path.exists(cache_dir):
-                os.makedirs(cache_dir)
-                with open(os.path.join(cache_dir, ".gitignore"), "w") as f:
-                    f.write("*\n")
-            self.zh_normalizer = NormalizerZh(
-                cache_dir=cache_dir, remove_interjections=False, remove_erhua=False, overwrite_cache=False
-            )
-            self.en_normalizer = NormalizerEn(overwrite_cache=False)
+    def load_async(self) -> threading.Thread:
+        """
+        在后台线程中 `load()`（如与模型权重的加载重叠），`normalize()` 会等待加载完成
+        """
+        with _shared_lock:
+            if self._load_thread is None:
+                self._load_thread = threading.Thread(target=self._load_in_background, name="TextNormalizer.load",
+                                                     daemon=True)
+                self._load_thread.start()
+            return self._load_thread
+
+    def _load_in_background(self):
+        try:
+            self.load()
+        except Exception:
+            # 加载失败时 `normalize()` 会重新加载并抛出异常
+            print(traceback.format_exc())
 
     def normalize(self, text: str) -> str:
         text = text.replace("嗯", "恩").replace("呣", "母")
-        if not self.zh_normalizer or not self.en_normalizer:
-            print("Error, text normalizer is not initialized !!!")
-            return ""
+        if not self.loaded:
+            # 懒加载，或者等待 `load_async()` 的后台加载完成
+            self.load()
         if self.use_chinese(text):
             text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
             replaced_text, pinyin_list = self.save_pinyin_tones(text.rstrip())
             
             replaced_text, original_name_list = self.save_names(replaced_text)
             try:
-                result = self.zh_normalizer.normalize(replaced_text)
+                with self._normalize_lock:
+                    result = self.zh_normalizer.normalize(replaced_text)
             except Exception:
                 result = ""
                 print(traceback.format_exc())
@@ -134,7 +180,8 @@ class TextNormalizer:
         else:
             try:
                 text = re.sub(TextNormalizer.ENGLISH_CONTRACTION_PATTERN, r"\1 is", text, flags=re.IGNORECASE)
-                result = self.en_normalizer.normalize(text)
+                with self._normalize_lock:
+                    result = self.en_normalizer.normalize(text)
             except Exception:
                 result = text
                 print(traceback.format_exc())
@@ -229,19 +276,42 @@ class TextNormalizer:
         return transformed_text
 
 
+_shared_lock = threading.Lock()
+_shared_normalizers: Dict[str, TextNormalizer] = {}
+
+
+def get_shared_normalizer(cache_dir: str = None) -> TextNormalizer:
+    """
+    进程内共享的 `TextNormalizer`（每个缓存目录一个），多个 `IndexTTS` / `TextTokenizer` 只加载一次 FST
+    """
+    cache_dir = TextNormalizer.resolve_cache_dir(cache_dir)
+    with _shared_lock:
+        if cache_dir not in _shared_normalizers:
+            _shared_normalizers[cache_dir] = TextNormalizer(cache_dir)
+        return _shared_normalizers[cache_dir]
+
+
 class TextTokenizer:
     def __init__(self, vocab_file: str, normalizer: TextNormalizer = None):
         self.vocab_file = vocab_file
         self.normalizer = normalizer
+        # 可选的正则化和 token id 缓存, 见 `indextts.utils.text_cache.TextCache`
+        self.text_cache = None
 
         if self.vocab_file is None:
             raise ValueError("vocab_file is None")
         if not os.path.exists(self.vocab_file):
             raise ValueError(f"vocab_file {self.vocab_file} does not exist")
-        if self.normalizer:
-            self.normalizer.load()
+        if self.normalizer and not self.normalizer.loaded:
+            # 不阻塞: 在后台加载, 第一次正则化时等待加载完成
+            self.normalizer.load_async()
         # 加载词表
         self.sp_model = SentencePieceProcessor(model_file=self.vocab_file)
+        # 分句用的 token id, 见 `split_sentences_ids`
+        self.punctuation_marks_ids = self.piece_ids(self.punctuation_marks_tokens)
+        self.comma_ids = self.piece_ids([",", "▁,"])
+        self.dash_ids = self.piece_ids(["-"])
+        self.apostrophe_ids = self.piece_ids(["'", "▁'"])
 
         self.pre_tokenizers = [
             # 预处理器
@@ -314,14 +384,48 @@ class TextTokenizer:
     def tokenize(self, text: str) -> List[str]:
         return self.encode(text, out_type=str)
 
-    def encode(self, text: str, **kwargs):
+    def normalize(self, text: str) -> str:
+        """
+        与 `encode` 相同的文本正则化，设置了 ``text_cache`` 时使用缓存
+        """
+        if self.text_cache is not None and self.text_cache.cacheable(text):
+            entry = self.text_cache.get(text)
+            if entry is not None:
+                return entry[0]
+            normalized = self._normalize(text)
+            self.text_cache.put(text, normalized)
+            return normalized
+        return self._normalize(text)
+
+    def _normalize(self, text: str) -> str:
+        if len(text.strip()) == 1 or not self.normalizer:
+            return text
+        return self.normalizer.normalize(text)
+
+    def encode(self, text: str, normalize: bool = True, **kwargs):
+        """
+        ``normalize``: 为 ``False`` 时跳过文本正则化，用于已经正则化过的文本（如 `DocumentNormalizer` 的结果）
+        设置了 ``text_cache`` 时，正则化结果和 token id 按原文本缓存
+        """
         if len(text) == 0:
             return []
         if len(text.strip()) == 1:
             return self.sp_model.Encode(text, out_type=kwargs.pop("out_type", int), **kwargs)
+        if normalize and len(kwargs) == 0 and self.text_cache is not None and self.text_cache.cacheable(text):
+            entry = self.text_cache.get(text)
+            if entry is not None and entry[1] is not None:
+                return entry[1].tolist()
+            # 只缓存了正则化结果时（`DocumentNormalizer`）补上 token id
+            normalized = entry[0] if entry is not None else self._normalize(text)
+            ids = self._encode_normalized(normalized)
+            self.text_cache.put(text, normalized, ids)
+            return ids
         # 预处理
-        if self.normalizer:
+        if self.normalizer and normalize:
             text = self.normalizer.normalize(text)
+        return self._encode_normalized(text, **kwargs)
+
+    def _encode_normalized(self, text: str, **kwargs):
         if len(self.pre_tokenizers) > 0:
             for pre_tokenizer in self.pre_tokenizers:
                 text = pre_tokenizer(text)
@@ -428,6 +532,102 @@ class TextTokenizer:
             tokenized, self.punctuation_marks_tokens, max_tokens_per_sentence=max_tokens_per_sentence
         )
 
+    def piece_ids(self, pieces: List[str]) -> Set[int]:
+        """
+        词表中的 piece 对应的 id，不在词表中的 piece 被忽略：
+        encode 结果中的 unk token 只由词表外的字符组成，不会等于这些 piece
+        """
+        ids = {self.sp_model.PieceToId(piece) for piece in pieces}
+        ids.discard(self.unk_token_id)
+        return ids
+
+    def split_sentences_ids(self, token_ids, max_tokens_per_sentence=120) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        `split_sentences` 的 token id 版本，分句边界与之完全相同，不做 piece 和 id 之间的转换。
+        每个 token 只访问常数次（分割 token 查预先计算的 id 集合，句子用区间表示，合并时不复制 token）。
+        Args:
+            ``token_ids``: `encode(text)` 的结果
+        Returns:
+            ``(ids, offsets)``: 所有句子拼接后的 int32 数组，第 k 句为 ``ids[offsets[k]:offsets[k + 1]]``
+        """
+        token_ids = np.asarray(token_ids, dtype=np.int32).reshape(-1)
+        ids = token_ids.tolist()
+        sentences = self._split_spans(ids, 0, len(ids), self.punctuation_marks_ids,
+                                      comma_split=True, dash_split=True,
+                                      max_tokens_per_sentence=max_tokens_per_sentence)
+        offsets = np.zeros(len(sentences) + 1, dtype=np.int64)
+        pieces = []
+        for k, spans in enumerate(sentences):
+            length = 0
+            for start, end in spans:
+                pieces.append(token_ids[start:end])
+                length += end - start
+            offsets[k + 1] = offsets[k] + length
+        out = np.concatenate(pieces) if len(pieces) > 0 else np.zeros(0, dtype=np.int32)
+        return out, offsets
+
+    def _split_spans(self, ids: List[int], start: int, end: int, split_ids: Set[int], comma_split: bool,
+                     dash_split: bool, max_tokens_per_sentence: int) -> List[List[Tuple[int, int]]]:
+        """
+        `split_sentences_by_token` 对 ``ids[start:end]`` 的等价实现，每个句子是若干个 ``(start, end)`` 区间
+        ``comma_split`` / ``dash_split``: 超长时是否还能按 , / - 分割
+        """
+        if end <= start:
+            return []
+        sentences: List[List[Tuple[int, int]]] = []
+        sentence_start = start
+        length = 0
+        for i in range(start, end):
+            length += 1
+            if length <= max_tokens_per_sentence:
+                if length > 2 and ids[i] in split_ids:
+                    stop = i + 1
+                    if i < end - 1 and ids[i + 1] in self.apostrophe_ids:
+                        # 后续token是'，则不切分；与 `split_sentences_by_token` 一致，' 同时也是下一句的开头
+                        stop = i + 2
+                    sentences.append([(sentence_start, stop)])
+                    sentence_start = i + 1
+                    length = 0
+                continue
+            # 如果当前tokens的长度超过最大限制
+            current = ids[sentence_start:i + 1]
+            if comma_split and any(token in self.comma_ids for token in current):
+                sub_sentences = self._split_spans(ids, sentence_start, i + 1, self.comma_ids, comma_split=False,
+                                                  dash_split=True, max_tokens_per_sentence=max_tokens_per_sentence)
+            elif dash_split and any(token in self.dash_ids for token in current):
+                # 不再回到按 , 分割：超长的句子里 , 和 - 都无法分割时 `split_sentences_by_token` 会无限递归，这里按长度分割
+                sub_sentences = self._split_spans(ids, sentence_start, i + 1, self.dash_ids, comma_split=False,
+                                                  dash_split=False, max_tokens_per_sentence=max_tokens_per_sentence)
+            else:
+                # 按照长度分割
+                sub_sentences = [[(j, min(j + max_tokens_per_sentence, i + 1))]
+                                 for j in range(sentence_start, i + 1, max_tokens_per_sentence)]
+                warnings.warn(
+                    f"The tokens length of sentence exceeds limit: {max_tokens_per_sentence}, "
+                    f"Tokens in sentence: {self.convert_ids_to_tokens(current)}."
+                    "Maybe unexpected behavior",
+                    RuntimeWarning,
+                )
+            sentences.extend(sub_sentences)
+            sentence_start = i + 1
+            length = 0
+        if length > 0:
+            sentences.append([(sentence_start, end)])
+        # 如果相邻的句子加起来长度小于最大限制，则合并
+        merged: List[List[Tuple[int, int]]] = []
+        merged_length = 0
+        for spans in sentences:
+            sentence_length = sum(e - s for s, e in spans)
+            if sentence_length == 0:
+                continue
+            if len(merged) > 0 and merged_length + sentence_length <= max_tokens_per_sentence:
+                merged[-1].extend(spans)
+                merged_length += sentence_length
+            else:
+                merged.append(list(spans))
+                merged_length = sentence_length
+        return merged
+
 
 if __name__ == "__main__":
     # 测试程序
@@ -0,0 +1,257 @@
+import itertools
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+# priority classes, lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+PRIORITY_CLASSES = {"interactive": PRIORITY_INTERACTIVE, "normal": PRIORITY_NORMAL, "bulk": PRIORITY_BULK}
+
+
+class QueueFullError(RuntimeError):
+    """
+    Raised by `InferenceWorker.submit()` when the request queue is full.
+    ``retry_after`` is the estimated number of seconds until a slot frees up.
+    """
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class WorkerStoppedError(RuntimeError):
+    """Raised by `InferenceWorker.submit()` after the worker has been shut down."""
+
+
+class InferenceWorker:
+    """
+    Runs blocking model calls on one dedicated thread, fed by a bounded priority queue,
+    so the caller (e.g. the asyncio event loop of the API server) never blocks on inference.
+    `submit()` returns a `concurrent.futures.Future` and fails fast with `QueueFullError`
+    once ``max_queue_size`` requests are waiting.
+    Tasks run by priority (see ``PRIORITY_CLASSES``), FIFO within the same priority.
+    """
+
+    def __init__(self, max_queue_size: int = 8, name: str = "inference-worker"):
+        self.max_queue_size = max_queue_size
+        # (priority, seq, item), the capacity is checked in `submit_with_priority()`
+        self._queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._stopped = False
+        self.busy = False
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._total_time = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Submit an interactive task"""
+        return self.submit_with_priority(PRIORITY_INTERACTIVE, fn, args, kwargs)
+
+    def submit_with_priority(self, priority: int, fn: Callable, args: tuple = (), kwargs: Dict = None,
+                             check_capacity: bool = True) -> Future:
+        """
+        ``check_capacity=False`` always queues the task, for callers that bound their own number of
+        queued tasks (e.g. `JobManager` keeps at most one step per running job in the queue).
+        """
+        if self._stopped:
+            raise WorkerStoppedError("inference worker has been shut down")
+        with self._submit_lock:
+            if check_capacity and self._queue.qsize() >= self.max_queue_size:
+                self._reject()
+            future = Future()
+            self._queue.put_nowait((priority, next(self._seq), (future, fn, args, kwargs or {})))
+        return future
+
+    def ensure_capacity(self):
+        """Raise `QueueFullError` if a request submitted now would be rejected."""
+        if self._queue.qsize() >= self.max_queue_size:
+            self._reject()
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+        raise QueueFullError(f"request queue is full ({self.max_queue_size})", self.retry_after())
+
+    def retry_after(self) -> int:
+        """Estimated seconds until the queue has room again, from the average processing time."""
+        with self._lock:
+            avg_time = self._total_time / self.processed if self.processed > 0 else 1.0
+        return max(1, math.ceil(avg_time))
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive() and not self._stopped
+
+    def _run(self):
+        while True:
+            _, _, item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.busy = True
+            start_time = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                with self._lock:
+                    self.failed += 1
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self.processed += 1
+                    self._total_time += time.perf_counter() - start_time
+                self.busy = False
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting requests; already queued requests still run before the thread exits."""
+        if self._stopped:
+            return
+        self._stopped = True
+        # after all queued tasks
+        self._queue.put((float("inf"), next(self._seq), None))
+        if wait:
+            self._thread.join()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "queue_size": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "busy": self.busy,
+                "processed": self.processed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_processing_time": round(self._total_time / self.processed, 3) if self.processed > 0 else None,
+            }
+
+
+class MicroBatchScheduler:
+    """
+    Collects concurrent requests and runs them as one batch on an `InferenceWorker`.
+
+    Requests with the same ``key`` (e.g. identical generation settings) are merged. A group is flushed to the worker when:
+        - no new request joined it for ``window`` seconds, or
+        - its oldest request has waited ``max_wait`` seconds, or
+        - it holds ``max_batch_size`` requests, or the summed ``cost`` reaches ``max_batch_cost``.
+    ``batch_fn(items)`` runs on the worker thread and must return one result per item, in order;
+    an exception instance in the results fails only the future of that item.
+    """
+
+    def __init__(self, worker: InferenceWorker, batch_fn: Callable, window: float = 0.02, max_wait: float = 0.2,
+                 max_batch_size: int = 4, max_batch_cost: float = None, name: str = "micro-batch-scheduler"):
+        self.worker = worker
+        self.batch_fn = batch_fn
+        self.window = window
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.max_batch_cost = max_batch_cost
+        # key -> {"items": [...], "futures": [...], "cost": float, "first": t, "last": t}
+        self._groups: Dict = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self.batches = 0
+        self.batched_items = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item, key=None, cost: float = 1.0) -> Future:
+        if self._stopped:
+            raise WorkerStoppedError("micro-batch scheduler has been shut down")
+        # fail fast, the batch could not be queued anyway
+        self.worker.ensure_capacity()
+        future = Future()
+        with self._cond:
+            now = time.monotonic()
+            group = self._groups.get(key)
+            if group is not None and self.max_batch_cost is not None and group["cost"] + cost > self.max_batch_cost:
+                # the new request would exceed the budget, send the current group first
+                self._flush(key)
+                group = None
+            if group is None:
+                group = self._groups[key] = {"items": [], "futures": [], "cost": 0.0, "first": now, "last": now}
+            group["items"].append(item)
+            group["futures"].append(future)
+            group["cost"] += cost
+            group["last"] = now
+            if len(group["items"]) >= self.max_batch_size \
+                    or (self.max_batch_cost is not None and group["cost"] >= self.max_batch_cost):
+                self._flush(key)
+            self._cond.notify()
+        return future
+
+    def _deadline(self, group) -> float:
+        return min(group["last"] + self.window, group["first"] + self.max_wait)
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                now = time.monotonic()
+                for key in [k for k, g in self._groups.items() if self._deadline(g) <= now]:
+                    self._flush(key)
+                timeout = min((self._deadline(g) for g in self._groups.values()), default=None)
+                self._cond.wait(None if timeout is None else max(0.0, timeout - now))
+            for key in list(self._groups):
+                self._flush(key)
+
+    def _flush(self, key):
+        # called with self._cond held
+        group = self._groups.pop(key)
+        items, futures = group["items"], group["futures"]
+        try:
+            batch_future = self.worker.submit(self.batch_fn, items)
+        except (QueueFullError, WorkerStoppedError) as e:
+            for future in futures:
+                if not future.cancelled():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.batched_items += len(items)
+
+        def _done(f: Future):
+            if f.exception() is not None:
+                for future in futures:
+                    if not future.cancelled():
+                        future.set_exception(f.exception())
+                return
+            for future, result in zip(futures, f.result()):
+                if future.cancelled():
+                    # the caller gave up on this item, e.g. its client disconnected
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        batch_future.add_done_callback(_done)
+
+    def shutdown(self):
+        """Flush the pending groups and stop the scheduler thread."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "window": self.window,
+                "max_wait": self.max_wait,
+                "max_batch_size": self.max_batch_size,
+                "max_batch_cost": self.max_batch_cost,
+                "pending": sum(len(g["items"]) for g in self._groups.values()),
+                "batches": self.batches,
+                "avg_batch_size": round(self.batched_items / self.batches, 2) if self.batches > 0 else None,
+            }
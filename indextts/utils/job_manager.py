@@ -0,0 +1,208 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterator, List, Optional
+
+from indextts.utils.inference_worker import PRIORITY_BULK, InferenceWorker, QueueFullError, WorkerStoppedError
+
+
+class Job:
+    """
+    Status of one asynchronous job, updated from the worker thread.
+    ``status``: ``queued`` -> ``running`` -> ``succeeded`` / ``failed`` / ``cancelled``
+    """
+
+    def __init__(self, job_id: str, priority: int, priority_class: str):
+        self.id = job_id
+        self.priority = priority
+        self.priority_class = priority_class
+        self.status = "queued"
+        self.progress = 0.0
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def set_progress(self, progress: float, stage: str = None):
+        self.progress = max(self.progress, min(1.0, progress))
+        if stage is not None:
+            self.stage = stage
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "priority": self.priority_class,
+            "progress": round(self.progress, 4),
+            "stage": self.stage,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "cancel_requested": self.cancelled,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs long jobs on an `InferenceWorker` in steps, so that short interactive requests are scheduled
+    between the steps of a running job instead of waiting for the whole job.
+
+    A job is a generator function ``steps(job)``: each ``next()`` runs as one worker task at the job's
+    priority, and the generator's return value (or the result of a returned `Future`) is the job result.
+    At most ``max_running_jobs`` jobs are running; queued jobs start by priority, then by submission order.
+    Finished jobs are forgotten ``keep_finished`` seconds after they finished.
+    """
+
+    def __init__(self, worker: InferenceWorker, max_jobs: int = 100, max_running_jobs: int = 1,
+                 keep_finished: float = 3600):
+        self.worker = worker
+        self.max_jobs = max_jobs
+        self.max_running_jobs = max_running_jobs
+        self.keep_finished = keep_finished
+        self._jobs: Dict[str, Job] = {}
+        self._steps: Dict[str, Iterator] = {}
+        # (priority, seq, job_id)
+        self._pending: List = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._lock = threading.RLock()
+
+    def submit(self, steps: Callable[[Job], Iterator], priority: int = PRIORITY_BULK,
+               priority_class: str = "bulk") -> Job:
+        with self._lock:
+            self._purge()
+            if sum(1 for job in self._jobs.values() if not job.done) >= self.max_jobs:
+                raise QueueFullError(f"too many jobs ({self.max_jobs})", self.worker.retry_after())
+            if not self.worker.is_alive():
+                raise WorkerStoppedError("inference worker has been shut down")
+            job = Job(uuid.uuid4().hex, priority, priority_class)
+            self._jobs[job.id] = job
+            self._steps[job.id] = steps(job)
+            heapq.heappush(self._pending, (priority, next(self._seq), job.id))
+            self._dispatch()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._purge()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        A queued job is cancelled immediately, a running job stops after its current step; steps that pass
+        ``job.cancel_event`` to the inference loops stop within a decoding step (see `indextts.utils.cancellation`).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return job
+            job.cancel_event.set()
+            if job.status == "queued":
+                self._finish(job, "cancelled")
+            return job
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        with self._lock:
+            pending = [jid for _, _, jid in sorted(self._pending) if jid in self._jobs and not self._jobs[jid].done]
+            return pending.index(job_id) if job_id in pending else None
+
+    def _dispatch(self):
+        # called with self._lock held
+        while self._running < self.max_running_jobs and self._pending:
+            _, _, job_id = heapq.heappop(self._pending)
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                continue
+            job.status = "running"
+            job.started_at = time.time()
+            self._running += 1
+            self._schedule_step(job)
+
+    def _schedule_step(self, job: Job):
+        try:
+            future = self.worker.submit_with_priority(job.priority, self._run_step, (job,), check_capacity=False)
+        except WorkerStoppedError as e:
+            self._finish(job, "failed", error=str(e))
+            return
+        future.add_done_callback(lambda f: self._on_step_done(job, f))
+
+    def _run_step(self, job: Job):
+        # runs on the worker thread, returns (finished, value)
+        if job.cancelled:
+            return True, None
+        try:
+            next(self._steps[job.id])
+        except StopIteration as stop:
+            return True, stop.value
+        return False, None
+
+    def _on_step_done(self, job: Job, future: Future):
+        with self._lock:
+            if job.cancelled:
+                # also when the step raised `InferenceCancelled`
+                self._finish(job, "cancelled")
+                return
+            if future.exception() is not None:
+                self._finish(job, "failed", error=str(future.exception()))
+                return
+            finished, value = future.result()
+            if not finished:
+                self._schedule_step(job)
+            elif isinstance(value, Future):
+                value.add_done_callback(lambda f: self._on_result(job, f))
+            else:
+                self._finish(job, "succeeded", result=value)
+
+    def _on_result(self, job: Job, future: Future):
+        with self._lock:
+            if future.exception() is not None:
+                self._finish(job, "failed", error=str(future.exception()))
+            else:
+                self._finish(job, "succeeded", result=future.result())
+
+    def _finish(self, job: Job, status: str, result=None, error: str = None):
+        # called with self._lock held
+        if job.done:
+            return
+        was_running = job.status == "running"
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        if status == "succeeded":
+            job.progress = 1.0
+        steps = self._steps.pop(job.id, None)
+        if steps is not None:
+            steps.close()
+        if was_running:
+            self._running -= 1
+            self._dispatch()
+
+    def _purge(self):
+        now = time.time()
+        for job_id in [jid for jid, job in self._jobs.items()
+                       if job.done and now - job.finished_at > self.keep_finished]:
+            del self._jobs[job_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {"max_jobs": self.max_jobs, "max_running_jobs": self.max_running_jobs, **counts}
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class FileHasher:
+    """
+    Memoized sha256 of file contents, keyed by path, size and mtime like `VoiceCache.make_key()`,
+    so a reference audio is only read again after it changed.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._hashes: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, path: str) -> str:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._hashes.get(key)
+            if digest is not None:
+                self._hashes.move_to_end(key)
+                return digest
+        digest = hash_file(path)
+        with self._lock:
+            self._hashes[key] = digest
+            while len(self._hashes) > self.max_entries:
+                self._hashes.popitem(last=False)
+        return digest
+
+
+class ResultCache:
+    """
+    Content-addressed disk cache of encoded synthesis results.
+
+    The key is a sha256 over everything that determines the output (see `make_key()`), an entry is
+    ``<cache_dir>/<key[:2]>/<key>.<ext>`` plus a ``<key>.json`` metadata file. Entries are evicted
+    least recently used first once ``max_bytes`` is exceeded, and expire ``ttl`` seconds after they
+    were written (``ttl=None`` never expires). The index is rebuilt from the directory on startup,
+    using the file mtime as last access time, so the cache survives restarts.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024, ttl: Optional[float] = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> {"path": str, "size": int, "created": float, "meta": dict}
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(**parts) -> str:
+        """sha256 of the JSON-serialized key parts, e.g. text, reference hash, generation params, seed, model version"""
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        found = []
+        for sub in os.listdir(self.cache_dir):
+            sub_dir = os.path.join(self.cache_dir, sub)
+            if not os.path.isdir(sub_dir):
+                continue
+            for name in os.listdir(sub_dir):
+                if name.endswith(".tmp") or name.endswith(".tmp.json"):
+                    # left over by a crash in `put()` (``.tmp.json`` by older versions), never a complete entry
+                    self._remove_files(os.path.join(sub_dir, name))
+                    continue
+                if not name.endswith(".json"):
+                    continue
+                meta_path = os.path.join(sub_dir, name)
+                try:
+                    with open(meta_path, "r", encoding="utf-8") as f:
+                        meta = json.load(f)
+                    path = os.path.join(sub_dir, meta["filename"])
+                    size = os.path.getsize(path)
+                    found.append((os.path.getmtime(path), name[:-len(".json")], path, size, meta))
+                except (OSError, ValueError, KeyError):
+                    # incomplete entry, e.g. the server was killed while writing it
+                    self._remove_files(meta_path)
+        for _, key, path, size, meta in sorted(found, key=lambda item: item[0]):
+            self._entries[key] = {"path": path, "size": size, "created": meta.get("created", 0.0), "meta": meta}
+            self.nbytes += size
+        with self._lock:
+            self._evict()
+
+    def _expired(self, entry: Dict) -> bool:
+        return self.ttl is not None and time.time() - entry["created"] > self.ttl
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Returns ``{"path": ..., "size": ..., "meta": {...}}`` of a live entry, or ``None``"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self._expired(entry) or not os.path.exists(entry["path"])):
+                if self._expired(entry):
+                    self.expirations += 1
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        try:
+            # persist the access time for the LRU order after a restart
+            os.utime(entry["path"])
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key: str, data: bytes, ext: str, **meta) -> str:
+        """Stores ``data`` as ``<key>.<ext>`` and returns its path"""
+        sub_dir = os.path.join(self.cache_dir, key[:2])
+        os.makedirs(sub_dir, exist_ok=True)
+        filename = f"{key}.{ext}"
+        path = os.path.join(sub_dir, filename)
+        meta = {**meta, "filename": filename, "created": time.time()}
+        # write to a temp file and rename, readers never see a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        # not ``*.json``, so `_load()` never takes a leftover temp meta for an entry
+        tmp_meta_path = f"{path}.{threading.get_ident()}.meta.tmp"
+        with open(tmp_meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta_path, os.path.join(sub_dir, f"{key}.json"))
+        with self._lock:
+            if key in self._entries:
+                old = self._entries.pop(key)
+                self.nbytes -= old["size"]
+                if old["path"] != path:
+                    self._remove_files(old["path"])
+            self._entries[key] = {"path": path, "size": len(data), "created": meta["created"], "meta": meta}
+            self.nbytes += len(data)
+            self._evict()
+        return path
+
+    def _evict(self):
+        # called with self._lock held, always keeps the newest entry
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            key = next(iter(self._entries))
+            self._drop(key)
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry["size"]
+        self._remove_files(entry["path"], os.path.join(os.path.dirname(entry["path"]), f"{key}.json"))
+
+    @staticmethod
+    def _remove_files(*paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / total, 4) if total > 0 else None,
+            }
+
+
+def copy_or_link(src: str, dst: str):
+    """Hard-links ``src`` to ``dst`` (falls back to a copy across file systems)"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
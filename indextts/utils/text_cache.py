@@ -0,0 +1,166 @@
+import hashlib
+import inspect
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from importlib import metadata
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from indextts.utils.result_cache import hash_file
+
+# (normalized text, token ids), the ids are ``None`` when only the normalization is known
+TextEntry = Tuple[str, Optional[np.ndarray]]
+
+
+def frontend_version(vocab_file: str, normalizer=None) -> str:
+    """
+    Version of the text frontend: the BPE model contents, the normalizer class and the source of its module,
+    and the installed WeTextProcessing / wetext versions. Cached entries of another version are never served.
+    """
+    parts = [hash_file(vocab_file)]
+    if normalizer is not None:
+        cls = type(normalizer)
+        parts.append(f"{cls.__module__}.{cls.__qualname__}")
+        try:
+            parts.append(hash_file(inspect.getfile(cls)))
+        except (TypeError, OSError):
+            pass
+        for dist in ("WeTextProcessing", "wetext"):
+            try:
+                parts.append(f"{dist}=={metadata.version(dist)}")
+            except metadata.PackageNotFoundError:
+                pass
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class TextCache:
+    """
+    Cache of raw text -> (normalized text, token ids) for texts that are synthesized again and again.
+
+    Entries live in an in-memory LRU of ``max_entries`` texts. With ``db_path`` they are also written to a
+    sqlite database, so the cache survives restarts; memory misses are looked up there. Every entry is tagged
+    with ``version`` (see `frontend_version()`), entries of other versions are deleted when the database is
+    opened, and the database keeps at most ``max_db_entries`` least recently used texts.
+    Texts longer than ``max_text_chars`` are not cached.
+    """
+
+    def __init__(self, version: str, max_entries: int = 4096, db_path: str = None, max_db_entries: int = 1000000,
+                 max_text_chars: int = 4096):
+        self.version = version
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self.max_text_chars = max_text_chars
+        self._entries: "OrderedDict[str, TextEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self._db = None
+        self._db_puts = 0
+        if db_path:
+            self._open_db()
+
+    def _open_db(self):
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "text TEXT PRIMARY KEY, version TEXT NOT NULL, normalized TEXT NOT NULL, ids BLOB, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._db.execute("DELETE FROM entries WHERE version != ?", (self.version,))
+
+    def cacheable(self, text: str) -> bool:
+        return len(text) <= self.max_text_chars
+
+    def get(self, text: str) -> Optional[TextEntry]:
+        with self._lock:
+            entry = self._entries.get(text)
+            if entry is not None:
+                self._entries.move_to_end(text)
+                self.hits += 1
+                return entry
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT normalized, ids FROM entries WHERE text = ? AND version = ?", (text, self.version)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE entries SET accessed = ? WHERE text = ?", (time.time(), text))
+                    entry = (row[0], None if row[1] is None else np.frombuffer(row[1], dtype=np.int32))
+                    self._remember(text, entry)
+                    self.db_hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def put(self, text: str, normalized: str, ids=None):
+        if not self.cacheable(text):
+            return
+        if ids is not None:
+            ids = np.asarray(ids, dtype=np.int32)
+        with self._lock:
+            self._remember(text, (normalized, ids))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (text, version, normalized, ids, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (text, self.version, normalized, None if ids is None else ids.tobytes(), time.time()),
+                )
+                self._db_puts += 1
+                if self._db_puts % 1000 == 0:
+                    self._prune_db()
+
+    def _remember(self, text: str, entry: TextEntry):
+        # called with self._lock held
+        self._entries[text] = entry
+        self._entries.move_to_end(text)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _prune_db(self):
+        # called with self._lock held
+        (count,) = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count > self.max_db_entries:
+            self._db.execute(
+                "DELETE FROM entries WHERE text IN (SELECT text FROM entries ORDER BY accessed LIMIT ?)",
+                (count - self.max_db_entries,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.db_hits + self.misses
+            stats = {
+                "version": self.version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.db_hits) / total, 4) if total > 0 else None,
+            }
+            if self._db is not None:
+                stats["db_path"] = self.db_path
+                stats["db_entries"] = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return stats
@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import torch
+
+
+class VoiceConditioning:
+    """
+    Everything derived from one reference audio:
+        - ``cond_mel``: (1, n_mels, frames) mel spectrogram of the reference audio
+        - ``conds_latent``: (1, 32, dim) `UnifiedVoice.get_conditioning()` perceiver latents
+        - ``speaker_embedding``: (1, 1, dim) BigVGAN ECAPA-TDNN speaker embedding
+    """
+
+    def __init__(self, cond_mel: torch.Tensor, conds_latent: torch.Tensor = None, speaker_embedding: torch.Tensor = None):
+        self.cond_mel = cond_mel
+        self.conds_latent = conds_latent
+        self.speaker_embedding = speaker_embedding
+
+    @property
+    def cond_mel_frame(self) -> int:
+        return self.cond_mel.shape[-1]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            t.numel() * t.element_size()
+            for t in (self.cond_mel, self.conds_latent, self.speaker_embedding)
+            if t is not None
+        )
+
+
+class VoiceCache:
+    """
+    LRU cache of `VoiceConditioning`, keyed by the reference audio file path, size and mtime,
+    so an updated file with the same name is never served stale.
+    Entries are evicted from the least recently used one once ``max_bytes`` is exceeded.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, VoiceConditioning]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(audio_prompt: str) -> Tuple:
+        stat = os.stat(audio_prompt)
+        return (os.path.abspath(audio_prompt), stat.st_size, stat.st_mtime_ns)
+
+    def get(self, key: Tuple) -> Optional[VoiceConditioning]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, entry: VoiceConditioning):
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = entry
+            self.nbytes += entry.nbytes
+            # always keep the newest entry, even if it alone exceeds the budget
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Tuple):
+        return key in self._entries
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+            }
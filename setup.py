@@ -66,6 +66,7 @@ setup(
     entry_points={
         "console_scripts": [
             "indextts = indextts.cli:main",
+            "indextts-prebuild = indextts.prebuild:main",
         ]
     },
     license="Apache-2.0",
@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from indextts.infer import IndexTTS
+
+if __name__ == "__main__":
+    """
+    Run merged requests through the batching path of the API server (`api_server.run_synthesis_batch`, used when
+    ``INDEXTTS_BATCH_WINDOW_MS`` > 0) with bucketed static batching (``INDEXTTS_BATCH_SLOTS=0``, the default)
+    and with `ContinuousBatchingEngine` (``INDEXTTS_BATCH_SLOTS`` > 0): with greedy search the audio of every
+    request must match (asserted), the time of both is printed.
+    ```
+    python tests/api_batching_test.py checkpoints
+    python tests/api_batching_test.py checkpoints 6
+    ```
+    """
+    import sys
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import api_server
+
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    batch_slots = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    api_server.tts_model = IndexTTS(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, is_fp16=False,
+                                    use_cuda_kernel=False)
+    api_server.REFERENCE_AUDIO_DIR = "tests"
+    texts = [
+        "There is a vehicle arriving in dock number 7?",
+        "大家好，我现在正在bilibili 体验 ai 科技，说实话，来之前我绝对想不到！AI技术已经发展到这样匪夷所思的地步了！",
+        "The weather is really nice today, perfect for studying at home.Thank you!",
+        "晕 XUAN4 是 一 种 GAN3 觉",
+    ]
+
+    outputs = {}
+    for slots in [0, batch_slots]:
+        api_server.BATCH_SLOTS = slots
+        items = [
+            (api_server.TTSRequest(text=text, reference_audio="sample_prompt.wav", do_sample=False), threading.Event())
+            for text in texts
+        ]
+        start = time.perf_counter()
+        results = api_server.run_synthesis_batch(items)
+        elapsed = time.perf_counter() - start
+        for result in results:
+            assert not isinstance(result, Exception), f"INDEXTTS_BATCH_SLOTS={slots}: {result!r}"
+        outputs[slots] = results
+        print(f"INDEXTTS_BATCH_SLOTS={slots}: {len(texts)} requests in {elapsed:.2f} s")
+        if slots > 0:
+            stats = api_server.tts_model.last_batching_stats
+            assert stats is not None and stats["max_batch_slots"] == slots, stats
+            print(">> continuous batching:", stats)
+
+    for i, ((sr, wav), (cb_sr, cb_wav)) in enumerate(zip(outputs[0], outputs[batch_slots])):
+        assert sr == cb_sr and np.array_equal(wav, cb_wav), \
+            f"request {i}: the audio with INDEXTTS_BATCH_SLOTS={batch_slots} differs from static batching"
+    print("all matched")
+    print("Test finished.")
@@ -0,0 +1,61 @@
+import time
+
+import numpy as np
+import torch
+import torchaudio
+from pydub import AudioSegment
+from pydub.effects import speedup
+
+from indextts.utils.audio_effects import apply_audio_effects
+
+
+def pydub_effects(wav: np.ndarray, sampling_rate: int, pitch_shift: float, speed_rate: float, volume_gain: float):
+    """the default (pydub) api_server backend: re-declare the frame rate / `speedup` over the PCM"""
+    audio = AudioSegment(data=wav.tobytes(), sample_width=2, frame_rate=sampling_rate, channels=1)
+    if volume_gain != 0.0:
+        audio = audio + volume_gain
+    if speed_rate > 1.0:
+        audio = speedup(audio, playback_speed=speed_rate)
+    elif speed_rate < 1.0:
+        audio = audio._spawn(audio.raw_data, overrides={"frame_rate": int(audio.frame_rate * speed_rate)})
+    if pitch_shift != 0.0:
+        audio = audio._spawn(audio.raw_data, overrides={"frame_rate": int(audio.frame_rate * 2 ** (pitch_shift / 12.0))})
+        audio = audio.set_frame_rate(22050)
+    return np.array(audio.get_array_of_samples(), dtype=np.int16), audio.frame_rate
+
+
+if __name__ == "__main__":
+    """
+    Benchmark the tensor-domain effects (`indextts.utils.audio_effects`) against the pydub backend of api_server.
+    ```
+    python tests/audio_effects_test.py 60
+    python tests/audio_effects_test.py 60 cuda
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+    device = sys.argv[2] if len(sys.argv) > 2 else "cpu"
+    audio, sr = torchaudio.load("tests/sample_prompt.wav")
+    audio = torchaudio.transforms.Resample(sr, 24000)(torch.mean(audio, dim=0))
+    sr = 24000
+    audio = audio.repeat(int(seconds * sr) // audio.shape[-1] + 1)[:int(seconds * sr)]
+    wav = torch.clamp(audio * 32767, -32767, 32767).to(torch.int16)
+    print(f">> {seconds:.0f}s of audio at {sr} Hz, device: {device}")
+
+    for pitch_shift, speed_rate, volume_gain in [(0, 1.0, 3.0), (0, 1.5, 0), (0, 0.8, 0), (2.0, 1.0, 0), (-3.0, 1.2, -2.0)]:
+        start = time.perf_counter()
+        out, out_sr = pydub_effects(wav.numpy(), sr, pitch_shift, speed_rate, volume_gain)
+        pydub_time = time.perf_counter() - start
+        # warmup
+        apply_audio_effects(wav[:sr], pitch_shift, speed_rate, volume_gain, device=device)
+        start = time.perf_counter()
+        tensor_out = apply_audio_effects(wav, pitch_shift, speed_rate, volume_gain, device=device)
+        tensor_time = time.perf_counter() - start
+        print(f"pitch_shift={pitch_shift}, speed_rate={speed_rate}, volume_gain={volume_gain}: "
+              f"pydub {pydub_time:.3f}s ({out.shape[-1] / out_sr:.2f}s audio), "
+              f"tensor {tensor_time:.3f}s ({tensor_out.shape[-1] / sr:.2f}s audio), "
+              f"expected {seconds / speed_rate:.2f}s")
+        assert tensor_out.shape[-1] == int(round(wav.shape[-1] / speed_rate))
+
+    print("Test finished.")
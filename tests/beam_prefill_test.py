@@ -0,0 +1,84 @@
+import os
+import time
+
+import torch
+import torchaudio
+from omegaconf import OmegaConf
+
+from indextts.gpt.model import UnifiedVoice
+from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.feature_extractors import MelSpectrogramFeatures
+
+if __name__ == "__main__":
+    """
+    Compare `UnifiedVoice.inference_speech()` with the prefill run once per input and fanned out to the beams
+    (`GPT2InferenceModel._prefill_group_size()`) against the prefill of every beam:
+    the generated codes must match (asserted), and the prefill time is printed for both.
+    Without the gpt checkpoint, the model is randomly initialized from config.yaml.
+    ```
+    python tests/beam_prefill_test.py checkpoints
+    python tests/beam_prefill_test.py checkpoints cuda
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    device = sys.argv[2] if len(sys.argv) > 2 else "cpu"
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml")
+    gpt = UnifiedVoice(**cfg.gpt)
+    gpt_path = os.path.join(model_dir, cfg.gpt_checkpoint)
+    if os.path.exists(gpt_path):
+        load_checkpoint(gpt, gpt_path)
+    else:
+        print(f">> {gpt_path} not found, using random weights")
+    gpt = gpt.to(device).eval()
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+
+    audio, sr = torchaudio.load("tests/sample_prompt.wav")
+    audio = torch.mean(audio, dim=0, keepdim=True)
+    audio = torchaudio.transforms.Resample(sr, 24000)(audio)
+    cond_mel = MelSpectrogramFeatures()(audio).to(device)
+    with torch.no_grad():
+        conds_latent = gpt.get_conditioning(cond_mel, torch.tensor([cond_mel.shape[-1]], device=device))
+    torch.manual_seed(0)
+    text_tokens = torch.randint(0, cfg.gpt.number_text_tokens - 2, (2, 40), dtype=torch.int32, device=device)
+    long_text_tokens = torch.randint(0, cfg.gpt.number_text_tokens - 2, (1, 120), dtype=torch.int32, device=device)
+
+    def every_beam(*args):
+        return 1
+
+    for num_beams, do_sample in [(3, False), (3, True)]:
+        kwargs = {
+            "do_sample": do_sample,
+            "top_p": 0.8,
+            "top_k": 30,
+            "temperature": 1.0,
+            "num_return_sequences": 1,
+            "length_penalty": 0.0,
+            "num_beams": num_beams,
+            "repetition_penalty": 10.0,
+            "max_generate_length": 30,
+        }
+        print("--" * 10)
+        print(f"num_beams: {num_beams}, do_sample: {do_sample}")
+        outputs = {}
+        for name in ["every_beam", "shared"]:
+            if name == "every_beam":
+                gpt.inference_model._prefill_group_size = every_beam
+            else:
+                del gpt.inference_model._prefill_group_size
+            with torch.no_grad():
+                torch.manual_seed(42)
+                outputs[name] = gpt.inference_speech(None, text_tokens, conds_latent=conds_latent, **kwargs)
+                start = time.perf_counter()
+                gpt.inference_speech(None, long_text_tokens, conds_latent=conds_latent,
+                                     **{**kwargs, "max_generate_length": 1})
+                if "cuda" in device:
+                    torch.cuda.synchronize()
+                elapsed = time.perf_counter() - start
+            print(f"{name}: prefill of {long_text_tokens.shape[-1]} text tokens in {elapsed * 1000:.2f} ms")
+        assert outputs["every_beam"].equal(outputs["shared"]), \
+            f"num_beams={num_beams}, do_sample={do_sample}: codes differ with the shared prefill:\n" \
+            f"{outputs['every_beam']}\n{outputs['shared']}"
+        print("all matched")
+    print("Test finished.")
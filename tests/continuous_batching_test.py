@@ -0,0 +1,91 @@
+import os
+import time
+
+import torch
+import torchaudio
+from omegaconf import OmegaConf
+
+from indextts.gpt.continuous_batching import ContinuousBatchingEngine
+from indextts.gpt.model import UnifiedVoice
+from indextts.utils.checkpoint import load_checkpoint
+from indextts.utils.feature_extractors import MelSpectrogramFeatures
+
+if __name__ == "__main__":
+    """
+    Compare `ContinuousBatchingEngine` with `UnifiedVoice.inference_speech()` run on each sentence alone:
+    the generated codes must match. Also compares the time with bucketed static batching.
+    Without the gpt checkpoint, the model is randomly initialized from config.yaml.
+    ```
+    python tests/continuous_batching_test.py checkpoints
+    python tests/continuous_batching_test.py checkpoints cuda
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    device = sys.argv[2] if len(sys.argv) > 2 else "cpu"
+    cfg = OmegaConf.load(f"{model_dir}/config.yaml")
+    gpt = UnifiedVoice(**cfg.gpt)
+    gpt_path = os.path.join(model_dir, cfg.gpt_checkpoint)
+    if os.path.exists(gpt_path):
+        load_checkpoint(gpt, gpt_path)
+    else:
+        print(f">> {gpt_path} not found, using random weights")
+    gpt = gpt.to(device).eval()
+    gpt.post_init_gpt2_config(use_deepspeed=False, kv_cache=True, half=False)
+
+    audio, sr = torchaudio.load("tests/sample_prompt.wav")
+    audio = torch.mean(audio, dim=0, keepdim=True)
+    audio = torchaudio.transforms.Resample(sr, 24000)(audio)
+    cond_mel = MelSpectrogramFeatures()(audio).to(device)
+    with torch.no_grad():
+        # two voices: the whole prompt and its first half
+        conds = [
+            gpt.get_conditioning(cond_mel, torch.tensor([cond_mel.shape[-1]], device=device)),
+            gpt.get_conditioning(cond_mel[..., :cond_mel.shape[-1] // 2], torch.tensor([cond_mel.shape[-1] // 2], device=device)),
+        ]
+    torch.manual_seed(0)
+    sentences = [
+        (torch.randint(0, cfg.gpt.number_text_tokens - 2, (int(n),), dtype=torch.int32, device=device), conds[i % 2])
+        for i, n in enumerate(torch.randint(5, 60, (12,)))
+    ]
+
+    max_generate_length = 100
+    for num_beams in [1, 3]:
+        kwargs = {
+            "do_sample": False,
+            "num_beams": num_beams,
+            "repetition_penalty": 10.0,
+            "length_penalty": 0.0,
+        }
+        print("--" * 10)
+        print(f"num_beams: {num_beams}")
+        with torch.no_grad():
+            expected = [gpt.inference_speech(None, tokens.unsqueeze(0), conds_latent=c, max_generate_length=max_generate_length,
+                                             **kwargs) for tokens, c in sentences]
+            # static batching: buckets of 4 sentences of similar length, run until the longest one ends
+            order = sorted(range(len(sentences)), key=lambda i: sentences[i][0].shape[0])
+            start = time.perf_counter()
+            for k in range(0, len(order), 4):
+                bucket = [sentences[i] for i in order[k:k + 4]]
+                text_tokens = torch.nn.utils.rnn.pad_sequence([t for t, _ in bucket], batch_first=True,
+                                                              padding_value=gpt.stop_text_token)
+                gpt.inference_speech(None, text_tokens, conds_latent=torch.cat([c for _, c in bucket]),
+                                     max_generate_length=max_generate_length, **kwargs)
+            static_time = time.perf_counter() - start
+
+            engine = ContinuousBatchingEngine(gpt, max_batch_slots=4 * num_beams, max_generate_length=max_generate_length, **kwargs)
+            seq_ids = [engine.add_request(tokens, c) for tokens, c in sentences]
+            start = time.perf_counter()
+            results = engine.run()
+            if "cuda" in device:
+                torch.cuda.synchronize()
+            engine_time = time.perf_counter() - start
+        mismatch = [i for i, seq_id in enumerate(seq_ids) if not results[seq_id].equal(expected[i])]
+        if len(mismatch) > 0:
+            print("mismatch:", mismatch)
+        else:
+            print("all matched")
+        print(f"static batching: {static_time:.2f}s, continuous batching: {engine_time:.2f}s")
+        print("stats:", engine.stats())
+    print("Test finished.")
@@ -0,0 +1,46 @@
+import json
+import os
+
+from indextts.utils.document_normalizer import DocumentNormalizer, split_document
+from indextts.utils.front import TextNormalizer
+
+
+if __name__ == "__main__":
+    """
+    Normalize a long document serially and with `DocumentNormalizer`, check that the result does not depend
+    on the number of worker processes and print the throughput.
+    ```
+    python tests/document_normalizer_test.py
+    python tests/document_normalizer_test.py chapter.txt 8
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+        with open(sys.argv[1], "r", encoding="utf-8") as f:
+            document = f.read()
+    else:
+        with open("tests/cases.jsonl", "r", encoding="utf-8") as f:
+            texts = [json.loads(line)["text"] for line in f if line.strip()]
+        document = "\n".join(texts * 50)
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    normalizer = TextNormalizer()
+    normalizer.load()
+    print(f">> document: {len(document)} chars, {len(split_document(document))} chunks")
+
+    serial = DocumentNormalizer(normalizer, num_workers=1)
+    serial.normalize(document)
+    print(f"serial: {serial.last_stats['chars_per_sec']:.0f} chars/s")
+
+    results = []
+    for num_workers in sorted({2, max_workers}):
+        document_normalizer = DocumentNormalizer(normalizer, num_workers=num_workers)
+        document_normalizer.start()
+        results.append(document_normalizer.normalize(document))
+        stats = document_normalizer.last_stats
+        print(f"{num_workers} workers: {stats['chars_per_sec']:.0f} chars/s, {stats['elapsed']:.2f}s")
+        document_normalizer.close()
+    assert all(result == results[0] for result in results)
+    expected = " ".join(text for text in (normalizer.normalize(chunk) for chunk in split_document(document)) if text)
+    assert results[0] == expected
+    print("Test finished.")
@@ -1,12 +1,46 @@
+import os
+
 import torch
 import torchaudio
+from omegaconf import OmegaConf
+from indextts.gpt.model import UnifiedVoice
 from indextts.infer import IndexTTS
 from indextts.utils.feature_extractors import MelSpectrogramFeatures
 from torch.nn import functional as F
+from torch.nn.utils.rnn import pad_sequence
+
+
+def batched_latent_diffs(gpt: UnifiedVoice, cond_mel, text_tokens, codes, **kwargs):
+    """
+    `UnifiedVoice.forward(return_latent=True)` of each sentence alone vs. all the sentences as one padded batch.
+    Args:
+        cond_mel: the conditioning mel spectrogram, ``None`` with ``conds_latent`` in kwargs
+        text_tokens, codes: lists of (1, L) text tokens and (1, T) mel codes, of different lengths
+        kwargs: e.g. ``cond_mel_lengths`` or ``conds_latent``
+    Returns:
+        the max abs difference of the latents of each sentence
+    """
+    device = text_tokens[0].device
+    single_latents = [
+        gpt(cond_mel, t, torch.tensor([t.shape[-1]], device=device), c,
+            torch.tensor([c.shape[-1]], device=device) * gpt.mel_length_compression,
+            return_latent=True, clip_inputs=False, **kwargs)
+        for t, c in zip(text_tokens, codes)
+    ]
+    text_lens = torch.tensor([t.shape[-1] for t in text_tokens], device=device)
+    code_lens = torch.tensor([c.shape[-1] for c in codes], device=device)
+    batch_latent = gpt(cond_mel,
+                       pad_sequence([t.squeeze(0) for t in text_tokens], batch_first=True, padding_value=gpt.stop_text_token),
+                       text_lens,
+                       pad_sequence([c.squeeze(0) for c in codes], batch_first=True, padding_value=gpt.stop_mel_token),
+                       code_lens * gpt.mel_length_compression, return_latent=True, clip_inputs=False, **kwargs)
+    return [(single_latents[i][0] - batch_latent[i, :code_lens[i]]).abs().max().item() for i in range(len(codes))]
+
 
 if __name__ == "__main__":
     """
     Test the padding of text tokens in inference.
+    The batched latent pass is first checked on a small randomly initialized `UnifiedVoice` (asserted, no checkpoint needed).
     ```
     python tests/padding_test.py checkpoints
     python tests/padding_test.py IndexTTS-1.5
@@ -16,10 +50,28 @@ if __name__ == "__main__":
     transformers.set_seed(42)
     import sys
     sys.path.append("..")
+    print("single vs batched latent pass, random weights:")
+    gpt = UnifiedVoice(layers=2, model_dim=64, heads=4, max_text_tokens=60, max_mel_tokens=80, number_text_tokens=100,
+                       number_mel_codes=60, start_mel_token=58, stop_mel_token=59, condition_type="perceiver").eval()
+    with torch.no_grad():
+        conds_latent = gpt.get_conditioning(torch.randn(1, 100, 50))
+        for text_lens in [(7, 12, 4), (9, 9)]:
+            # (9, 9): no text padding, the batch runs without attention mask
+            text_tokens = [torch.randint(2, 100, (1, n)) for n in text_lens]
+            codes = [torch.randint(0, 58, (1, n)) for n in (20, 8, 14)[:len(text_lens)]]
+            diffs = batched_latent_diffs(gpt, None, text_tokens, codes, conds_latent=conds_latent)
+            print(f"text_lens: {text_lens}, max abs diff: {[round(d, 6) for d in diffs]}")
+            assert all(d <= 1e-5 for d in diffs), f"text_lens: {text_lens}, batched latents differ: {diffs}"
+    print("all matched")
+    print("--"*10)
     if len(sys.argv) > 1:
         model_dir = sys.argv[1]
     else:
         model_dir = "checkpoints"
+    gpt_path = os.path.join(model_dir, OmegaConf.load(f"{model_dir}/config.yaml").gpt_checkpoint)
+    if not os.path.exists(gpt_path):
+        print(f">> {gpt_path} not found, skip the tests with the checkpoints")
+        sys.exit(0)
     audio_prompt="tests/sample_prompt.wav"
     tts = IndexTTS(cfg_path=f"{model_dir}/config.yaml", model_dir=model_dir, is_fp16=False, use_cuda_kernel=False)
     text = "晕 XUAN4 是 一 种 not very good GAN3 觉"
@@ -96,4 +148,21 @@ if __name__ == "__main__":
     else:
         print("all matched")
     
-    print("Test finished.")
\ No newline at end of file
+    print("--"*10)
+    print("single vs batched latent pass:")
+    texts = [
+        text,
+        "There is a vehicle arriving in dock number 7?",
+        "晕 XUAN4 是 一 种 GAN3 觉",
+    ]
+    text_tokens = [torch.tensor(tts.tokenizer.encode(t), dtype=torch.int32, device=tts.device).unsqueeze(0) for t in texts]
+    with torch.no_grad():
+        codes = [tts.gpt.inference_speech(auto_conditioning, t, **kwargs) for t in text_tokens]
+        codes = [tts.remove_long_silence(c)[0] for c in codes]
+        diffs = batched_latent_diffs(tts.gpt, auto_conditioning, text_tokens, codes, cond_mel_lengths=cond_mel_lengths)
+    for i, c in enumerate(codes):
+        print(f"[{i}] code_len: {c.shape[-1]}, max abs diff: {diffs[i]:.6f}")
+    assert all(d <= 1e-4 for d in diffs), f"batched latents differ: {diffs}"
+    print("all matched")
+
+    print("Test finished.")
@@ -0,0 +1,118 @@
+import time
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from indextts.infer import IndexTTS
+
+
+def remove_long_silence_reference(codes: torch.Tensor, stop_mel_token, silent_token=52, max_consecutive=30):
+    """
+    The original per-token loop implementation of `IndexTTS.remove_long_silence`.
+    """
+    code_lens = []
+    codes_list = []
+    device = codes.device
+    isfix = False
+    for i in range(0, codes.shape[0]):
+        code = codes[i]
+        if not torch.any(code == stop_mel_token).item():
+            len_ = code.size(0)
+        else:
+            stop_mel_idx = (code == stop_mel_token).nonzero(as_tuple=False)
+            len_ = stop_mel_idx[0].item() if len(stop_mel_idx) > 0 else code.size(0)
+
+        count = torch.sum(code == silent_token).item()
+        if count > max_consecutive:
+            ncode_idx = []
+            n = 0
+            for k in range(len_):
+                assert code[k] != stop_mel_token, f"stop_mel_token {stop_mel_token} should be shrinked here"
+                if code[k] != silent_token:
+                    ncode_idx.append(k)
+                    n = 0
+                elif code[k] == silent_token and n < 10:
+                    ncode_idx.append(k)
+                    n += 1
+            len_ = len(ncode_idx)
+            codes_list.append(code[ncode_idx])
+            isfix = True
+        else:
+            codes_list.append(code[:len_])
+        code_lens.append(len_)
+    if isfix:
+        if len(codes_list) > 1:
+            codes = pad_sequence(codes_list, batch_first=True, padding_value=stop_mel_token)
+        else:
+            codes = codes_list[0].unsqueeze(0)
+    max_len = max(code_lens)
+    if max_len < codes.shape[1]:
+        codes = codes[:, :max_len]
+    code_lens = torch.tensor(code_lens, dtype=torch.long, device=device)
+    return codes, code_lens
+
+
+def random_codes(batch_size, max_len, stop_mel_token, silent_token=52, silent_prob=0.0, device="cpu"):
+    """
+    Random codes with runs of silent tokens, each row ends with stop_mel_token padding at a random length.
+    """
+    codes = torch.randint(0, 1024, (batch_size, max_len), device=device)
+    if silent_prob > 0:
+        run_starts = torch.rand(batch_size, max_len, device=device) < silent_prob / 20
+        for b, k in run_starts.nonzero().tolist():
+            codes[b, k:k + torch.randint(1, 40, (1,)).item()] = silent_token
+    for b in range(batch_size):
+        end = torch.randint(max_len // 2, max_len + 1, (1,)).item()
+        codes[b, end:] = stop_mel_token
+    return codes
+
+
+if __name__ == "__main__":
+    """
+    Check that `IndexTTS.remove_long_silence` matches the original loop implementation, and benchmark both.
+    ```
+    python tests/remove_long_silence_test.py
+    python tests/remove_long_silence_test.py cuda
+    ```
+    """
+    import sys
+    device = sys.argv[1] if len(sys.argv) > 1 else "cpu"
+    torch.manual_seed(42)
+    stop_mel_token = 8193
+    # remove_long_silence only depends on stop_mel_token, no checkpoint needed
+    tts = IndexTTS.__new__(IndexTTS)
+    tts.stop_mel_token = stop_mel_token
+
+    mismatch = []
+    cases = 0
+    for batch_size in [1, 2, 4, 8]:
+        for silent_prob in [0.0, 0.1, 0.5, 1.0]:
+            for _ in range(10):
+                codes = random_codes(batch_size, 600, stop_mel_token, silent_prob=silent_prob, device=device)
+                expected = remove_long_silence_reference(codes.clone(), stop_mel_token)
+                actual = tts.remove_long_silence(codes.clone())
+                cases += 1
+                if not (expected[0].equal(actual[0]) and expected[1].equal(actual[1])):
+                    mismatch.append((batch_size, silent_prob))
+    if len(mismatch) > 0:
+        print("mismatch:", mismatch)
+    else:
+        print(f"all matched ({cases} cases)")
+
+    print("--" * 10)
+    for batch_size in [1, 4, 16]:
+        codes = random_codes(batch_size, 600, stop_mel_token, silent_prob=0.5, device=device)
+        for name, fn in [
+            ("reference", lambda c: remove_long_silence_reference(c, stop_mel_token)),
+            ("vectorized", tts.remove_long_silence),
+        ]:
+            fn(codes)  # warmup
+            runs = 5 if name == "reference" else 100
+            start = time.perf_counter()
+            for _ in range(runs):
+                fn(codes)
+            if "cuda" in device:
+                torch.cuda.synchronize()
+            elapsed = (time.perf_counter() - start) / runs
+            print(f"batch_size: {batch_size}, {name}: {elapsed * 1000:.3f} ms")
+    print("Test finished.")
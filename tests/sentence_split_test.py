@@ -0,0 +1,64 @@
+import json
+import time
+
+import numpy as np
+
+from indextts.utils.front import TextTokenizer
+
+
+def load_texts(path="tests/cases.jsonl"):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    """
+    Compare `TextTokenizer.split_sentences` (pieces) with `split_sentences_ids` (token ids) on a book-length text:
+    the sentence boundaries must be identical.
+    ```
+    python tests/sentence_split_test.py checkpoints
+    python tests/sentence_split_test.py checkpoints 4
+    ```
+    """
+    import sys
+    sys.path.append("..")
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else "checkpoints"
+    megabytes = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    tokenizer = TextTokenizer(f"{model_dir}/bpe.model")
+    texts = load_texts()
+    # every case on its own, several sentence lengths
+    for max_tokens in (20, 60, 120):
+        for text in texts:
+            ids = tokenizer.encode(text)
+            expected = [tokenizer.convert_tokens_to_ids(sent)
+                        for sent in tokenizer.split_sentences(tokenizer.convert_ids_to_tokens(ids), max_tokens)]
+            flat, offsets = tokenizer.split_sentences_ids(ids, max_tokens)
+            actual = [flat[offsets[k]:offsets[k + 1]].tolist() for k in range(len(offsets) - 1)]
+            assert actual == expected, f"max_tokens={max_tokens}, text: {text}"
+    print(f">> {len(texts)} cases: same sentences")
+
+    # book-length input
+    book = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        for text in texts:
+            book.append(text)
+            size += len(text.encode("utf-8"))
+    book = "\n".join(book)
+    ids = tokenizer.encode(book)
+    print(f">> text: {len(book.encode('utf-8')) / 1024 / 1024:.2f} MB, {len(ids)} tokens")
+
+    start = time.perf_counter()
+    tokens = tokenizer.convert_ids_to_tokens(ids)
+    sentences = tokenizer.split_sentences(tokens, 120)
+    expected = [tokenizer.convert_tokens_to_ids(sent) for sent in sentences]
+    pieces_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    flat, offsets = tokenizer.split_sentences_ids(ids, 120)
+    ids_time = time.perf_counter() - start
+    actual = np.split(flat, offsets[1:-1]) if len(offsets) > 1 else []
+    assert len(actual) == len(expected) and all(a.tolist() == e for a, e in zip(actual, expected))
+    print(f">> {len(expected)} sentences, split_sentences + convert_tokens_to_ids: {pieces_time:.3f}s, "
+          f"split_sentences_ids: {ids_time:.3f}s ({len(ids) / ids_time / 1e6:.2f}M tokens/s)")
+    print("Test finished.")